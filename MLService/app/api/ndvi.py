@@ -1,6 +1,12 @@
 from fastapi import APIRouter, HTTPException
-from app.models.schemas import NDVIComputeRequest, NDVIComputeResponse
-from app.core.compute_ndvi import compute_ndvi_from_paths
+from app.models.schemas import (
+    NDVIComputeRequest, NDVIComputeResponse, IndicesComputeRequest, IndicesComputeResponse,
+    ZonalComputeRequest, ZonalComputeResponse,
+)
+from app.core.compute_ndvi import compute_ndvi_from_paths, compute_indices_from_paths, compute_zonal_from_paths
+from app.core.indices import normalize_indices
+from app.core.executor import compute_pool, PoolSaturated
+from app.core.preview import get_palette
 
 router = APIRouter()
 
@@ -9,14 +15,90 @@ async def compute_ndvi(payload: NDVIComputeRequest):
     """
     Compute NDVI clipped to the provided polygon.
     For production, prefer sending S3 paths and let the service read/write from S3.
+    approx=true returns a quick look (decimated / overview read) with confidence intervals.
     """
+    if payload.save_preview and payload.preview_palette:
+        try:
+            get_palette(payload.preview_palette)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        result = compute_ndvi_from_paths(
+        result = await compute_pool.run(
+            compute_ndvi_from_paths,
             red_path=payload.red_path,
             nir_path=payload.nir_path,
             polygon_geojson=payload.polygon_geojson,
-            save_preview=payload.save_preview
+            save_preview=payload.save_preview,
+            windowed=payload.windowed,
+            preview_size=payload.preview_size,
+            preview_palette=payload.preview_palette,
+            approx=payload.approx,
+            mask_path=payload.mask_path,
+            mask_values=payload.mask_values,
         )
         return result
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/indices", response_model=IndicesComputeResponse)
+async def compute_indices(payload: IndicesComputeRequest):
+    """
+    Compute several spectral indices (ndvi, gndvi, ndwi, savi, evi) clipped to the polygon in one
+    pass: each band is read once per window, so extra indices cost little beyond the reads.
+    """
+    try:
+        indices = normalize_indices(payload.indices)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not payload.band_paths and not payload.image_path:
+        raise HTTPException(status_code=400, detail="Provide band_paths and/or image_path")
+    try:
+        result = await compute_pool.run(
+            compute_indices_from_paths,
+            polygon_geojson=payload.polygon_geojson,
+            indices=indices,
+            band_paths=payload.band_paths,
+            image_path=payload.image_path,
+            band_map=payload.band_map,
+            stress_threshold=payload.stress_threshold,
+            stress_thresholds=payload.stress_thresholds,
+            reflectance_scale=payload.reflectance_scale,
+            mask_path=payload.mask_path,
+            mask_values=payload.mask_values,
+        )
+        return result
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/zonal", response_model=ZonalComputeResponse)
+async def compute_zonal(payload: ZonalComputeRequest):
+    """
+    Per-zone NDVI statistics for a FeatureCollection of farm polygons over one shared scene:
+    the scene is read once and the polygons are rasterized into a label grid instead of masking per farm.
+    """
+    try:
+        result = await compute_pool.run(
+            compute_zonal_from_paths,
+            red_path=payload.red_path,
+            nir_path=payload.nir_path,
+            feature_collection=payload.features,
+            stress_threshold=payload.stress_threshold,
+            id_property=payload.id_property,
+            mask_path=payload.mask_path,
+            mask_values=payload.mask_values,
+        )
+        return result
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,318 @@
+"""
+Durable outbox for n8n alert delivery.
+
+Alerts are written to a local SQLite file first and delivered by a single background sender,
+so a restart or crash no longer drops pending alerts and an n8n outage does not pile up
+sleeping coroutines. The sender reuses one HTTP connection pool, can batch several payloads
+per webhook call, de-duplicates by ndviReport.reportId, caps concurrent posts, and gives up on
+an alert after N8N_MAX_RETRIES attempts (it is kept as "dead" for inspection until re-submitted).
+
+Delivery is at-least-once; the backend upserts advisories by reportId, so replays are harmless.
+With several web workers every worker runs a sender on the same file: a sender claims the rows it
+is about to post (pushing them N8N_OUTBOX_CLAIM_SECONDS ahead), so the others skip them.
+
+Config (env):
+  N8N_WEBHOOK_URL, N8N_SERVICE_TOKEN, N8N_MAX_RETRIES, N8N_RETRY_BASE_SECONDS  (as before)
+  N8N_OUTBOX_PATH            sqlite file (default: data/n8n_outbox.sqlite3)
+  N8N_BATCH_SIZE             payloads per webhook call; >1 posts a JSON array (default: 1)
+  N8N_MAX_CONCURRENCY        concurrent webhook calls (default: 4)
+  N8N_OUTBOX_POLL_SECONDS    max idle wait between scans (default: 5)
+  N8N_OUTBOX_RETENTION_HOURS how long sent rows are kept for de-duplication (default: 72)
+  N8N_OUTBOX_PURGE_SECONDS   how often the sender deletes sent rows past retention (default: 3600)
+  N8N_OUTBOX_CLAIM_SECONDS   how long claimed rows stay hidden from other senders (default: 60)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger("ml_service")
+
+N8N_WEBHOOK = os.getenv("N8N_WEBHOOK_URL")  # e.g. https://localhost:5678/webhook/ndvi-alert
+N8N_SERVICE_TOKEN = os.getenv("N8N_SERVICE_TOKEN")  # optional, for your webhook auth
+N8N_MAX_RETRIES = int(os.getenv("N8N_MAX_RETRIES", "3"))
+N8N_RETRY_BASE_SECONDS = float(os.getenv("N8N_RETRY_BASE_SECONDS", "1.0"))
+
+N8N_OUTBOX_PATH = os.getenv("N8N_OUTBOX_PATH", os.path.join("data", "n8n_outbox.sqlite3"))
+N8N_BATCH_SIZE = max(1, int(os.getenv("N8N_BATCH_SIZE", "1")))
+N8N_MAX_CONCURRENCY = max(1, int(os.getenv("N8N_MAX_CONCURRENCY", "4")))
+N8N_OUTBOX_POLL_SECONDS = float(os.getenv("N8N_OUTBOX_POLL_SECONDS", "5"))
+N8N_OUTBOX_RETENTION_HOURS = float(os.getenv("N8N_OUTBOX_RETENTION_HOURS", "72"))
+N8N_OUTBOX_CLAIM_SECONDS = float(os.getenv("N8N_OUTBOX_CLAIM_SECONDS", "60"))
+N8N_OUTBOX_PURGE_SECONDS = float(os.getenv("N8N_OUTBOX_PURGE_SECONDS", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    report_id       TEXT PRIMARY KEY,
+    payload         TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',  -- pending | sent | dead
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL,
+    last_error      TEXT
+);
+CREATE INDEX IF NOT EXISTS alerts_due ON alerts (status, next_attempt_at);
+"""
+
+
+class AlertOutbox:
+    """SQLite-backed queue of n8n payloads plus the worker that drains it."""
+
+    def __init__(self, path: str = N8N_OUTBOX_PATH, webhook_url: Optional[str] = N8N_WEBHOOK):
+        self.path = path
+        self.webhook_url = webhook_url
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.deduplicated = 0
+        self.webhook_calls = 0
+
+    # ---------- storage (sync, run via asyncio.to_thread) ----------
+    def _open(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params=()):
+        with self._db_lock:
+            return self._open().execute(sql, params).fetchall()
+
+    def _insert(self, report_id: str, payload: dict) -> bool:
+        return self._insert_many([(report_id, payload)]) == 1
+
+    def _insert_many(self, items) -> int:
+        now = time.time()
+        inserted = 0
+        with self._db_lock:
+            db = self._open()
+            db.execute("BEGIN")
+            try:
+                for report_id, payload in items:
+                    inserted += self._upsert(db, report_id, payload, now)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return inserted
+
+    @staticmethod
+    def _upsert(db, report_id: str, payload: dict, now: float) -> int:
+        cur = db.execute(
+            "INSERT INTO alerts (report_id, payload, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+            # a re-submitted alert that previously exhausted its retries gets a fresh budget
+            "ON CONFLICT(report_id) DO UPDATE SET status = 'pending', attempts = 0, payload = excluded.payload, "
+            "next_attempt_at = excluded.next_attempt_at, updated_at = excluded.updated_at WHERE alerts.status = 'dead'",
+            (report_id, json.dumps(payload), now, now, now),
+        )
+        return cur.rowcount
+
+    def _due(self, limit: int):
+        """Claim up to limit due rows: they stay pending, but other senders skip them until the claim expires."""
+        now = time.time()
+        with self._db_lock:
+            db = self._open()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = db.execute(
+                    "SELECT report_id, payload, attempts FROM alerts WHERE status = 'pending' AND next_attempt_at <= ? "
+                    "ORDER BY next_attempt_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                db.executemany(
+                    "UPDATE alerts SET next_attempt_at = ? WHERE report_id = ?",
+                    [(now + N8N_OUTBOX_CLAIM_SECONDS, report_id) for report_id, _, _ in rows],
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _seconds_until_next_due(self) -> Optional[float]:
+        rows = self._execute("SELECT MIN(next_attempt_at) FROM alerts WHERE status = 'pending'")
+        if not rows or rows[0][0] is None:
+            return None
+        return max(0.0, rows[0][0] - time.time())
+
+    def _mark_sent(self, report_ids):
+        now = time.time()
+        with self._db_lock:
+            self._open().executemany(
+                "UPDATE alerts SET status = 'sent', attempts = attempts + 1, updated_at = ?, last_error = NULL WHERE report_id = ?",
+                [(now, rid) for rid in report_ids],
+            )
+
+    def _mark_failed(self, rows, error: str):
+        now = time.time()
+        updates = []
+        for report_id, _, attempts in rows:
+            attempts += 1
+            status = "dead" if attempts >= N8N_MAX_RETRIES else "pending"
+            backoff = N8N_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            updates.append((status, attempts, now + backoff, now, error[:500], report_id))
+        with self._db_lock:
+            self._open().executemany(
+                "UPDATE alerts SET status = ?, attempts = ?, next_attempt_at = ?, updated_at = ?, last_error = ? WHERE report_id = ?",
+                updates,
+            )
+
+    def _purge(self) -> int:
+        cutoff = time.time() - N8N_OUTBOX_RETENTION_HOURS * 3600
+        with self._db_lock:
+            return self._open().execute("DELETE FROM alerts WHERE status = 'sent' AND updated_at < ?", (cutoff,)).rowcount
+
+    # ---------- public API ----------
+    async def enqueue(self, payload: dict) -> dict:
+        """
+        Persist a payload for delivery. Payloads sharing an ndviReport.reportId are sent once.
+        """
+        if not self.webhook_url:
+            logger.info("N8N_WEBHOOK_URL not set — skipping n8n alert")
+            return {"queued": False, "reason": "no_webhook_configured"}
+        report_id = (payload.get("ndviReport") or {}).get("reportId")
+        if not report_id:
+            raise ValueError("n8n payload needs ndviReport.reportId for de-duplication")
+        inserted = await asyncio.to_thread(self._insert, report_id, payload)
+        if not inserted:
+            self.deduplicated += 1
+            return {"queued": False, "reason": "duplicate", "reportId": report_id}
+        if self._wake is not None:
+            self._wake.set()
+        return {"queued": True, "reportId": report_id}
+
+    async def enqueue_many(self, payloads) -> dict:
+        """
+        Persist several payloads in one transaction (used by batch endpoints).
+        """
+        if not self.webhook_url:
+            logger.info("N8N_WEBHOOK_URL not set — skipping n8n alerts")
+            return {"queued": 0, "reason": "no_webhook_configured"}
+        items = {}
+        for payload in payloads:
+            report_id = (payload.get("ndviReport") or {}).get("reportId")
+            if not report_id:
+                raise ValueError("n8n payload needs ndviReport.reportId for de-duplication")
+            items[report_id] = payload
+        inserted = await asyncio.to_thread(self._insert_many, list(items.items())) if items else 0
+        self.deduplicated += len(payloads) - inserted
+        if inserted and self._wake is not None:
+            self._wake.set()
+        return {"queued": inserted, "duplicates": len(payloads) - inserted}
+
+    async def start(self):
+        if not self.webhook_url or self._worker is not None:
+            return
+        await asyncio.to_thread(self._open)
+        headers = {"Content-Type": "application/json"}
+        if N8N_SERVICE_TOKEN:
+            headers["X-Service-Token"] = N8N_SERVICE_TOKEN
+        self._client = httpx.AsyncClient(
+            verify=False,
+            timeout=10.0,
+            headers=headers,
+            limits=httpx.Limits(max_connections=N8N_MAX_CONCURRENCY, max_keepalive_connections=N8N_MAX_CONCURRENCY),
+        )
+        self._wake = asyncio.Event()
+        self._worker = asyncio.create_task(self._run(), name="n8n-outbox")
+        logger.info(f"n8n outbox started ({self.path}, batch={N8N_BATCH_SIZE}, concurrency={N8N_MAX_CONCURRENCY})")
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        counts = {"pending": 0, "sent": 0, "dead": 0}
+        if self._db is not None or os.path.exists(self.path):
+            for status, n in self._execute("SELECT status, COUNT(*) FROM alerts GROUP BY status"):
+                counts[status] = n
+        return {
+            **counts,
+            "deduplicated": self.deduplicated,
+            "webhook_calls": self.webhook_calls,
+            "batch_size": N8N_BATCH_SIZE,
+            "max_concurrency": N8N_MAX_CONCURRENCY,
+            "worker_running": self._worker is not None and not self._worker.done(),
+        }
+
+    # ---------- sender ----------
+    async def _post(self, rows):
+        body = [json.loads(p) for _, p, _ in rows]
+        content = body[0] if N8N_BATCH_SIZE == 1 else body
+        self.webhook_calls += 1
+        try:
+            r = await self._client.post(self.webhook_url, json=content)
+        except Exception as e:
+            logger.warning(f"n8n delivery failed for {len(rows)} alert(s): {e}")
+            await asyncio.to_thread(self._mark_failed, rows, str(e))
+            return
+        if 200 <= r.status_code < 300:
+            logger.info(f"n8n accepted {len(rows)} alert(s) (status={r.status_code})")
+            await asyncio.to_thread(self._mark_sent, [rid for rid, _, _ in rows])
+        else:
+            logger.warning(f"n8n returned status {r.status_code}: {r.text}")
+            await asyncio.to_thread(self._mark_failed, rows, f"status {r.status_code}: {r.text}")
+
+    async def _drain_once(self) -> int:
+        rows = await asyncio.to_thread(self._due, N8N_BATCH_SIZE * N8N_MAX_CONCURRENCY)
+        if not rows:
+            return 0
+        batches = [rows[i:i + N8N_BATCH_SIZE] for i in range(0, len(rows), N8N_BATCH_SIZE)]
+        await asyncio.gather(*(self._post(batch) for batch in batches))
+        return len(rows)
+
+    async def _run(self):
+        next_purge = 0.0
+        while True:
+            self._wake.clear()
+            try:
+                # a long-running sender would otherwise keep every sent row forever
+                if time.monotonic() >= next_purge:
+                    next_purge = time.monotonic() + N8N_OUTBOX_PURGE_SECONDS
+                    purged = await asyncio.to_thread(self._purge)
+                    if purged:
+                        logger.info(f"n8n outbox: purged {purged} sent alert(s) past retention")
+                if await self._drain_once():
+                    continue
+                wait = await asyncio.to_thread(self._seconds_until_next_due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("n8n outbox drain failed")
+                wait = None
+            timeout = N8N_OUTBOX_POLL_SECONDS if wait is None else min(wait, N8N_OUTBOX_POLL_SECONDS)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+alert_outbox = AlertOutbox()
@@ -0,0 +1,97 @@
+"""
+Binary band ingest for /v1/ndvi/compute.
+
+Bands can be uploaded as:
+  - .npy files (any numeric dtype, C or Fortran order), detected by the NPY magic bytes,
+  - raw little-endian buffers, with form fields array_dtype ("float32" | "uint16") and array_shape ("H,W"),
+  - a single stacked buffer of shape (2, H, W) holding [nir, red] (.npy or raw with array_shape "2,H,W").
+
+Decoding wraps the uploaded bytes with np.frombuffer, so the band arrays are read-only views
+of the request body rather than copies.
+"""
+
+import io
+from typing import Optional
+
+import numpy as np
+
+NPY_MAGIC = b"\x93NUMPY"
+RAW_DTYPES = {"float32": np.dtype("<f4"), "uint16": np.dtype("<u2")}
+# the .npy header is padded to a multiple of 64 bytes and rarely exceeds a few hundred
+_NPY_HEADER_PROBE = 65536 + 16
+
+
+def is_npy(buf) -> bool:
+    return bytes(memoryview(buf)[: len(NPY_MAGIC)]) == NPY_MAGIC
+
+
+def parse_array_shape(shape: Optional[str]) -> tuple:
+    """Parse "H,W" / "2,H,W" (also accepts 'x' separators) into a tuple of positive ints."""
+    if not shape:
+        raise ValueError("array_shape is required for raw buffers")
+    try:
+        dims = tuple(int(d) for d in shape.replace("x", ",").split(",") if d.strip())
+    except ValueError:
+        raise ValueError(f"invalid array_shape {shape!r}")
+    if not dims or any(d <= 0 for d in dims):
+        raise ValueError(f"invalid array_shape {shape!r}")
+    return dims
+
+
+def describe_binary_array(buf, dtype: Optional[str] = None, shape: Optional[str] = None):
+    """
+    Validate a binary buffer without decoding it.
+    Returns (dtype, shape, data_offset, fortran_order).
+    """
+    mv = memoryview(buf)
+    if is_npy(mv):
+        fp = io.BytesIO(bytes(mv[:_NPY_HEADER_PROBE]))
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            arr_shape, fortran, arr_dtype = np.lib.format.read_array_header_1_0(fp)
+        elif version in ((2, 0), (3, 0)):
+            arr_shape, fortran, arr_dtype = np.lib.format.read_array_header_2_0(fp)
+        else:
+            raise ValueError(f"unsupported .npy version {version}")
+        if arr_dtype.hasobject or arr_dtype.kind not in "uif":
+            raise ValueError(f"unsupported .npy dtype {arr_dtype}")
+        offset = fp.tell()
+    else:
+        if dtype not in RAW_DTYPES:
+            raise ValueError(f"array_dtype must be one of {sorted(RAW_DTYPES)} for raw buffers")
+        arr_dtype = RAW_DTYPES[dtype]
+        arr_shape = parse_array_shape(shape)
+        fortran, offset = False, 0
+
+    expected = int(np.prod(arr_shape)) * arr_dtype.itemsize
+    if len(mv) - offset != expected:
+        raise ValueError(f"buffer holds {len(mv) - offset} bytes, expected {expected} for {arr_shape} {arr_dtype}")
+    if len(arr_shape) not in (2, 3):
+        raise ValueError(f"expected a 2D band or a stacked (2, H, W) array, got shape {arr_shape}")
+    return arr_dtype, tuple(arr_shape), offset, fortran
+
+
+def decode_binary_array(buf, dtype: Optional[str] = None, shape: Optional[str] = None) -> np.ndarray:
+    """Zero-copy decode of a .npy or raw buffer into a read-only ndarray view."""
+    arr_dtype, arr_shape, offset, fortran = describe_binary_array(buf, dtype, shape)
+    flat = np.frombuffer(buf, dtype=arr_dtype, count=int(np.prod(arr_shape)), offset=offset)
+    return flat.reshape(arr_shape, order="F" if fortran else "C")
+
+
+def split_stacked_bands(arr: np.ndarray):
+    """Split a stacked (2, H, W) [nir, red] array into two views."""
+    if arr.ndim != 3 or arr.shape[0] != 2:
+        raise ValueError(f"stacked bands must have shape (2, H, W), got {arr.shape}")
+    return arr[0], arr[1]
+
+
+def band_to_float(arr: np.ndarray) -> np.ndarray:
+    """
+    Convert a decoded band to float32 in 0..1. Integer bands are scaled by their dtype
+    range (one unavoidable copy); float32 input is returned as-is.
+    """
+    if arr.dtype.kind in "ui":
+        out = arr.astype(np.float32)
+        out *= np.float32(1.0 / np.iinfo(arr.dtype).max)
+        return out
+    return arr.astype(np.float32, copy=False)
@@ -4,79 +4,381 @@ NDVI computation helper.
 This file tries to use rasterio/geopandas if available (recommended for real data).
 If rasterio is not available (quick dev), it falls back to a simple PIL-based loader
 which is only suitable for small test images where 'red' and 'nir' are supplied as greyscale PNGs.
+
+Only valid pixels are computed: inside the polygon (or zone), not nodata / NaN in any band (nor
+outside a band's internal or alpha mask), and not flagged by the optional cloud / quality mask
+raster (mask_path: nonzero pixels, or the pixels equal to one of mask_values, e.g. Sentinel-2
+SCL classes 3, 8, 9, 10). Valid pixels are compacted before the NDVI math, windows without any
+are skipped before the bands are read where possible, and results report valid_pixel_count,
+area_pixel_count and coverage_fraction.
 """
 
+import math
+import os
+from contextlib import ExitStack, contextmanager
+
 import numpy as np
 import warnings
 
-# Try to import rasterio and shapely; if not present, we use fallback
-try:
-    import rasterio
-    from rasterio.mask import mask
-    from shapely.geometry import shape, mapping
-    HAS_RASTERIO = True
-except Exception:
-    HAS_RASTERIO = False
-
 from app.core.utils import to_png_base64
+from app.core.preview import NDVI_PREVIEW_SIZE
+from app.core.ndvi_stats import NDVIStatsAccumulator, combine_masks, compute_ndvi_stats, coverage, ndvi_chunk
+from app.core.indices import IndexAccumulators, compute_index_stats, normalize_indices, required_bands
+from app.core.zonal import ZonalAccumulator
+from app.core.remote_source import is_remote, open_remote_raster, prefetch_window, summarize_io
+from app.core.coregister import Grid, aligned, reference_source, source_of
+from app.core.quicklook import NDVI_QUICK_SAMPLE_PIXELS, approx_mode, sample_estimates
+from app.core.serving import module_available
+
+# rasterio and shapely are imported inside the functions that use them (importing GDAL costs
+# ~0.2 s, paid by the serving process up front instead, see app.core.serving); without them we
+# use the PIL fallback
+HAS_RASTERIO = module_available("rasterio") and module_available("shapely")
+
+# windowed (streaming) mode: used automatically when the polygon's bounding window exceeds
+# NDVI_WINDOWED_MIN_PIXELS; each step reads roughly NDVI_WINDOW_TARGET_PIXELS pixels per band.
+WINDOWED_MIN_PIXELS = int(os.getenv("NDVI_WINDOWED_MIN_PIXELS", str(4096 * 4096)))
+WINDOW_TARGET_PIXELS = int(os.getenv("NDVI_WINDOW_TARGET_PIXELS", str(1024 * 1024)))
+PREVIEW_MAX_SIDE = 512
+# band order of a multi-band image when no band_map is given (4-band B, G, R, NIR products)
+DEFAULT_BAND_MAP = {"blue": 1, "green": 2, "red": 3, "nir": 4}
+
+
+@contextmanager
+def _open_raster(path, io_sessions=None):
+    """
+    rasterio dataset for a local path, or for an s3:// / http(s):// path through the range-read
+    layer (app.core.remote_source); remote sessions are appended to io_sessions for I/O stats.
+    """
+    if is_remote(path):
+        with open_remote_raster(path) as (src, session):
+            if io_sessions is not None:
+                io_sessions.append(session)
+            yield src
+    else:
+        import rasterio
+
+        with rasterio.open(path) as src:
+            yield src
+
+
+def _prefetch(io_sessions, src, window, geometry=None):
+    """
+    Fetch the remote blocks of src overlapping window (and geometry) in coalesced concurrent requests.
+    src may be an aligned (warped) view: the covering window of the underlying raster is fetched.
+    """
+    if not io_sessions:
+        return
+    src, plan = source_of(src)
+    if plan is not None:
+        window = plan.source_window(window)
+        geometry = geometry if plan.same_crs else None
+    for session in io_sessions:
+        if session.dataset is src:
+            prefetch_window(src, session, window, geometry)
+
+
+def _valid_pixels(src, data, window=None, bidx=1, out_shape=None):
+    """
+    Pixels of data (band bidx of src, read over window) that hold a value: not nodata / NaN and
+    inside the dataset's own mask (alpha band or internal mask). None when every pixel is valid.
+    """
+    from rasterio.enums import MaskFlags
+
+    flags = src.mask_flag_enums[bidx - 1]
+    if MaskFlags.per_dataset in flags or MaskFlags.alpha in flags:
+        return src.read_masks(bidx, window=window, out_shape=out_shape) > 0
+    nodata = src.nodatavals[bidx - 1]
+    finite = np.isfinite(data) if data.dtype.kind == "f" else None
+    if nodata is None or np.isnan(nodata):
+        return finite
+    return combine_masks(data != nodata, finite)
+
+
+@contextmanager
+def _pixel_mask(mask_path, reference, io_sessions=None):
+    """The cloud / quality mask raster on the reference grid (nearest neighbour), or None."""
+    if not mask_path:
+        yield None
+        return
+    with _open_raster(mask_path, io_sessions) as raw, aligned(raw, Grid.of(reference), "nearest") as view:
+        yield view
+
+
+def _unmasked(mask_src, mask_values, window, out_shape=None):
+    """Pixels the cloud / quality mask keeps: zero, or not one of mask_values. None without a mask."""
+    if mask_src is None:
+        return None
+    from rasterio.enums import Resampling
+
+    flags = mask_src.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+    if mask_values:
+        return ~np.isin(flags, mask_values)
+    return flags == 0
+
 
-def compute_ndvi_from_paths(red_path, nir_path, polygon_geojson, save_preview=True, stress_threshold=0.3):
+@contextmanager
+def _aligned_pair(src_red, src_nir):
+    """(red, nir) views on a common grid: the finer band's, the other one warped onto it."""
+    ref = Grid.of(reference_source((src_red, src_nir)))
+    with aligned(src_red, ref) as red, aligned(src_nir, ref) as nir:
+        yield red, nir
+
+
+def _with_io(result, io_sessions):
+    io_stats = summarize_io(io_sessions)
+    if io_stats:
+        result["io"] = io_stats
+    return result
+
+
+def compute_ndvi_from_paths(red_path, nir_path, polygon_geojson, save_preview=True, stress_threshold=0.3, windowed=None,
+                            preview_size=None, preview_palette=None, approx=None, mask_path=None, mask_values=None):
     """
     red_path, nir_path: local paths or URLs (for now we support local filesystem).
     polygon_geojson: GeoJSON mapping (Polygon or MultiPolygon) in same coordinate system as raster.
+    windowed: True forces the block-streaming engine, False forces full in-memory masking,
+              None picks streaming for large polygon windows.
+    preview_size / preview_palette: side of the square preview and its palette (see app.core.preview).
+    approx: truthy for a quick look from a decimated read (see _compute_ndvi_rasterio_quicklook).
+    mask_path / mask_values: optional cloud / quality mask raster (see the module docstring).
     Returns summary dict.
     """
 
+    preview = {"size": preview_size, "palette": preview_palette} if save_preview else None
+    masks = {"mask_path": mask_path, "mask_values": mask_values}
     if HAS_RASTERIO:
-        return _compute_ndvi_rasterio(red_path, nir_path, polygon_geojson, save_preview, stress_threshold)
+        if approx_mode(approx):
+            return _compute_ndvi_rasterio_quicklook(red_path, nir_path, polygon_geojson, preview, stress_threshold, **masks)
+        if windowed is None:
+            windowed = _polygon_window_pixels(red_path, polygon_geojson) > WINDOWED_MIN_PIXELS
+        if windowed:
+            return _compute_ndvi_rasterio_windowed(red_path, nir_path, polygon_geojson, preview, stress_threshold, **masks)
+        return _compute_ndvi_rasterio(red_path, nir_path, polygon_geojson, preview, stress_threshold, **masks)
     else:
         warnings.warn("rasterio not available — using simplified PIL fallback (for small images only)")
-        return _compute_ndvi_pil(red_path, nir_path, polygon_geojson, save_preview, stress_threshold)
+        return _compute_ndvi_pil(red_path, nir_path, polygon_geojson, preview, stress_threshold)
 
 
-def _compute_ndvi_rasterio(red_path, nir_path, polygon_geojson, save_preview, stress_threshold):
+def _compute_ndvi_rasterio(red_path, nir_path, polygon_geojson, preview, stress_threshold, mask_path=None,
+                           mask_values=None):
     import rasterio
-    from rasterio.mask import mask
-    from shapely.geometry import shape, mapping
+    from shapely.geometry import shape
 
-    # Open red and nir as rasters; they must have same shape/transform/CRS in realistic scenarios.
-    with rasterio.open(red_path) as src_red, rasterio.open(nir_path) as src_nir:
-        # quick sanity check
-        if src_red.shape != src_nir.shape:
-            # Not always required (bands, transforms). We proceed but users should ensure alignment.
-            pass
+    from rasterio.features import geometry_mask, geometry_window
+    from shapely.prepared import prep
 
+    io_sessions = []
+    # Open red and nir as rasters; bands on different grids are co-registered onto the finer one
+    with _open_raster(red_path, io_sessions) as red_raster, _open_raster(nir_path, io_sessions) as nir_raster, \
+            _aligned_pair(red_raster, nir_raster) as (src_red, src_nir), \
+            _pixel_mask(mask_path, reference_source((red_raster, nir_raster)), io_sessions) as cloud:
         geom = [polygon_geojson]
-        # mask both rasters to polygon
-        red_clip, _ = mask(src_red, geom, crop=True, filled=True)
-        nir_clip, _ = mask(src_nir, geom, crop=True, filled=True)
+        # the polygon's bounding window (what mask(crop=True) used to read)
+        window = geometry_window(src_nir, geom)
+        if io_sessions:
+            poly = prep(shape(polygon_geojson))
+            for src in (src_red, src_nir) + ((cloud,) if cloud is not None else ()):
+                _prefetch(io_sessions, src, window, poly)
+        h, w = int(window.height), int(window.width)
+        inside = geometry_mask(geom, out_shape=(h, w), transform=src_nir.window_transform(window), invert=True)
+        valid = combine_masks(inside, _unmasked(cloud, mask_values, window))
 
-        # convert to float and compute NDVI bandwise (handle multiple bands by taking band 1)
-        red = red_clip[0].astype('float32')
-        nir = nir_clip[0].astype('float32')
-        denom = (nir + red)
-        denom[denom == 0] = 1e-6
-        ndvi = (nir - red) / denom
-
-        mean_ndvi = float(np.nanmean(ndvi))
-        median_ndvi = float(np.nanmedian(ndvi))
-        pct_stress = float((ndvi < stress_threshold).sum() / ndvi.size)
+        # band 1 of each raster; the stats kernel compacts the valid pixels and promotes them to
+        # float32 chunk by chunk, so no full-size float copies of the bands are made
+        red = src_red.read(1, window=window)
+        nir = src_nir.read(1, window=window)
+        valid = combine_masks(valid, _valid_pixels(src_red, red, window), _valid_pixels(src_nir, nir, window))
+        ndvi = np.empty(nir.shape, dtype=np.float32) if preview else None
+        result = compute_ndvi_stats(nir, red, stress_threshold, ndvi_out=ndvi, valid=valid)
+        result.update(coverage(result["valid_pixel_count"], np.count_nonzero(inside)))
 
         preview_b64 = None
-        if save_preview:
-            preview_b64 = to_png_base64(ndvi)
-
-        return {
-            "mean_ndvi": mean_ndvi,
-            "median_ndvi": median_ndvi,
-            "pct_stress": pct_stress,
-            "stress_threshold": stress_threshold,
+        if preview:
+            preview_b64 = _preview_base64(ndvi, preview)
+
+        result.update({
             "preview_png_base64": preview_b64,
             "message": "computed with rasterio"
-        }
+        })
+    return _with_io(result, io_sessions)
+
+
+def _polygon_window_pixels(raster_path, polygon_geojson):
+    """Pixel count of the raster window bounding the polygon (header-only read)."""
+    import rasterio
+    from rasterio.features import geometry_window
+
+    with _open_raster(raster_path) as src:
+        win = geometry_window(src, [polygon_geojson])
+        return int(win.width) * int(win.height)
+
+
+def _iter_block_windows(src, bounds_window, target_pixels=WINDOW_TARGET_PIXELS):
+    """
+    Yield windows aligned to the raster's native block grid that cover bounds_window.
+    Small blocks (e.g. one-row strips) are grouped into block-aligned multiples of
+    about target_pixels so per-read overhead stays low.
+    """
+    from rasterio.windows import Window
+
+    block_h, block_w = src.block_shapes[0]
+    block_px = max(1, block_h * block_w)
+    if block_w >= src.width:
+        # striped layout: grow vertically only
+        step_h, step_w = block_h * max(1, target_pixels // block_px), block_w
+    else:
+        mult = max(1, int(math.sqrt(target_pixels / block_px)))
+        step_h, step_w = block_h * mult, block_w * mult
+
+    r0 = max(0, int(bounds_window.row_off))
+    c0 = max(0, int(bounds_window.col_off))
+    r1 = min(src.height, int(math.ceil(bounds_window.row_off + bounds_window.height)))
+    c1 = min(src.width, int(math.ceil(bounds_window.col_off + bounds_window.width)))
+
+    for row in range((r0 // step_h) * step_h, r1, step_h):
+        top, bottom = max(row, r0), min(row + step_h, r1)
+        for col in range((c0 // step_w) * step_w, c1, step_w):
+            left, right = max(col, c0), min(col + step_w, c1)
+            yield Window(left, top, right - left, bottom - top)
+
+
+def _preview_base64(ndvi, preview):
+    size = int(preview.get("size") or NDVI_PREVIEW_SIZE)
+    return to_png_base64(ndvi, size=(size, size), palette=preview.get("palette"))
+
+
+def _decimated_ndvi(src_red, src_nir, window, max_side=PREVIEW_MAX_SIDE):
+    """Low-resolution NDVI over window for previews, read with on-the-fly decimation."""
+    from rasterio.enums import Resampling
+
+    scale = max(window.height, window.width) / float(max_side)
+    if scale > 1:
+        out_shape = (max(1, int(window.height / scale)), max(1, int(window.width / scale)))
+    else:
+        out_shape = (int(window.height), int(window.width))
+    red = src_red.read(1, window=window, out_shape=out_shape, resampling=Resampling.average).astype('float32')
+    nir = src_nir.read(1, window=window, out_shape=out_shape, resampling=Resampling.average).astype('float32')
+    denom = (nir + red)
+    denom[denom == 0] = 1e-6
+    return (nir - red) / denom
+
+
+def _compute_ndvi_rasterio_windowed(red_path, nir_path, polygon_geojson, preview, stress_threshold, mask_path=None,
+                                    mask_values=None):
+    """
+    Streaming variant of _compute_ndvi_rasterio: walks block windows intersecting the
+    polygon, reads one window of each band at a time and accumulates stats, so peak
+    memory depends on the block size rather than on the scene or polygon size.
+    Only valid pixels reach the stats; the cloud mask is read first, so fully masked
+    blocks are skipped without reading the bands.
+    """
+    import rasterio
+    from rasterio.features import geometry_mask, geometry_window
+    from rasterio.windows import bounds as window_bounds
+    from shapely.geometry import shape, box
+    from shapely.prepared import prep
+
+    io_sessions = []
+    with _open_raster(red_path, io_sessions) as red_raster, _open_raster(nir_path, io_sessions) as nir_raster, \
+            _aligned_pair(red_raster, nir_raster) as (src_red, src_nir), \
+            _pixel_mask(mask_path, reference_source((red_raster, nir_raster)), io_sessions) as cloud:
+        # block windows follow the reference band's native layout
+        ref = reference_source((red_raster, nir_raster))
+        poly = prep(shape(polygon_geojson))
+        poly_window = geometry_window(ref, [polygon_geojson])
+        acc = NDVIStatsAccumulator(stress_threshold)
+        blocks_read = blocks_skipped = polygon_pixels = valid_pixels = 0
+
+        for win in _iter_block_windows(ref, poly_window):
+            if not poly.intersects(box(*window_bounds(win, ref.transform))):
+                continue
+            h, w = int(win.height), int(win.width)
+            inside = geometry_mask([polygon_geojson], out_shape=(h, w),
+                                   transform=ref.window_transform(win), invert=True)
+            area = np.count_nonzero(inside)
+            if not area:
+                continue
+            polygon_pixels += area
+            if cloud is not None:
+                _prefetch(io_sessions, cloud, win, poly)
+                inside &= _unmasked(cloud, mask_values, win)
+                if not inside.any():
+                    blocks_skipped += 1
+                    continue
+            _prefetch(io_sessions, src_red, win, poly)
+            _prefetch(io_sessions, src_nir, win, poly)
+            red = src_red.read(1, window=win)
+            nir = src_nir.read(1, window=win)
+            valid = combine_masks(inside, _valid_pixels(src_red, red, win), _valid_pixels(src_nir, nir, win))
+            red, nir = red[valid], nir[valid]
+            blocks_read += 1
+            valid_pixels += nir.size
+
+            ndvi = np.empty(nir.size, dtype=np.float32)
+            acc.add(ndvi_chunk(nir, red, ndvi, np.empty_like(ndvi)))
+
+        preview_b64 = None
+        if preview:
+            preview_b64 = _preview_base64(_decimated_ndvi(src_red, src_nir, poly_window), preview)
+
+    result = acc.result()
+    result.update(coverage(valid_pixels, polygon_pixels))
+    result.update({
+        "preview_png_base64": preview_b64,
+        "message": f"computed with rasterio (windowed, {blocks_read} blocks, {blocks_skipped} fully masked)",
+    })
+    return _with_io(result, io_sessions)
 
 
-def _compute_ndvi_pil(red_path, nir_path, polygon_geojson, save_preview, stress_threshold):
+def _compute_ndvi_rasterio_quicklook(red_path, nir_path, polygon_geojson, preview, stress_threshold,
+                                     sample_pixels=NDVI_QUICK_SAMPLE_PIXELS, mask_path=None, mask_values=None):
+    """
+    Quick look: one nearest-neighbour decimated read per band over the polygon window, sized to
+    about sample_pixels pixels. That is a strided sample of the polygon, and GDAL serves it from
+    the overviews when the file has them, so only a few blocks are read. Stats are estimated
+    with confidence intervals (app.core.quicklook); a polygon smaller than the sample is read
+    at full resolution and its stats are exact. Validity masks are read at the same decimation,
+    so coverage is estimated from the sample too.
+    """
+    from rasterio.enums import Resampling
+    from rasterio.features import geometry_mask, geometry_window
+    from rasterio.transform import Affine
+
+    io_sessions = []
+    with _open_raster(red_path, io_sessions) as red_raster, _open_raster(nir_path, io_sessions) as nir_raster, \
+            _aligned_pair(red_raster, nir_raster) as (src_red, src_nir), \
+            _pixel_mask(mask_path, reference_source((red_raster, nir_raster)), io_sessions) as cloud:
+        ref = reference_source((red_raster, nir_raster))
+        window = geometry_window(ref, [polygon_geojson])
+        h, w = int(window.height), int(window.width)
+        scale = max(1.0, math.sqrt(h * w / float(sample_pixels)))
+        out_shape = (max(1, int(round(h / scale))), max(1, int(round(w / scale))))
+        cell_h, cell_w = h / out_shape[0], w / out_shape[1]
+        inside = geometry_mask([polygon_geojson], out_shape=out_shape, invert=True,
+                               transform=ref.window_transform(window) * Affine.scale(cell_w, cell_h))
+        red = src_red.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+        nir = src_nir.read(1, window=window, out_shape=out_shape, resampling=Resampling.nearest)
+        valid = combine_masks(inside, _unmasked(cloud, mask_values, window, out_shape),
+                              _valid_pixels(src_red, red, window, out_shape=out_shape),
+                              _valid_pixels(src_nir, nir, window, out_shape=out_shape))
+        overviews = ref.overviews(1)
+        method = "overview" if overviews and scale >= min(overviews) else ("strided" if scale > 1 else "full")
+
+    ndvi = ndvi_chunk(nir, red, np.empty(out_shape, dtype=np.float32), np.empty(out_shape, dtype=np.float32))
+    values = ndvi[valid]
+    result = sample_estimates(values, stress_threshold, int(round(values.size * cell_h * cell_w)), method)
+    result.update(coverage(result["approximate"]["population_pixels"],
+                           int(round(np.count_nonzero(inside) * cell_h * cell_w))))
+    preview_b64 = _preview_base64(ndvi, preview) if preview else None
+    result.update({
+        "preview_png_base64": preview_b64,
+        "message": f"quick look with rasterio ({method}, {values.size} of ~{result['approximate']['population_pixels']} pixels)",
+    })
+    return _with_io(result, io_sessions)
+
+
+def _compute_ndvi_pil(red_path, nir_path, polygon_geojson, preview, stress_threshold):
     """
     Simplified fallback:
     - red_path, nir_path are small greyscale images (PNG/JPG) of equal dimensions.
@@ -86,29 +388,234 @@ def _compute_ndvi_pil(red_path, nir_path, polygon_geojson, save_preview, stress_
     from PIL import Image
     import numpy as np
 
-    red = np.array(Image.open(red_path).convert('L')).astype('float32')
-    nir = np.array(Image.open(nir_path).convert('L')).astype('float32')
+    red = np.asarray(Image.open(red_path).convert('L'))
+    nir = np.asarray(Image.open(nir_path).convert('L'))
 
     if red.shape != nir.shape:
         raise ValueError("red and nir images must be same dimensions in fallback mode")
 
-    denom = (nir + red)
-    denom[denom == 0] = 1e-6
-    ndvi = (nir - red) / denom
-
-    mean_ndvi = float(np.nanmean(ndvi))
-    median_ndvi = float(np.nanmedian(ndvi))
-    pct_stress = float((ndvi < stress_threshold).sum() / ndvi.size)
+    ndvi = np.empty(nir.shape, dtype=np.float32) if preview else None
+    result = compute_ndvi_stats(nir, red, stress_threshold, ndvi_out=ndvi)
 
     preview_b64 = None
-    if save_preview:
-        preview_b64 = to_png_base64(ndvi)
-
-    return {
-        "mean_ndvi": mean_ndvi,
-        "median_ndvi": median_ndvi,
-        "pct_stress": pct_stress,
-        "stress_threshold": stress_threshold,
+    if preview:
+        preview_b64 = _preview_base64(ndvi, preview)
+
+    result.update({
         "preview_png_base64": preview_b64,
         "message": "computed with PIL fallback (no rasterio)"
-    }
+    })
+    return result
+
+
+def _band_sources(indices, band_paths=None, image_path=None, band_map=None):
+    """
+    Resolve every band the indices need to (path, 1-based band index), grouped by path so each
+    file is opened once and all of its bands are read in a single call per window.
+    """
+    band_paths = band_paths or {}
+    band_map = band_map or DEFAULT_BAND_MAP
+    grouped = {}
+    for band in required_bands(indices):
+        if band in band_paths:
+            path, bidx = band_paths[band], 1
+        elif image_path and band in band_map:
+            path, bidx = image_path, int(band_map[band])
+        else:
+            raise ValueError(f"band {band!r} is required for {indices} but was not provided")
+        grouped.setdefault(path, []).append((band, bidx))
+    return grouped
+
+
+def compute_indices_from_paths(polygon_geojson, indices=("ndvi",), band_paths=None, image_path=None, band_map=None,
+                               stress_threshold=0.3, stress_thresholds=None, reflectance_scale=None, mask_path=None,
+                               mask_values=None):
+    """
+    Several spectral indices over one polygon in a single pass over the bands.
+    band_paths: {"nir": path, "red": path, "green": path, "blue": path} (band 1 of each file), and/or
+    image_path + band_map: one multi-band raster, band_map maps band names to 1-based band indexes
+    (default DEFAULT_BAND_MAP).
+    mask_path / mask_values: optional cloud / quality mask raster; a pixel counts only where every band is valid.
+    Returns {"indices": {name: {mean, median, pct_stress, stress_threshold, histogram, pixel_count}},
+    valid_pixel_count, area_pixel_count, coverage_fraction, "message": ...}.
+    """
+    indices = normalize_indices(indices)
+    sources = _band_sources(indices, band_paths, image_path, band_map)
+    if HAS_RASTERIO:
+        return _compute_indices_rasterio(polygon_geojson, indices, sources, stress_threshold,
+                                         stress_thresholds, reflectance_scale, mask_path, mask_values)
+    warnings.warn("rasterio not available — using simplified PIL fallback (for small images only)")
+    return _compute_indices_pil(indices, sources, stress_threshold, stress_thresholds, reflectance_scale)
+
+
+def _compute_indices_rasterio(polygon_geojson, indices, sources, stress_threshold, stress_thresholds, reflectance_scale,
+                              mask_path=None, mask_values=None):
+    """
+    Block-window streaming over the polygon (as _compute_ndvi_rasterio_windowed): every band is read
+    once per window and all indices are derived from the same buffers. Medians come from the fine
+    histogram (within 0.001).
+    """
+    from rasterio.features import geometry_mask, geometry_window
+    from rasterio.windows import bounds as window_bounds
+    from shapely.geometry import shape, box
+    from shapely.prepared import prep
+
+    io_sessions = []
+    with ExitStack() as stack:
+        rasters = {path: stack.enter_context(_open_raster(path, io_sessions)) for path in sources}
+        # sources on other grids are warped onto the finest one
+        ref = reference_source(rasters.values())
+        ref_grid = Grid.of(ref)
+        srcs = {path: stack.enter_context(aligned(src, ref_grid)) for path, src in rasters.items()}
+        cloud = stack.enter_context(_pixel_mask(mask_path, ref, io_sessions))
+        for path, src in srcs.items():
+            for band, bidx in sources[path]:
+                if not 1 <= bidx <= src.count:
+                    raise ValueError(f"band {band!r} -> index {bidx} is out of range for {path} ({src.count} bands)")
+
+        poly = prep(shape(polygon_geojson))
+        poly_window = geometry_window(ref, [polygon_geojson])
+        accs = IndexAccumulators(indices, stress_threshold, stress_thresholds, reflectance_scale)
+        blocks_read = blocks_skipped = polygon_pixels = valid_pixels = 0
+
+        for win in _iter_block_windows(ref, poly_window):
+            if not poly.intersects(box(*window_bounds(win, ref.transform))):
+                continue
+            h, w = int(win.height), int(win.width)
+            inside = geometry_mask([polygon_geojson], out_shape=(h, w),
+                                   transform=ref.window_transform(win), invert=True)
+            area = np.count_nonzero(inside)
+            if not area:
+                continue
+            polygon_pixels += area
+            if cloud is not None:
+                _prefetch(io_sessions, cloud, win, poly)
+                inside &= _unmasked(cloud, mask_values, win)
+                if not inside.any():
+                    blocks_skipped += 1
+                    continue
+            for src in srcs.values():
+                _prefetch(io_sessions, src, win, poly)
+            windows = {}
+            for path, bands in sources.items():
+                data = srcs[path].read([bidx for _, bidx in bands], window=win)
+                for i, (band, bidx) in enumerate(bands):
+                    windows[band] = data[i]
+                    inside = combine_masks(inside, _valid_pixels(srcs[path], data[i], win, bidx))
+            raw = {band: data[inside] for band, data in windows.items()}
+            blocks_read += 1
+            valid_pixels += int(np.count_nonzero(inside))
+            accs.add(raw)
+
+    band_reads = blocks_read * sum(len(b) for b in sources.values())
+    result = {"indices": accs.results()}
+    result.update(coverage(valid_pixels, polygon_pixels))
+    result["message"] = (f"computed with rasterio (windowed, {blocks_read} blocks, {band_reads} band reads, "
+                         f"{blocks_skipped} fully masked)")
+    return _with_io(result, io_sessions)
+
+
+def _compute_indices_pil(indices, sources, stress_threshold, stress_thresholds, reflectance_scale):
+    """PIL fallback: whole images, polygon ignored (quick local tests only)."""
+    from PIL import Image
+
+    bands = {}
+    for path, wanted in sources.items():
+        img = np.asarray(Image.open(path))
+        for band, bidx in wanted:
+            bands[band] = img if img.ndim == 2 else img[..., bidx - 1]
+    result = compute_index_stats(bands, indices, stress_threshold, stress_thresholds, reflectance_scale)
+    return {"indices": result, "message": "computed with PIL fallback (no rasterio)"}
+
+
+def _zone_features(feature_collection, id_property):
+    """(ids, geometries) of a GeoJSON FeatureCollection (a bare list of features is accepted too)."""
+    features = feature_collection.get("features", []) if isinstance(feature_collection, dict) else feature_collection
+    ids, geoms = [], []
+    for i, feature in enumerate(features or []):
+        geom = feature.get("geometry")
+        if not geom:
+            continue
+        props = feature.get("properties") or {}
+        ids.append(props.get(id_property, feature.get("id", i)))
+        geoms.append(geom)
+    if not geoms:
+        raise ValueError("feature collection has no geometries")
+    return ids, geoms
+
+
+def compute_zonal_from_paths(red_path, nir_path, feature_collection, stress_threshold=0.3, id_property="farmId",
+                             mask_path=None, mask_values=None):
+    """
+    NDVI statistics for many zones (e.g. farm polygons) over one scene in a single pass.
+    The zones are burned into an integer label grid block by block, NDVI is computed once per
+    pixel, and every zone's stats come from grouped np.bincount reductions. An STRtree over the
+    zones skips scene blocks that no zone touches. Where zones overlap, a pixel counts for the
+    zone listed last. Medians are approximate (within 0.01). Nodata and cloud-masked pixels are
+    left out of every zone and reported through its coverage_fraction.
+    Returns {"zones": [{zone_id, mean_ndvi, median_ndvi, pct_stress, histogram, pixel_count,
+    valid_pixel_count, area_pixel_count, coverage_fraction}, ...], "message"}.
+    """
+    if not HAS_RASTERIO:
+        raise ValueError("zonal statistics need rasterio (georeferenced rasters)")
+    import shapely
+    from rasterio.features import rasterize
+    from rasterio.windows import bounds as window_bounds, from_bounds
+    from shapely.geometry import shape, box
+    from shapely.strtree import STRtree
+
+    zone_ids, geojson_geoms = _zone_features(feature_collection, id_property)
+    geoms = [shape(g) for g in geojson_geoms]
+    tree = STRtree(geoms)
+
+    io_sessions = []
+    with _open_raster(red_path, io_sessions) as red_raster, _open_raster(nir_path, io_sessions) as nir_raster, \
+            _aligned_pair(red_raster, nir_raster) as (src_red, src_nir), \
+            _pixel_mask(mask_path, reference_source((red_raster, nir_raster)), io_sessions) as cloud:
+        ref = reference_source((red_raster, nir_raster))
+        minx, miny, maxx, maxy = (
+            min(g.bounds[0] for g in geoms), min(g.bounds[1] for g in geoms),
+            max(g.bounds[2] for g in geoms), max(g.bounds[3] for g in geoms),
+        )
+        zones_window = from_bounds(minx, miny, maxx, maxy, transform=ref.transform)
+        acc = ZonalAccumulator(len(geoms), stress_threshold)
+        blocks_read = blocks_skipped = 0
+
+        for win in _iter_block_windows(ref, zones_window):
+            candidates = tree.query(box(*window_bounds(win, ref.transform)), predicate="intersects")
+            if len(candidates) == 0:
+                blocks_skipped += 1
+                continue
+            h, w = int(win.height), int(win.width)
+            # ascending label order so later zones win where polygons overlap
+            shapes = [(geoms[i], int(i) + 1) for i in sorted(candidates)]
+            labels = rasterize(shapes, out_shape=(h, w), transform=ref.window_transform(win),
+                               fill=0, dtype="int32")
+            inside = labels > 0
+            if not inside.any():
+                blocks_skipped += 1
+                continue
+            acc.add_area(labels)
+            zones_here = [geoms[i] for i in candidates]
+            block_geom = zones_here[0] if len(zones_here) == 1 else shapely.union_all(zones_here)
+            if cloud is not None:
+                _prefetch(io_sessions, cloud, win, block_geom)
+                inside &= _unmasked(cloud, mask_values, win)
+                if not inside.any():
+                    blocks_skipped += 1
+                    continue
+            _prefetch(io_sessions, src_red, win, block_geom)
+            _prefetch(io_sessions, src_nir, win, block_geom)
+            red = src_red.read(1, window=win)
+            nir = src_nir.read(1, window=win)
+            inside = combine_masks(inside, _valid_pixels(src_red, red, win), _valid_pixels(src_nir, nir, win))
+            red, nir = red[inside], nir[inside]
+            blocks_read += 1
+
+            ndvi = np.empty(nir.size, dtype=np.float32)
+            acc.add(labels[inside], ndvi_chunk(nir, red, ndvi, np.empty_like(ndvi)))
+
+    return _with_io({
+        "zones": acc.results(zone_ids),
+        "message": f"computed with rasterio (zonal, {len(geoms)} zones, {blocks_read} blocks read, {blocks_skipped} skipped)",
+    }, io_sessions)
@@ -0,0 +1,206 @@
+"""
+Co-registration of mismatched bands.
+
+Two cases:
+  - plain arrays (uploads without georeferencing): resample_array resizes in float32 with PIL's
+    separable bilinear filter ("F" mode, area-weighted when shrinking), no 8-bit round trip;
+  - rasters: aligned() yields a view of a raster on a reference grid. Same grid -> the dataset
+    itself; otherwise a GDAL WarpedVRT onto the reference CRS / transform / shape, read window by
+    window like any dataset (mask(), block windows, decimated reads). The warp's working and
+    output type is float32, so resampled values are not rounded back to the band's integer type.
+    Rasters without a CRS are aligned through their geotransforms alone.
+
+Building the alignment (CRS equivalence, footprint overlap, resampling choice, source windows)
+goes through PROJ, so plans are cached per (source grid, reference grid) in an LRU: repeat
+captures of the same farm / tile grid reuse them. reference_source() picks the finest-resolution
+band, so coarser bands are upsampled rather than detail thrown away.
+
+Config (env):
+  NDVI_ALIGN_RESAMPLING      bilinear | cubic | nearest | average | auto      (default: auto:
+                             average when the source is finer than the reference, else bilinear)
+  NDVI_ALIGN_CACHE_SIZE      cached alignment plans                            (default: 256)
+  NDVI_WARP_THREADS          GDAL warp threads per view                        (default: 1)
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("ml_service")
+
+NDVI_ALIGN_RESAMPLING = os.getenv("NDVI_ALIGN_RESAMPLING", "auto").strip().lower()
+NDVI_ALIGN_CACHE_SIZE = int(os.getenv("NDVI_ALIGN_CACHE_SIZE", "256"))
+NDVI_WARP_THREADS = os.getenv("NDVI_WARP_THREADS", "1")
+
+RESAMPLING_METHODS = ("bilinear", "cubic", "nearest", "average")
+_PIL_RESAMPLING = {"bilinear": Image.BILINEAR, "cubic": Image.BICUBIC, "nearest": Image.NEAREST, "average": Image.BOX}
+
+
+# ---------- arrays ----------
+def resample_array(arr: np.ndarray, target_shape: tuple, method: str = "bilinear") -> np.ndarray:
+    """Resize a 2D band to target_shape (height, width) as float32 in the band's own units."""
+    if arr.shape == tuple(target_shape):
+        return arr
+    if method not in _PIL_RESAMPLING:
+        raise ValueError(f"unknown resampling {method!r}, expected one of {RESAMPLING_METHODS}")
+    img = Image.fromarray(np.ascontiguousarray(arr, dtype=np.float32))
+    # PIL expects (width, height)
+    return np.asarray(img.resize((int(target_shape[1]), int(target_shape[0])), resample=_PIL_RESAMPLING[method]))
+
+
+# ---------- rasters ----------
+class Grid:
+    """CRS + affine transform + shape of a raster (hashable, comparable)."""
+
+    __slots__ = ("crs", "transform", "width", "height", "_crs_key")
+
+    def __init__(self, crs, transform, width, height):
+        self.crs = crs
+        self.transform = transform
+        self.width = int(width)
+        self.height = int(height)
+        self._crs_key = crs.to_wkt() if crs else None
+
+    @classmethod
+    def of(cls, src) -> "Grid":
+        return cls(src.crs, src.transform, src.width, src.height)
+
+    @property
+    def key(self) -> tuple:
+        return (self._crs_key, tuple(self.transform)[:6], self.width, self.height)
+
+    @property
+    def resolution(self) -> float:
+        t = self.transform
+        return abs(t.a * t.e - t.b * t.d) ** 0.5
+
+
+class AlignmentPlan:
+    """How to read one source grid on a reference grid."""
+
+    def __init__(self, source: Grid, reference: Grid, resampling: str = NDVI_ALIGN_RESAMPLING):
+        self.source = source
+        self.reference = reference
+        self.identity = source.key == reference.key
+        if (source.crs is None) != (reference.crs is None):
+            raise ValueError("cannot align a raster without a CRS to one with a CRS")
+        self.same_crs = source.crs is None or source.crs == reference.crs
+        if resampling == "auto":
+            resampling = "average" if source.resolution < reference.resolution * 0.999 else "bilinear"
+        if resampling not in RESAMPLING_METHODS:
+            raise ValueError(f"unknown resampling {resampling!r}, expected one of {RESAMPLING_METHODS}")
+        self.resampling = resampling
+        if not self.identity and not self._overlaps():
+            raise ValueError("band rasters do not overlap")
+
+    def _bounds_in_source_crs(self, left, bottom, right, top):
+        if self.same_crs:
+            return left, bottom, right, top
+        from rasterio.warp import transform_bounds
+
+        return transform_bounds(self.reference.crs, self.source.crs, left, bottom, right, top, densify_pts=21)
+
+    def _overlaps(self) -> bool:
+        left, bottom, right, top = self._bounds_in_source_crs(*_bounds(self.reference))
+        s_left, s_bottom, s_right, s_top = _bounds(self.source)
+        return not (right <= s_left or left >= s_right or top <= s_bottom or bottom >= s_top)
+
+    def vrt_options(self) -> dict:
+        from rasterio.enums import Resampling
+
+        options = {
+            "transform": self.reference.transform,
+            "width": self.reference.width,
+            "height": self.reference.height,
+            "resampling": Resampling[self.resampling],
+            "dtype": "float32",
+            "warp_extras": {"NUM_THREADS": NDVI_WARP_THREADS},
+        }
+        if self.reference.crs is not None:
+            options["crs"] = self.reference.crs
+        return options
+
+    def source_window(self, window):
+        """Window of the source raster covering a window of the reference grid (for prefetching)."""
+        from rasterio.windows import bounds as window_bounds, from_bounds
+
+        left, bottom, right, top = self._bounds_in_source_crs(*window_bounds(window, self.reference.transform))
+        return from_bounds(left, bottom, right, top, transform=self.source.transform)
+
+
+def _bounds(grid: Grid):
+    """(left, bottom, right, top) of a grid."""
+    from rasterio.transform import array_bounds
+
+    return array_bounds(grid.height, grid.width, grid.transform)
+
+
+class PlanCache:
+    """LRU of AlignmentPlans keyed by (source grid, reference grid, resampling)."""
+
+    def __init__(self, max_entries: int = NDVI_ALIGN_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, source: Grid, reference: Grid, resampling: str = NDVI_ALIGN_RESAMPLING) -> AlignmentPlan:
+        key = (source.key, reference.key, resampling)
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                self.hits += 1
+                return plan
+        plan = AlignmentPlan(source, reference, resampling)
+        with self._lock:
+            self.misses += 1
+            self._plans[key] = plan
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+        return plan
+
+    def stats(self) -> dict:
+        return {"entries": len(self._plans), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+def reference_source(sources):
+    """
+    The dataset whose grid the others are aligned to: the finest resolution (first on ties).
+    Resolutions are only comparable within one CRS; with mixed CRSs the first dataset wins.
+    """
+    sources = list(sources)
+    grids = [Grid.of(src) for src in sources]
+    if any(g.key[0] != grids[0].key[0] for g in grids):
+        return sources[0]
+    return sources[min(range(len(grids)), key=lambda i: grids[i].resolution)]
+
+
+@contextmanager
+def aligned(src, reference: Grid, resampling: str = NDVI_ALIGN_RESAMPLING):
+    """src itself when it already lies on the reference grid, else a float32 WarpedVRT onto it."""
+    plan = plan_cache.get(Grid.of(src), reference, resampling)
+    if plan.identity:
+        yield src
+        return
+    from rasterio.vrt import WarpedVRT
+
+    with WarpedVRT(src, **plan.vrt_options()) as vrt:
+        yield vrt
+
+
+def source_of(view):
+    """(underlying dataset, plan) of an aligned view, or (view, None) when it is not warped."""
+    src = getattr(view, "src_dataset", None)
+    if src is None:
+        return view, None
+    return src, plan_cache.get(Grid.of(src), Grid.of(view))
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,229 @@
+"""
+Bounded compute pool for CPU-bound NDVI work.
+
+Decoding images and running the NDVI math are pure numpy/PIL work that would otherwise
+block the event loop. This module runs those stages in a process (or thread) pool so one
+uvicorn process can drive all cores, and applies admission control: once every worker is
+busy and the wait queue is full, new work is rejected with `PoolSaturated` so the API can
+answer 503 + Retry-After instead of letting latency grow without bound.
+
+A worker process that dies mid-call (OOM kill, segfault in GDAL) breaks a ProcessPoolExecutor for
+good; the pool then replaces the executor and fails only the calls that were on the broken one,
+with `PoolRestarted`.
+
+Config (env):
+  NDVI_POOL_MODE          process | thread | inline   (default: process)
+  NDVI_POOL_WORKERS       number of workers            (default: cpu count / NDVI_WEB_WORKERS, so the
+                          pools of several web workers do not oversubscribe the cores)
+  NDVI_POOL_QUEUE_SIZE    max jobs waiting for a slot  (default: 2 x workers)
+  NDVI_POOL_RETRY_AFTER   seconds hinted to clients on saturation (default: 2)
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger("ml_service")
+
+POOL_MODES = ("process", "thread", "inline")
+
+
+class PoolSaturated(Exception):
+    """Raised when the compute pool has no free worker and no room left in its queue."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"compute pool saturated, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PoolRestarted(PoolSaturated):
+    """
+    Raised when the worker running the call died and the pool was rebuilt. It is a PoolSaturated,
+    so callers back off (or answer 503 + Retry-After) the same way.
+    """
+
+    def __init__(self, retry_after: int, cause: BaseException):
+        Exception.__init__(self, f"compute pool worker died ({cause!r}), pool restarted")
+        self.retry_after = retry_after
+
+
+class ComputePool:
+    """
+    Runs sync callables off the event loop with a bounded number of concurrent
+    jobs and a bounded wait queue.
+
+    Concurrency is gated by an asyncio semaphore sized to the worker count, so the
+    executor itself never holds more than `workers` jobs and the queue depth we report
+    is exactly the number of requests waiting on the semaphore.
+    """
+
+    def __init__(self, mode: str = "process", workers: int = 1, max_queue: int = 2, retry_after: int = 2):
+        if mode not in POOL_MODES:
+            raise ValueError(f"unknown pool mode {mode!r}, expected one of {POOL_MODES}")
+        self.mode = mode
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.retry_after = max(1, int(retry_after))
+        self.initializer = None
+        self.initargs = ()
+
+        self._executor = None
+        self._restart_lock = threading.Lock()
+        self._restarts = 0
+        self._slots = None
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_queued_seen = 0
+        self._wait_seconds_total = 0.0
+        self._run_seconds_total = 0.0
+
+    @classmethod
+    def from_env(cls) -> "ComputePool":
+        web_workers = max(1, int(os.getenv("NDVI_WEB_WORKERS", "1") or 1))
+        workers = int(os.getenv("NDVI_POOL_WORKERS", "0") or 0) or max(1, (os.cpu_count() or 1) // web_workers)
+        return cls(
+            mode=os.getenv("NDVI_POOL_MODE", "process").strip().lower(),
+            workers=workers,
+            max_queue=int(os.getenv("NDVI_POOL_QUEUE_SIZE", str(2 * workers))),
+            retry_after=int(os.getenv("NDVI_POOL_RETRY_AFTER", "2")),
+        )
+
+    # ---------- lifecycle ----------
+    def start(self, initializer=None, initargs=()):
+        """
+        Create the executor. initializer(*initargs) runs once in every worker process when it
+        starts (see app.core.serving.warm_worker); it is kept for restarts.
+        """
+        if initializer is not None:
+            self.initializer, self.initargs = initializer, tuple(initargs)
+        if self._executor is not None or self.mode == "inline":
+            return
+        if self.mode == "process":
+            # spawn avoids forking a process that already runs an event loop and threads
+            ctx = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx,
+                                                 initializer=self.initializer, initargs=self.initargs)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ndvi")
+        logger.info(f"Compute pool started (mode={self.mode}, workers={self.workers}, max_queue={self.max_queue})")
+
+    async def warm(self) -> int:
+        """
+        Start every worker process now, so the spawn, imports and initializer run before traffic
+        instead of in the first requests. Returns the number of processes started.
+        """
+        if self.mode != "process":
+            return 0
+        self.start()
+        loop = asyncio.get_running_loop()
+        # submitted back to back, each call finds no idle worker and spawns a new one
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, os.getpid) for _ in range(self.workers)))
+        return len(set(pids))
+
+    def _restart(self, broken):
+        """Replace a broken executor (once, however many calls saw it break)."""
+        with self._restart_lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self._restarts += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+            logger.warning(f"Compute pool broken (a worker process died), restarting it (restart #{self._restarts})")
+            self.start()
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+            logger.info("Compute pool stopped")
+
+    # ---------- execution ----------
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    def _admit(self):
+        if self._queued + self._running >= self.capacity:
+            self._rejected += 1
+            raise PoolSaturated(self.retry_after)
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the pool and return its result.
+        Raises PoolSaturated when the pool and its queue are full, PoolRestarted when the worker
+        died while running the call.
+        In process mode fn and args must be picklable (module-level functions, bytes, numpy arrays).
+        """
+        self._admit()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        self.start()
+
+        self._submitted += 1
+        self._queued += 1
+        self._max_queued_seen = max(self._max_queued_seen, self._queued)
+        enqueued_at = time.perf_counter()
+        waiting = True
+        try:
+            async with self._slots:
+                self._queued -= 1
+                waiting = False
+                started_at = time.perf_counter()
+                self._wait_seconds_total += started_at - enqueued_at
+                self._running += 1
+                try:
+                    call = functools.partial(fn, *args, **kwargs)
+                    if self._executor is None:
+                        result = call()
+                    else:
+                        executor = self._executor
+                        loop = asyncio.get_running_loop()
+                        try:
+                            result = await loop.run_in_executor(executor, call)
+                        except BrokenExecutor as e:
+                            self._restart(executor)
+                            raise PoolRestarted(self.retry_after, e) from e
+                    self._completed += 1
+                    return result
+                except Exception:
+                    self._failed += 1
+                    raise
+                finally:
+                    self._running -= 1
+                    self._run_seconds_total += time.perf_counter() - started_at
+        finally:
+            if waiting:
+                self._queued -= 1
+
+    # ---------- metrics ----------
+    def stats(self) -> dict:
+        finished = self._completed + self._failed
+        started = self._submitted - self._queued
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queue_depth": self._queued,
+            "max_queue_depth_seen": self._max_queued_seen,
+            "submitted": self._submitted,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "pool_restarts": self._restarts,
+            "avg_wait_ms": (self._wait_seconds_total / started * 1000.0) if started else 0.0,
+            "avg_run_ms": (self._run_seconds_total / finished * 1000.0) if finished else 0.0,
+        }
+
+
+# shared pool used by the API layer
+compute_pool = ComputePool.from_env()
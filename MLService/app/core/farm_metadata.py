@@ -0,0 +1,321 @@
+"""
+Farm metadata lookups against the backend (/api/farms/{id}).
+
+One pooled httpx.AsyncClient is shared by every request (opened/closed by the app lifespan),
+and results are kept in an in-process TTL + LRU cache:
+  - positive entries live FARM_CACHE_TTL_SECONDS,
+  - "farm not found" (404 / 410) answers are negatively cached for FARM_CACHE_NEGATIVE_TTL_SECONDS,
+  - concurrent lookups for the same farmId are coalesced into a single backend call.
+Transport errors and every other status (5xx, but also 401/403 from a rotated token or 429
+throttling) are not cached, so a backend or auth blip does not hide metadata for long.
+
+Behind the in-process tier sits a SQLite file shared by every web worker of the host (and kept
+across restarts), so a farm looked up by one worker is a hit for the others. With the shared
+tier a worker trusts its in-memory copy for at most FARM_CACHE_LOCAL_TTL_SECONDS, which bounds
+how long an invalidation made through another worker takes to reach it.
+
+Config (env):
+  BACKEND_URL, BACKEND_FARMS_PATH, BACKEND_TIMEOUT_SECONDS, BACKEND_MAX_CONNECTIONS
+  FARM_CACHE_TTL_SECONDS, FARM_CACHE_NEGATIVE_TTL_SECONDS, FARM_CACHE_MAX_ENTRIES
+  FARM_CACHE_SHARED_PATH         sqlite file shared by the workers (default: data/farm_cache.sqlite3;
+                                 empty disables the shared tier)
+  FARM_CACHE_LOCAL_TTL_SECONDS   in-memory lifetime of entries when the shared tier is on (default: 5)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger("ml_service")
+
+BACKEND_URL = os.getenv("BACKEND_URL")
+BACKEND_FARMS_PATH = os.getenv("BACKEND_FARMS_PATH", "/api/farms")
+BACKEND_TIMEOUT_SECONDS = float(os.getenv("BACKEND_TIMEOUT_SECONDS", "6.0"))
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "20"))
+
+FARM_CACHE_TTL_SECONDS = float(os.getenv("FARM_CACHE_TTL_SECONDS", "300"))
+FARM_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("FARM_CACHE_NEGATIVE_TTL_SECONDS", "30"))
+FARM_CACHE_MAX_ENTRIES = int(os.getenv("FARM_CACHE_MAX_ENTRIES", "1024"))
+FARM_CACHE_SHARED_PATH = os.getenv("FARM_CACHE_SHARED_PATH", os.path.join("data", "farm_cache.sqlite3"))
+FARM_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("FARM_CACHE_LOCAL_TTL_SECONDS", "5"))
+
+NOT_FOUND_STATUSES = (404, 410)  # backend answers that mean the farm does not exist
+
+_MISSING = object()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS farms (
+    farm_id    TEXT PRIMARY KEY,
+    value      TEXT,           -- JSON metadata, NULL for "farm not found"
+    expires_at REAL NOT NULL   -- wall clock
+);
+"""
+
+
+class SharedFarmStore:
+    """Farm metadata entries in a SQLite file shared by the worker processes (sync, run via asyncio.to_thread)."""
+
+    def __init__(self, path: str = FARM_CACHE_SHARED_PATH):
+        self.path = path
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    def _open(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params=()):
+        with self._db_lock:
+            return self._open().execute(sql, params).fetchall()
+
+    def get(self, farm_id: str):
+        """(value, seconds left) of a live entry, or (_MISSING, None)."""
+        now = time.time()
+        rows = self._execute("SELECT value, expires_at FROM farms WHERE farm_id = ? AND expires_at > ?", (farm_id, now))
+        if not rows:
+            return _MISSING, None
+        value, expires_at = rows[0]
+        return (json.loads(value) if value is not None else None), expires_at - now
+
+    def put(self, farm_id: str, value, ttl: float):
+        now = time.time()
+        encoded = json.dumps(value) if value is not None else None
+        with self._db_lock:
+            db = self._open()
+            db.execute("INSERT OR REPLACE INTO farms (farm_id, value, expires_at) VALUES (?, ?, ?)", (farm_id, encoded, now + ttl))
+            db.execute("DELETE FROM farms WHERE expires_at <= ?", (now,))
+
+    def delete(self, farm_id: Optional[str] = None) -> int:
+        with self._db_lock:
+            db = self._open()
+            if farm_id is None:
+                return db.execute("DELETE FROM farms").rowcount
+            return db.execute("DELETE FROM farms WHERE farm_id = ?", (farm_id,)).rowcount
+
+    def count(self) -> int:
+        if self._db is None and not os.path.exists(self.path):
+            return 0
+        return self._execute("SELECT COUNT(*) FROM farms WHERE expires_at > ?", (time.time(),))[0][0]
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class FarmMetadataCache:
+    """
+    TTL + LRU cache with negative entries and singleflight loading.
+    Values of None are "known missing" entries and use the negative TTL.
+    shared: optional SharedFarmStore consulted on a memory miss before the loader runs.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_entries: int, shared: Optional[SharedFarmStore] = None,
+                 local_ttl: float = FARM_CACHE_LOCAL_TTL_SECONDS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max(1, max_entries)
+        self.shared = shared
+        self.local_ttl = local_ttl
+        self._entries = OrderedDict()  # farm_id -> (expires_at, value)
+        self._inflight = {}  # farm_id -> asyncio.Future
+        self.hits = 0
+        self.negative_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.shared_errors = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _ttl(self, value) -> float:
+        return self.ttl if value is not None else self.negative_ttl
+
+    def _store(self, key, value, ttl: Optional[float] = None):
+        ttl = self._ttl(value) if ttl is None else ttl
+        if self.shared is not None:
+            ttl = min(ttl, self.local_ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key, loader):
+        """
+        Return the cached value for key, or await loader() once for all concurrent callers.
+        loader returns (value, cacheable).
+        """
+        value = self._lookup(key)
+        if value is not _MISSING:
+            if value is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            value, ttl = await self._shared_get(key)
+            if value is not _MISSING:
+                self.shared_hits += 1
+                self._store(key, value, ttl)
+            else:
+                self.misses += 1
+                value, cacheable = await loader()
+                if cacheable:
+                    self._store(key, value)
+                    await self._shared_put(key, value)
+            fut.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # mark retrieved so an unawaited shared failure doesn't log "exception never retrieved"
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    # ---------- shared tier (failures degrade to a miss) ----------
+    async def _shared_get(self, key):
+        if self.shared is None:
+            return _MISSING, None
+        try:
+            return await asyncio.to_thread(self.shared.get, key)
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"farm cache: shared tier read failed for {key}: {e}")
+            return _MISSING, None
+
+    async def _shared_put(self, key, value):
+        if self.shared is None or self._ttl(value) <= 0:
+            return
+        try:
+            await asyncio.to_thread(self.shared.put, key, value, self._ttl(value))
+        except Exception as e:
+            self.shared_errors += 1
+            logger.warning(f"farm cache: shared tier write failed for {key}: {e}")
+
+    def invalidate(self, key: Optional[str] = None) -> int:
+        """Drop one farm (or everything when key is None) from this process; returns number of entries removed."""
+        if key is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        return 1 if self._entries.pop(key, None) is not None else 0
+
+    async def invalidate_all_workers(self, key: Optional[str] = None) -> int:
+        """invalidate() plus the shared tier, so the other workers reload within local_ttl."""
+        removed = self.invalidate(key)
+        if self.shared is not None:
+            removed = max(removed, await asyncio.to_thread(self.shared.delete, key))
+        return removed
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.shared_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "negative_ttl_seconds": self.negative_ttl,
+            "shared": self.shared is not None,
+            "shared_entries": self.shared.count() if self.shared is not None else 0,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "shared_hits": self.shared_hits,
+            "shared_errors": self.shared_errors,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+            "hit_ratio": ((self.hits + self.negative_hits + self.shared_hits + self.coalesced) / lookups) if lookups else 0.0,
+        }
+
+
+class BackendClient:
+    """Lifespan-managed, pooled client for backend farm lookups."""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        shared = SharedFarmStore(FARM_CACHE_SHARED_PATH) if FARM_CACHE_SHARED_PATH else None
+        self.cache = FarmMetadataCache(FARM_CACHE_TTL_SECONDS, FARM_CACHE_NEGATIVE_TTL_SECONDS, FARM_CACHE_MAX_ENTRIES, shared)
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                verify=False,
+                timeout=BACKEND_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=BACKEND_MAX_CONNECTIONS, max_keepalive_connections=BACKEND_MAX_CONNECTIONS),
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.cache.shared is not None:
+            await asyncio.to_thread(self.cache.shared.close)
+
+    async def _load_farm(self, farm_id: str):
+        url = f"{BACKEND_URL.rstrip('/')}{BACKEND_FARMS_PATH.rstrip('/')}/{farm_id}"
+        if self._client is None:
+            await self.start()
+        try:
+            r = await self._client.get(url)
+        except Exception as e:
+            logger.warning(f"fetch_farm_metadata error for {farm_id}: {e}")
+            return None, False
+        if r.status_code == 200:
+            return r.json(), True
+        logger.warning(f"fetch_farm_metadata: backend returned {r.status_code} for farm {farm_id}: {r.text}")
+        # only "not found" is an answer about the farm; auth, throttling and 5xx are transient
+        return None, r.status_code in NOT_FOUND_STATUSES
+
+    async def fetch_farm_metadata(self, farm_id: Optional[str]):
+        """
+        Fetch farm metadata from backend: expected shape { farmId, farmName, owner: { telegramChatId, ... }, tiles_url?... }
+        Returns dict or None.
+        """
+        if not BACKEND_URL or not farm_id:
+            return None
+        return await self.cache.get(farm_id, lambda: self._load_farm(farm_id))
+
+
+backend_client = BackendClient()
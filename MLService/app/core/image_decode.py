@@ -0,0 +1,149 @@
+"""
+Single-channel, native-dtype decode of band images (PNG / JPEG / TIFF uploads).
+
+The previous decode built a float32 HxWx3 copy before the luminance math (about 12 bytes of
+transient memory per pixel) and squeezed 16-bit bands through 8-bit "L". Here:
+  - colour images are reduced to luminance by PIL's integer "L" conversion (ITU-R 601 weights,
+    the same as before), so the only full-size array is 1 byte per pixel;
+  - JPEGs are decoded straight to greyscale with draft(), and at a reduced DCT scale (1/2..1/8)
+    when the band is larger than needed;
+  - 16-bit bands stay uint16 ("I;16" / "I" modes), float TIFFs stay float32;
+  - bands larger than NDVI_MAX_BAND_PIXELS are block-averaged down by an integer factor, and
+    images whose header declares more than NDVI_MAX_SOURCE_PIXELS are rejected before decoding.
+decode_band_pair reads both headers first (cheap), decodes red no larger than it must be to be
+resampled to the NIR grid, and decodes the two bands concurrently (PIL releases the GIL while
+decoding).
+
+Config (env):
+  NDVI_MAX_BAND_PIXELS     largest decoded band; larger images are reduced  (default: 100000000)
+  NDVI_MAX_SOURCE_PIXELS   larger images are rejected with 413               (default: 400000000)
+  NDVI_DECODE_THREADS      concurrent band decodes per worker                (default: 2)
+"""
+
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+NDVI_MAX_BAND_PIXELS = int(float(os.getenv("NDVI_MAX_BAND_PIXELS", "100000000")))
+NDVI_MAX_SOURCE_PIXELS = int(float(os.getenv("NDVI_MAX_SOURCE_PIXELS", "400000000")))
+NDVI_DECODE_THREADS = max(1, int(os.getenv("NDVI_DECODE_THREADS", "2")))
+
+# our own source-size guard replaces PIL's decompression-bomb warning threshold
+Image.MAX_IMAGE_PIXELS = NDVI_MAX_SOURCE_PIXELS
+
+_UINT16_MODES = ("I;16", "I;16L", "I;16B", "I;16N")
+
+_decode_pool = None
+_decode_pool_lock = threading.Lock()
+
+
+class BandTooLarge(ValueError):
+    """Raised when a band exceeds the pixel limits."""
+
+
+def check_source_pixels(width: int, height: int, name: str = "band"):
+    if width * height > NDVI_MAX_SOURCE_PIXELS:
+        raise BandTooLarge(f"{name} is {width}x{height} ({width * height / 1e6:.0f} MP), "
+                           f"limit is {NDVI_MAX_SOURCE_PIXELS / 1e6:.0f} MP")
+
+
+def reduce_factor(width: int, height: int, max_pixels: int = NDVI_MAX_BAND_PIXELS, target_size=None) -> int:
+    """
+    Integer downscale factor for a width x height band: enough to fit max_pixels and, with
+    target_size (w, h), as much as possible while staying at least that large.
+    """
+    factor = 1
+    if max_pixels and width * height > max_pixels:
+        factor = math.ceil(math.sqrt(width * height / max_pixels))
+    if target_size and target_size[0] > 0 and target_size[1] > 0:
+        factor = max(factor, min(width // target_size[0], height // target_size[1]))
+    return max(1, factor)
+
+
+def _image_array(img: Image.Image) -> np.ndarray:
+    """Loaded PIL image -> 2D array in its native dtype (uint8 / uint16 / float32)."""
+    mode = img.mode
+    if mode in _UINT16_MODES:
+        return np.asarray(img).astype(np.uint16, copy=False)
+    if mode == "I":
+        arr = np.asarray(img)
+        if arr.size and arr.min() >= 0 and arr.max() <= 65535:
+            return arr.astype(np.uint16)
+        return arr.astype(np.float32)
+    if mode == "F":
+        return np.asarray(img)
+    if mode != "L":
+        img = img.convert("L")
+    return np.asarray(img)
+
+
+def block_reduce(arr: np.ndarray, factor: int) -> np.ndarray:
+    """Mean of factor x factor blocks (trailing partial blocks dropped), keeping the dtype."""
+    if factor <= 1:
+        return arr
+    h, w = arr.shape[0] // factor, arr.shape[1] // factor
+    blocks = arr[:h * factor, :w * factor].reshape(h, factor, w, factor)
+    out = blocks.mean(axis=(1, 3), dtype=np.float32)
+    if arr.dtype.kind in "ui":
+        return np.rint(out, out=out).astype(arr.dtype)
+    return out
+
+
+def decode_band_image(src, target_size=None, max_pixels: int = NDVI_MAX_BAND_PIXELS, name: str = "band") -> np.ndarray:
+    """
+    Decode one band image (path or binary file object) to a 2D native-dtype array.
+    target_size (w, h): the band will be resampled to this size afterwards, so it may be
+    decoded smaller as long as it stays at least that large.
+    """
+    try:
+        img = Image.open(src)
+    except Image.DecompressionBombError as e:
+        raise BandTooLarge(f"{name}: {e}")
+    with img:
+        width, height = img.size
+        check_source_pixels(width, height, name)
+        factor = reduce_factor(width, height, max_pixels, target_size)
+        if img.format == "JPEG":
+            # libjpeg decodes straight to greyscale and scales by 1/2, 1/4 or 1/8 in the DCT
+            img.draft("L", (math.ceil(width / factor), math.ceil(height / factor)))
+        arr = _image_array(img)
+    # what draft() did not cover is done by block averaging
+    return block_reduce(arr, reduce_factor(arr.shape[1], arr.shape[0], max_pixels, target_size))
+
+
+def _image_size(src):
+    with Image.open(src) as img:
+        return img.size
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _decode_pool
+    with _decode_pool_lock:
+        if _decode_pool is None:
+            _decode_pool = ThreadPoolExecutor(max_workers=NDVI_DECODE_THREADS, thread_name_prefix="band-decode")
+        return _decode_pool
+
+
+def decode_band_pair(nir_src_fn, red_src_fn):
+    """
+    Decode the NIR and red images concurrently. *_src_fn are zero-argument callables returning
+    a fresh path / file object (headers are read first, then each band is opened again to decode).
+    Red is decoded no larger than needed to be resampled to the NIR grid.
+    """
+    try:
+        nir_w, nir_h = _image_size(nir_src_fn())
+    except Image.DecompressionBombError as e:
+        raise BandTooLarge(f"nir: {e}")
+    check_source_pixels(nir_w, nir_h, "nir")
+    nir_factor = reduce_factor(nir_w, nir_h)
+    target = (nir_w // nir_factor, nir_h // nir_factor)
+    if NDVI_DECODE_THREADS < 2:
+        return decode_band_image(nir_src_fn(), name="nir"), decode_band_image(red_src_fn(), target, name="red")
+    pool = _pool()
+    nir_future = pool.submit(decode_band_image, nir_src_fn(), None, NDVI_MAX_BAND_PIXELS, "nir")
+    red_future = pool.submit(decode_band_image, red_src_fn(), target, NDVI_MAX_BAND_PIXELS, "red")
+    return nir_future.result(), red_future.result()
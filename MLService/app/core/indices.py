@@ -0,0 +1,191 @@
+"""
+Vegetation / water indices computed together from one read of each band.
+
+Every index is a chunk kernel over float32 band buffers, so a window (or chunk) of bands is
+converted to float32 once and all requested indices are derived from the same buffers while
+they are hot in cache; each index feeds its own NDVIStatsAccumulator (values clipped to -1..1).
+
+  ndvi   (nir - red) / (nir + red)
+  gndvi  (nir - green) / (nir + green)
+  ndwi   (green - nir) / (green + nir)                      (McFeeters)
+  savi   (1 + L) (nir - red) / (nir + red + L), L = 0.5
+  evi    2.5 (nir - red) / (nir + 6 red - 7.5 blue + 1)
+
+The ratio indices are scale-invariant; SAVI and EVI expect surface reflectance (0..1), so
+integer DN bands should be given a reflectance_scale (e.g. 0.0001 for Sentinel-2 L2A).
+"""
+
+import numpy as np
+
+from app.core.ndvi_stats import CHUNK_PIXELS, NDVIStatsAccumulator, exact_median, ndvi_chunk
+
+SAVI_L = 0.5
+
+INDEX_BANDS = {
+    "ndvi": ("nir", "red"),
+    "gndvi": ("nir", "green"),
+    "ndwi": ("green", "nir"),
+    "savi": ("nir", "red"),
+    "evi": ("nir", "red", "blue"),
+}
+
+
+def _savi(b, out, scratch):
+    np.subtract(b["nir"], b["red"], out=out)
+    np.add(b["nir"], b["red"], out=scratch)
+    scratch += np.float32(SAVI_L)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(out, scratch, out=out)
+    out *= np.float32(1.0 + SAVI_L)
+    np.copyto(out, 0.0, where=(scratch == 0))
+    np.clip(out, -1.0, 1.0, out=out)
+    return out
+
+
+def _evi(b, out, scratch):
+    np.subtract(b["nir"], b["red"], out=out)
+    np.multiply(b["red"], np.float32(6.0), out=scratch)
+    scratch += b["nir"]
+    scratch -= np.float32(7.5) * b["blue"]
+    scratch += np.float32(1.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(out, scratch, out=out)
+    out *= np.float32(2.5)
+    np.copyto(out, 0.0, where=(scratch == 0))
+    np.clip(out, -1.0, 1.0, out=out)
+    return out
+
+
+INDEX_KERNELS = {
+    "ndvi": lambda b, out, scratch: ndvi_chunk(b["nir"], b["red"], out, scratch),
+    "gndvi": lambda b, out, scratch: ndvi_chunk(b["nir"], b["green"], out, scratch),
+    "ndwi": lambda b, out, scratch: ndvi_chunk(b["green"], b["nir"], out, scratch),
+    "savi": _savi,
+    "evi": _evi,
+}
+
+
+def normalize_indices(indices) -> list:
+    """Lower-case, de-duplicate and validate a list of index names (ValueError if unknown)."""
+    names = []
+    for name in indices or ["ndvi"]:
+        name = str(name).strip().lower()
+        if name not in INDEX_KERNELS:
+            raise ValueError(f"unknown index {name!r}; available: {sorted(INDEX_KERNELS)}")
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def required_bands(indices) -> list:
+    """Bands needed for the given indices, in a stable order."""
+    needed = []
+    for name in indices:
+        for band in INDEX_BANDS[name]:
+            if band not in needed:
+                needed.append(band)
+    return needed
+
+
+def _threshold_for(name, stress_thresholds, default):
+    if isinstance(stress_thresholds, dict):
+        return float(stress_thresholds.get(name, default))
+    return float(default)
+
+
+class IndexAccumulators:
+    """One NDVIStatsAccumulator per requested index, fed from shared float32 band buffers."""
+
+    def __init__(self, indices, stress_threshold=0.3, stress_thresholds=None, reflectance_scale=None):
+        self.indices = normalize_indices(indices)
+        self.bands = required_bands(self.indices)
+        self.reflectance_scale = reflectance_scale
+        self.acc = {name: NDVIStatsAccumulator(_threshold_for(name, stress_thresholds, stress_threshold))
+                    for name in self.indices}
+        self._buffers = {}
+
+    def _buffer(self, name, n):
+        buf = self._buffers.get(name)
+        if buf is None or buf.size < n:
+            buf = self._buffers[name] = np.empty(n, dtype=np.float32)
+        return buf[:n]
+
+    def load_bands(self, raw: dict) -> dict:
+        """Convert one chunk of each band to float32 exactly once (scaled to reflectance if configured)."""
+        out = {}
+        for band in self.bands:
+            values = raw[band].reshape(-1)
+            buf = self._buffer(f"band:{band}", values.size)
+            np.copyto(buf, values, casting="unsafe")
+            if self.reflectance_scale:
+                buf *= np.float32(self.reflectance_scale)
+            out[band] = buf
+        return out
+
+    def iter_index_values(self, bands: dict):
+        """Yield (name, values) for every index over one chunk of float32 bands."""
+        n = next(iter(bands.values())).size
+        out = self._buffer("out", n)
+        scratch = self._buffer("scratch", n)
+        for name in self.indices:
+            yield name, INDEX_KERNELS[name](bands, out, scratch)
+
+    def add(self, raw: dict):
+        for name, values in self.iter_index_values(self.load_bands(raw)):
+            self.acc[name].add(values)
+
+    def results(self, medians=None) -> dict:
+        """{index: {mean, median, pct_stress, stress_threshold, histogram, pixel_count}}."""
+        medians = medians or {}
+        out = {}
+        for name in self.indices:
+            stats = self.acc[name].result(median=medians.get(name))
+            stats["mean"] = stats.pop("mean_ndvi")
+            stats["median"] = stats.pop("median_ndvi")
+            out[name] = stats
+        return out
+
+
+def compute_index_stats(bands: dict, indices, stress_threshold=0.3, stress_thresholds=None,
+                        reflectance_scale=None, median="exact", chunk_pixels=CHUNK_PIXELS) -> dict:
+    """
+    Per-index statistics for in-memory same-shape band arrays keyed by "nir" / "red" / "green" / "blue".
+    Returns {index: stats}, stats as in compute_ndvi_stats with mean / median instead of mean_ndvi / median_ndvi.
+    """
+    accs = IndexAccumulators(indices, stress_threshold, stress_thresholds, reflectance_scale)
+    missing = [b for b in accs.bands if b not in bands]
+    if missing:
+        raise ValueError(f"missing bands {missing} for indices {accs.indices}")
+    shapes = {bands[b].shape for b in accs.bands}
+    if len(shapes) != 1:
+        raise ValueError("all bands must have the same shape")
+    flat = {b: bands[b].reshape(-1) for b in accs.bands}
+    n = next(iter(flat.values())).size
+
+    def chunks():
+        for start in range(0, n, chunk_pixels):
+            yield {b: flat[b][start:start + chunk_pixels] for b in accs.bands}
+
+    for raw in chunks():
+        accs.add(raw)
+    if median == "approx" or n == 0:
+        return accs.results()
+
+    # exact medians: one more pass, recomputing every index from a single conversion per band chunk
+    lo_hi = {name: accs.acc[name].median_bins() for name in accs.indices if accs.acc[name].count}
+    picked = {name: [] for name in lo_hi}
+    for raw in chunks():
+        for name, values in accs.iter_index_values(accs.load_bands(raw)):
+            if name not in lo_hi:
+                continue
+            lo_bin, hi_bin = lo_hi[name][:2]
+            finite = values[np.isfinite(values)]
+            idx = accs.acc[name].bin_index(finite)
+            sel = (idx >= lo_bin) & (idx <= hi_bin)
+            if sel.any():
+                picked[name].append(finite[sel])
+    medians = {}
+    for name, parts in picked.items():
+        # same rank selection as exact_median, over the gathered candidates
+        medians[name] = exact_median(accs.acc[name], [np.concatenate(parts)])
+    return accs.results(medians)
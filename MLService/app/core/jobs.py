@@ -0,0 +1,642 @@
+"""
+Background NDVI jobs for long-running scene work (full scenes, many polygons, many zones).
+
+POST /v1/ndvi/jobs returns a job id at once and the work runs here instead of on an open HTTP
+connection:
+  - a job is split into units: one polygon for compute / indices jobs, NDVI_JOB_ZONAL_CHUNK
+    features for zonal jobs. Each unit runs on the shared compute pool (the windowed engines
+    already stream the scene block window by block window inside a unit) and its result is
+    written to the store as soon as it finishes, so progress is done / total units;
+  - scheduling is per unit over two priority lanes. Interactive units always go first and bulk
+    units may occupy at most NDVI_JOB_BULK_RUNNERS of the NDVI_JOB_RUNNERS runners, so a
+    single-farm job waits at most for one running unit, never for a whole bulk re-processing
+    job. A saturated compute pool (busy synchronous traffic) makes runners back off, not fail,
+    and a unit whose pool worker died is rerun on the rebuilt pool (NDVI_JOB_CRASH_RETRIES times;
+    errors raised by the computation itself fail the unit at once);
+  - state lives in SQLite (jobs + finished unit results). Jobs are leased by the process running
+    them and the lease is renewed while it works; after a restart (or with several uvicorn
+    workers, when a worker dies) unfinished jobs are claimed again and resume from their first
+    missing unit;
+  - cancelling drops the pending units at once; a unit already on the pool finishes but its
+    result is discarded. Cancellation goes through the store, so it reaches any worker;
+  - progress subscribers (SSE) get every change made by this process and re-read the store on
+    each heartbeat, which covers jobs running in another worker.
+
+Config (env):
+  NDVI_JOBS_PATH            sqlite file                                    (default: data/ndvi_jobs.sqlite3)
+  NDVI_JOB_RUNNERS          units run concurrently by this process         (default: 2)
+  NDVI_JOB_BULK_RUNNERS     runners bulk units may occupy                  (default: runners - 1, at least 1)
+  NDVI_JOB_ZONAL_CHUNK      features per zonal unit                        (default: 500)
+  NDVI_JOB_MAX_UNITS        polygons / zone chunks per job                 (default: 10000)
+  NDVI_JOB_LEASE_SECONDS    a job not renewed for this long is taken over  (default: 30)
+  NDVI_JOB_CRASH_RETRIES    reruns of a unit whose pool worker died        (default: 2)
+  NDVI_JOB_RETENTION_HOURS  finished jobs kept                             (default: 168)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+from app.core.compute_ndvi import compute_indices_from_paths, compute_ndvi_from_paths, compute_zonal_from_paths
+from app.core.executor import PoolRestarted, PoolSaturated, compute_pool
+
+logger = logging.getLogger("ml_service")
+
+NDVI_JOBS_PATH = os.getenv("NDVI_JOBS_PATH", os.path.join("data", "ndvi_jobs.sqlite3"))
+NDVI_JOB_RUNNERS = max(1, int(os.getenv("NDVI_JOB_RUNNERS", "2")))
+NDVI_JOB_BULK_RUNNERS = max(1, int(os.getenv("NDVI_JOB_BULK_RUNNERS", "0") or 0) or NDVI_JOB_RUNNERS - 1)
+NDVI_JOB_ZONAL_CHUNK = max(1, int(os.getenv("NDVI_JOB_ZONAL_CHUNK", "500")))
+NDVI_JOB_MAX_UNITS = int(os.getenv("NDVI_JOB_MAX_UNITS", "10000"))
+NDVI_JOB_LEASE_SECONDS = float(os.getenv("NDVI_JOB_LEASE_SECONDS", "30"))
+NDVI_JOB_CRASH_RETRIES = max(0, int(os.getenv("NDVI_JOB_CRASH_RETRIES", "2")))
+NDVI_JOB_RETENTION_HOURS = float(os.getenv("NDVI_JOB_RETENTION_HOURS", "168"))
+
+JOB_KINDS = ("compute", "indices", "zonal")
+LANES = ("interactive", "bulk")  # in priority order
+OPEN_STATUSES = ("queued", "running")
+FINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+_HOST = socket.gethostname()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    lane        TEXT NOT NULL,
+    status      TEXT NOT NULL,  -- queued | running | succeeded | failed | cancelled
+    params      TEXT NOT NULL,
+    total       INTEGER NOT NULL,
+    done        INTEGER NOT NULL DEFAULT 0,
+    failed      INTEGER NOT NULL DEFAULT 0,
+    owner       TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    error       TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    updated_at  REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_open ON jobs (status, lease_until);
+CREATE TABLE IF NOT EXISTS job_units (
+    job_id  TEXT NOT NULL,
+    idx     INTEGER NOT NULL,
+    ok      INTEGER NOT NULL,
+    result  TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+_STATE_COLUMNS = "id, kind, lane, status, total, done, failed, error, created_at, started_at, updated_at, finished_at"
+
+
+# ---------- units ----------
+def job_units(kind: str, params: dict) -> int:
+    """Number of units a job is split into."""
+    if kind == "zonal":
+        features = params["features"].get("features", []) if isinstance(params["features"], dict) else params["features"]
+        return max(1, -(-len(features or []) // NDVI_JOB_ZONAL_CHUNK))
+    return len(params["polygons"])
+
+
+def unit_call(kind: str, params: dict, index: int):
+    """(fn, kwargs) running unit `index` of a job on the compute pool."""
+    if kind == "zonal":
+        collection = params["features"]
+        features = collection.get("features", []) if isinstance(collection, dict) else collection
+        chunk = []
+        for i, feature in enumerate((features or [])[index * NDVI_JOB_ZONAL_CHUNK:(index + 1) * NDVI_JOB_ZONAL_CHUNK]):
+            # zones without an id are named by their position in the whole collection, not in the chunk
+            if (feature.get("properties") or {}).get(params["id_property"]) is None and feature.get("id") is None:
+                feature = dict(feature, id=index * NDVI_JOB_ZONAL_CHUNK + i)
+            chunk.append(feature)
+        kwargs = {k: v for k, v in params.items() if k != "features"}
+        return compute_zonal_from_paths, dict(kwargs, feature_collection={"type": "FeatureCollection", "features": chunk})
+    kwargs = {k: v for k, v in params.items() if k != "polygons"}
+    kwargs["polygon_geojson"] = params["polygons"][index]
+    if kind == "indices":
+        return compute_indices_from_paths, kwargs
+    return compute_ndvi_from_paths, kwargs
+
+
+# ---------- storage (sync, run via asyncio.to_thread) ----------
+def _state(row) -> dict:
+    (job_id, kind, lane, status, total, done, failed, error,
+     created_at, started_at, updated_at, finished_at) = row
+    return {
+        "jobId": job_id,
+        "kind": kind,
+        "priority": lane,
+        "status": status,
+        "progress": {"done": done, "failed": failed, "total": total, "fraction": done / total if total else 1.0},
+        "error": error,
+        "createdAt": created_at,
+        "startedAt": started_at,
+        "updatedAt": updated_at,
+        "finishedAt": finished_at,
+    }
+
+
+class JobStore:
+    """SQLite tables of jobs and their finished unit results."""
+
+    def __init__(self, path: str = NDVI_JOBS_PATH):
+        self.path = path
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    def _open(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA busy_timeout=5000")  # several uvicorn workers share the file
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def _execute(self, sql: str, params=()):
+        with self._db_lock:
+            return self._open().execute(sql, params).fetchall()
+
+    def _update(self, sql: str, params=()) -> int:
+        with self._db_lock:
+            return self._open().execute(sql, params).rowcount
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def create(self, job_id: str, kind: str, lane: str, params: dict, total: int, owner: str, lease: float):
+        now = time.time()
+        self._update(
+            "INSERT INTO jobs (id, kind, lane, status, params, total, owner, lease_until, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, lane, json.dumps(params), total, owner, now + lease, now, now),
+        )
+
+    def state(self, job_id: str) -> Optional[dict]:
+        rows = self._execute(f"SELECT {_STATE_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+        return _state(rows[0]) if rows else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> list:
+        if status:
+            rows = self._execute(f"SELECT {_STATE_COLUMNS} FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+                                 (status, limit))
+        else:
+            rows = self._execute(f"SELECT {_STATE_COLUMNS} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [_state(r) for r in rows]
+
+    def load(self, job_id: str):
+        """(kind, lane, params, total, indexes of finished units) of a job."""
+        rows = self._execute("SELECT kind, lane, params, total FROM jobs WHERE id = ?", (job_id,))
+        kind, lane, params, total = rows[0]
+        finished = {idx for (idx,) in self._execute("SELECT idx FROM job_units WHERE job_id = ?", (job_id,))}
+        return kind, lane, json.loads(params), total, finished
+
+    def units(self, job_id: str) -> list:
+        """[(index, ok, result)] of the finished units in index order."""
+        rows = self._execute("SELECT idx, ok, result FROM job_units WHERE job_id = ? ORDER BY idx", (job_id,))
+        return [(idx, bool(ok), json.loads(result)) for idx, ok, result in rows]
+
+    def begin_unit(self, job_id: str, owner: str) -> bool:
+        """Mark the job running; False when it was cancelled or taken over meanwhile."""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), updated_at = ? "
+            "WHERE id = ? AND owner = ? AND status IN ('queued', 'running')",
+            (now, now, job_id, owner),
+        ) == 1
+
+    def save_unit(self, job_id: str, owner: str, index: int, ok: bool, result: dict) -> bool:
+        """Store one unit result and count it; False (nothing stored) when the job is no longer ours."""
+        now = time.time()
+        with self._db_lock:
+            db = self._open()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = db.execute(
+                    "UPDATE jobs SET done = done + 1, failed = failed + ?, updated_at = ? "
+                    "WHERE id = ? AND owner = ? AND status = 'running'",
+                    (0 if ok else 1, now, job_id, owner),
+                )
+                if cur.rowcount == 1:
+                    db.execute("INSERT INTO job_units (job_id, idx, ok, result) VALUES (?, ?, ?, ?)",
+                               (job_id, index, int(ok), json.dumps(result)))
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def finish(self, job_id: str, owner: str) -> bool:
+        """Close a job whose units are all done: failed when every unit failed."""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET status = CASE WHEN failed >= total THEN 'failed' ELSE 'succeeded' END, "
+            "error = CASE WHEN failed > 0 THEN failed || ' of ' || total || ' units failed' END, "
+            "finished_at = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (now, now, job_id, owner),
+        ) == 1
+
+    def cancel(self, job_id: str) -> bool:
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ?, updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (now, now, job_id),
+        ) == 1
+
+    def renew(self, owner: str, job_ids, lease: float):
+        until = time.time() + lease
+        with self._db_lock:
+            self._open().executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status IN ('queued', 'running')",
+                [(until, job_id, owner) for job_id in job_ids],
+            )
+
+    def claim_orphans(self, owner: str, lease: float, limit: int = 100) -> list:
+        """
+        Take over open jobs whose lease expired or whose owner process on this host is gone
+        (compare-and-set on owner + lease, so two workers never claim the same job).
+        """
+        now = time.time()
+        rows = self._execute(
+            "SELECT id, owner, lease_until FROM jobs WHERE status IN ('queued', 'running') AND (owner IS NULL OR owner != ?) "
+            "ORDER BY created_at LIMIT ?",
+            (owner, limit),
+        )
+        claimed = []
+        for job_id, old_owner, lease_until in rows:
+            if lease_until >= now and _owner_alive(old_owner, owner):
+                continue
+            if self._update("UPDATE jobs SET owner = ?, lease_until = ? WHERE id = ? AND owner IS ? AND lease_until = ?",
+                            (owner, now + lease, job_id, old_owner, lease_until)) == 1:
+                claimed.append(job_id)
+        return claimed
+
+    def counts(self) -> dict:
+        counts = {s: 0 for s in OPEN_STATUSES + FINAL_STATUSES}
+        for status, n in self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = n
+        return counts
+
+    def purge(self, retention_hours: float = NDVI_JOB_RETENTION_HOURS) -> int:
+        cutoff = time.time() - retention_hours * 3600
+        with self._db_lock:
+            db = self._open()
+            db.execute("BEGIN")
+            try:
+                db.execute("DELETE FROM job_units WHERE job_id IN "
+                           "(SELECT id FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?)",
+                           (cutoff,))
+                removed = db.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+                                     (cutoff,)).rowcount
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        return removed
+
+
+def _owner_alive(owner: Optional[str], me: str) -> bool:
+    """Whether a lease owner may still be running (only processes on this host can be checked)."""
+    if not owner:
+        return False
+    host, _, rest = owner.partition(":")
+    pid = rest.partition(":")[0]
+    if host != _HOST or not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        # same pid, different owner id: an earlier incarnation of this process (e.g. pid 1 in a container)
+        return owner == me
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# ---------- scheduler ----------
+class _ActiveJob:
+    """A job this process is working on: its pending unit indexes and units in flight."""
+
+    __slots__ = ("id", "kind", "lane", "params", "pending", "inflight", "dropped")
+
+    def __init__(self, job_id, kind, lane, params, pending):
+        self.id = job_id
+        self.kind = kind
+        self.lane = lane
+        self.params = params
+        self.pending = deque(pending)
+        self.inflight = 0
+        self.dropped = False
+
+
+class JobManager:
+    """Runs jobs of this process unit by unit with interactive units ahead of bulk ones."""
+
+    def __init__(self, store: JobStore, runners: int = NDVI_JOB_RUNNERS, bulk_runners: int = NDVI_JOB_BULK_RUNNERS,
+                 lease: float = NDVI_JOB_LEASE_SECONDS):
+        self.store = store
+        self.runners = runners
+        self.bulk_runners = min(bulk_runners, runners)
+        self.lease = lease
+        self.owner = f"{_HOST}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._active = {}
+        self._lanes = {lane: deque() for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._cond: Optional[asyncio.Condition] = None
+        self._tasks = []
+        self._subscribers = {}
+        self.units_run = 0
+        self.units_discarded = 0
+        self.saturation_waits = 0
+        self.worker_crashes = 0
+        self.resumed = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        if self._tasks:
+            return
+        self._cond = asyncio.Condition()
+        # the serving process's pid: with a preloaded app this object was built in the parent
+        self.owner = f"{_HOST}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        await asyncio.to_thread(self.store.purge)
+        self._tasks = [asyncio.create_task(self._runner(), name=f"ndvi-job-runner-{i}") for i in range(self.runners)]
+        self._tasks.append(asyncio.create_task(self._maintain(), name="ndvi-job-lease"))
+        logger.info(f"NDVI job runners started ({self.store.path}, runners={self.runners}, bulk={self.bulk_runners})")
+
+    async def stop(self):
+        """Stop the runners; units in flight are abandoned and rerun by whoever resumes the job."""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._active.clear()
+        for lane in LANES:
+            self._lanes[lane].clear()
+            self._running[lane] = 0
+        await asyncio.to_thread(self.store.close)
+
+    # ---------- public API ----------
+    async def submit(self, kind: str, params: dict, priority: Optional[str] = None) -> dict:
+        """
+        Persist a job and queue its units. params are the body of the matching synchronous endpoint
+        (compute / indices with `polygons`, zonal with `features`), already validated.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"unknown job kind {kind!r}, expected one of {JOB_KINDS}")
+        total = job_units(kind, params)
+        if total > NDVI_JOB_MAX_UNITS:
+            raise ValueError(f"job has {total} units, limit is {NDVI_JOB_MAX_UNITS}")
+        lane = priority or ("interactive" if total == 1 else "bulk")
+        if lane not in LANES:
+            raise ValueError(f"unknown priority {lane!r}, expected one of {LANES}")
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.create, job_id, kind, lane, params, total, self.owner, self.lease)
+        await self._activate(_ActiveJob(job_id, kind, lane, params, range(total)))
+        logger.info(f"Queued NDVI job {job_id} ({kind}, {total} units, {lane})")
+        return await asyncio.to_thread(self.store.state, job_id)
+
+    async def state(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.store.state, job_id)
+
+    async def list(self, status: Optional[str] = None, limit: int = 50) -> list:
+        return await asyncio.to_thread(self.store.list, status, limit)
+
+    async def result(self, job_id: str, kind: str) -> dict:
+        """Unit results of a job: per-polygon results, or the zones of every chunk concatenated."""
+        units = await asyncio.to_thread(self.store.units, job_id)
+        if kind == "zonal":
+            zones, errors = [], []
+            for index, ok, result in units:
+                if ok:
+                    zones.extend(result.get("zones", []))
+                else:
+                    errors.append({"index": index, "error": result.get("error")})
+            return {"zones": zones, "errors": errors}
+        return {"results": [
+            {"index": index, "success": ok, **({"result": result} if ok else {"error": result.get("error")})}
+            for index, ok, result in units
+        ]}
+
+    async def cancel(self, job_id: str) -> Optional[dict]:
+        cancelled = await asyncio.to_thread(self.store.cancel, job_id)
+        job = self._active.get(job_id)
+        if job is not None:
+            async with self._cond:
+                self._drop(job)
+        if cancelled:
+            logger.info(f"Cancelled NDVI job {job_id}")
+        state = await asyncio.to_thread(self.store.state, job_id)
+        self._publish(job_id, state)
+        return state
+
+    async def watch(self, job_id: str, heartbeat: float = 15.0):
+        """
+        Async iterator over a job's state: the current state first, then every change until it is
+        final. Yields None on heartbeats without a change (keep-alive for proxies).
+        """
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            state = await asyncio.to_thread(self.store.state, job_id)
+            if state is None:
+                return
+            yield state
+            last = (state["status"], state["updatedAt"])
+            while state["status"] not in FINAL_STATUSES:
+                try:
+                    state = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    # the job may be running in another worker: look at the store
+                    state = await asyncio.to_thread(self.store.state, job_id)
+                if state is None:
+                    return
+                if (state["status"], state["updatedAt"]) == last:
+                    yield None
+                    continue
+                last = (state["status"], state["updatedAt"])
+                yield state
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    def stats(self) -> dict:
+        return {
+            **self.store.counts(),
+            "active_jobs": len(self._active),
+            "pending_interactive_units": sum(len(j.pending) for j in self._lanes["interactive"]),
+            "pending_bulk_units": sum(len(j.pending) for j in self._lanes["bulk"]),
+            "running_interactive_units": self._running["interactive"],
+            "running_bulk_units": self._running["bulk"],
+            "runners": self.runners,
+            "bulk_runners": self.bulk_runners,
+            "units_run": self.units_run,
+            "units_discarded": self.units_discarded,
+            "saturation_waits": self.saturation_waits,
+            "worker_crashes": self.worker_crashes,
+            "resumed_jobs": self.resumed,
+        }
+
+    # ---------- scheduling ----------
+    async def _activate(self, job: _ActiveJob):
+        if self._cond is None:
+            raise RuntimeError("job manager is not started")
+        async with self._cond:
+            self._active[job.id] = job
+            if job.pending:
+                self._lanes[job.lane].append(job)
+                self._cond.notify_all()
+
+    def _drop(self, job: _ActiveJob):
+        """Forget a job's pending units (caller holds the condition)."""
+        job.dropped = True
+        job.pending.clear()
+        try:
+            self._lanes[job.lane].remove(job)
+        except ValueError:
+            pass
+        if job.inflight == 0:
+            self._active.pop(job.id, None)
+
+    def _pick(self):
+        for lane in LANES:
+            if lane == "bulk" and self._running["bulk"] >= self.bulk_runners:
+                continue
+            jobs = self._lanes[lane]
+            if jobs:
+                job = jobs[0]
+                index = job.pending.popleft()
+                if not job.pending:
+                    jobs.popleft()
+                job.inflight += 1
+                self._running[lane] += 1
+                return job, index
+        return None
+
+    async def _next_unit(self):
+        async with self._cond:
+            while True:
+                picked = self._pick()
+                if picked is not None:
+                    return picked
+                await self._cond.wait()
+
+    async def _runner(self):
+        while True:
+            job, index = await self._next_unit()
+            try:
+                await self._run_unit(job, index)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"NDVI job {job.id} unit {index} could not be recorded")
+            finally:
+                async with self._cond:
+                    job.inflight -= 1
+                    self._running[job.lane] -= 1
+                    last = not job.pending and job.inflight == 0
+                    if last:
+                        self._active.pop(job.id, None)
+                    self._cond.notify_all()
+            if last and not job.dropped:
+                if await asyncio.to_thread(self.store.finish, job.id, self.owner):
+                    logger.info(f"NDVI job {job.id} finished")
+                self._publish(job.id, await asyncio.to_thread(self.store.state, job.id))
+
+    async def _run_unit(self, job: _ActiveJob, index: int):
+        if job.dropped or not await asyncio.to_thread(self.store.begin_unit, job.id, self.owner):
+            await self._abandon(job)
+            return
+        fn, kwargs = unit_call(job.kind, job.params, index)
+        crashes = 0
+        while True:
+            try:
+                result, ok = await compute_pool.run(fn, **kwargs), True
+            except PoolRestarted as e:
+                # the pool, not the computation, failed (worker killed, out of memory): rerun the unit
+                # on the rebuilt pool, unless it keeps taking its worker down
+                self.worker_crashes += 1
+                crashes += 1
+                if crashes > NDVI_JOB_CRASH_RETRIES:
+                    result, ok = {"error": f"{e} ({crashes} times running this unit)"}, False
+                    break
+                logger.warning(f"NDVI job {job.id} unit {index}: {e}, running it again")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except PoolSaturated as e:
+                # synchronous requests keep the pool busy: wait instead of failing the unit
+                self.saturation_waits += 1
+                await asyncio.sleep(e.retry_after)
+                continue
+            except Exception as e:
+                result, ok = {"error": str(e)}, False
+            break
+        self.units_run += 1
+        if job.dropped or not await asyncio.to_thread(self.store.save_unit, job.id, self.owner, index, ok, result):
+            self.units_discarded += 1
+            await self._abandon(job)
+            return
+        self._publish(job.id, await asyncio.to_thread(self.store.state, job.id))
+
+    async def _abandon(self, job: _ActiveJob):
+        """The job was cancelled or taken over by another worker: stop working on it here."""
+        async with self._cond:
+            self._drop(job)
+
+    def _publish(self, job_id: str, state: Optional[dict]):
+        if state is None:
+            return
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(state)
+
+    async def _maintain(self):
+        """Renew the leases of our jobs and take over orphaned ones (also right after startup)."""
+        while True:
+            try:
+                if self._active:
+                    await asyncio.to_thread(self.store.renew, self.owner, list(self._active), self.lease)
+                for job_id in await asyncio.to_thread(self.store.claim_orphans, self.owner, self.lease):
+                    if job_id in self._active:
+                        continue
+                    kind, lane, params, total, finished = await asyncio.to_thread(self.store.load, job_id)
+                    pending = [i for i in range(total) if i not in finished]
+                    logger.info(f"Resuming NDVI job {job_id} ({len(pending)} of {total} units left)")
+                    self.resumed += 1
+                    await self._activate(_ActiveJob(job_id, kind, lane, params, pending))
+                    if not pending:
+                        # every unit finished before the previous owner could close the job
+                        await asyncio.to_thread(self.store.begin_unit, job_id, self.owner)
+                        async with self._cond:
+                            self._active.pop(job_id, None)
+                        await asyncio.to_thread(self.store.finish, job_id, self.owner)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("NDVI job lease maintenance failed")
+            await asyncio.sleep(self.lease / 3)
+
+
+job_manager = JobManager(JobStore())
@@ -0,0 +1,242 @@
+"""
+Per-stage request timing and Prometheus metrics for the NDVI service.
+
+A StageTimer collects wall-clock durations of the named pipeline stages of one request
+(read, cache, decode, resize, ndvi, median, tiles, enrich, alert, serialize, ...). Stages that
+run on the compute pool are timed inside the worker and shipped back with the result, then merged
+into the request's timer. The timer is rendered as a `Server-Timing` response header and observed
+into histograms.
+
+The registry renders the Prometheus text exposition format itself (no client library needed):
+  - counters and histograms updated on the request path,
+  - gauges read at scrape time from the existing stats() dicts (compute pool, result cache,
+    farm cache, ...), so the JSON stats endpoints and /metrics never disagree.
+Metrics are per process: with several uvicorn workers each one exposes its own series.
+
+Config (env):
+  NDVI_METRICS_ENABLED         1 / 0: /metrics endpoint and Server-Timing header (default: 1)
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from app.core.upload_spool import SpooledUpload
+
+NDVI_METRICS_ENABLED = os.getenv("NDVI_METRICS_ENABLED", "1") not in ("0", "false", "False", "")
+
+# seconds; covers sub-ms stages up to a slow 10k^2 scene
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = tuple(float(4 ** i * 1024) for i in range(1, 11))  # 4 KiB .. 1 GiB
+PIXEL_BUCKETS = tuple(float(s * s) for s in (64, 256, 512, 1024, 2048, 4096, 8192, 16384))
+
+
+# ---------- per-request stage timer ----------
+class StageTimer:
+    """Accumulates named stage durations (seconds) in first-seen order."""
+
+    def __init__(self):
+        self.stages = {}
+        self.profile_id = None  # set when the request was profiled (see app.core.profiling)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + float(seconds)
+
+    def merge(self, stages: dict):
+        for name, seconds in (stages or {}).items():
+            self.add(name, seconds)
+
+    def server_timing(self) -> str:
+        """`Server-Timing` header value, durations in milliseconds."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+# ---------- metric types ----------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            series = dict(self._series)
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in series.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._series.get(key) or ([0] * len(self.buckets), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._series[key] = (counts, total + value)
+
+    def render(self) -> list:
+        with self._lock:
+            series = {k: (list(c), s) for k, (c, s) in self._series.items()}
+        lines = self.header()
+        for key, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Owned metrics plus scrape-time gauge collectors over stats() dicts."""
+
+    def __init__(self, namespace: str = "ndvi"):
+        self.namespace = namespace
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        metric = Counter(f"{self.namespace}_{name}", help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=TIME_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.namespace}_{name}", help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats_collector(self, prefix: str, help_text: str, stats_fn):
+        """Export every numeric entry of stats_fn() as gauge <namespace>_<prefix>_<key> at scrape time."""
+        self._collectors.append((f"{self.namespace}_{prefix}", help_text, stats_fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, help_text, stats_fn in self._collectors:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                lines.append(f"# {prefix} collector failed: {_escape(e)}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', str(key))}"
+                lines.extend([f"# HELP {name} {help_text} ({key})", f"# TYPE {name} gauge", f"{name} {_number(value)}"])
+        return "\n".join(lines) + "\n"
+
+
+# ---------- service metrics ----------
+registry = MetricsRegistry()
+http_requests = registry.counter("http_requests_total", "HTTP requests by route and status", ("route", "method", "status"))
+http_request_seconds = registry.histogram("http_request_seconds", "HTTP request latency by route", ("route", "method"))
+stage_seconds = registry.histogram("stage_seconds", "NDVI pipeline stage durations", ("endpoint", "stage"))
+input_bytes = registry.histogram("input_bytes", "Raw band input size per computed request", ("endpoint",), BYTES_BUCKETS)
+input_pixels = registry.histogram("input_pixels", "Pixels per computed scene", ("endpoint",), PIXEL_BUCKETS)
+results_total = registry.counter("results_total", "NDVI results by cache status", ("endpoint", "cache"))
+profiles_total = registry.counter("profiles_total", "Profiled NDVI requests", ("trigger",))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and observing latency per route template (never the raw
+    path, which would explode cardinality with report / farm ids). Latency runs until the last
+    body chunk is sent, so streamed batch responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not NDVI_METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            label = getattr(route, "path", None) or "unmatched"
+            http_requests.inc(route=label, method=scope["method"], status=status["code"])
+            http_request_seconds.observe(time.perf_counter() - start, route=label, method=scope["method"])
+
+
+def inputs_nbytes(inputs: dict) -> int:
+    return sum(len(v) for v in inputs.values() if isinstance(v, (bytes, bytearray, memoryview, SpooledUpload)))
+
+
+def observe_result(endpoint: str, timer: StageTimer, inputs: dict, stats: dict, cache_status: str):
+    """Record one NDVI result: stage histograms, cache status and (when computed) input size."""
+    if not NDVI_METRICS_ENABLED:
+        return
+    results_total.inc(endpoint=endpoint, cache=cache_status)
+    for name, seconds in timer.stages.items():
+        stage_seconds.observe(seconds, endpoint=endpoint, stage=name)
+    if not cache_status.startswith("hit"):
+        input_bytes.observe(inputs_nbytes(inputs), endpoint=endpoint)
+        if "pixel_count" in stats:
+            input_pixels.observe(stats["pixel_count"], endpoint=endpoint)
@@ -0,0 +1,268 @@
+"""
+Fused NDVI statistics kernel shared by the API pipeline (main.py) and the raster paths (compute_ndvi.py).
+
+NDVI is computed chunk by chunk into two reusable float32 buffers with in-place ufuncs, and every
+statistic is accumulated from the same chunk while it is hot in cache:
+  - mean over finite values, pct_stress (< threshold) over all pixels,
+  - a fine fixed-range histogram (MEDIAN_HIST_BINS bins over -1..1) from which both the reported
+    coarse histogram and the median are derived.
+Bin membership follows np.histogram exactly (histogram_bin_index), so the coarse histogram is the
+one np.histogram(ndvi, HIST_BINS, (-1, 1)) reports. The median is either approximate (interpolated inside its fine bin, error <= 1/MEDIAN_HIST_BINS)
+or exact: a second pass gathers only the values that fall in the median's fine bin and selects
+the rank with np.partition, so no full-size sort or copy is ever made.
+With a validity mask (nodata, outside the polygon, clouds) the bands are compacted to the valid
+pixels first: masked pixels never reach the NDVI math and do not count in pixel_count or
+pct_stress, and the result reports valid_pixel_count and coverage_fraction.
+"""
+
+import functools
+import os
+import time
+
+import numpy as np
+
+# pixels per chunk: 256k float32 = 1 MiB per buffer, comfortably inside L2/L3
+CHUNK_PIXELS = int(os.getenv("NDVI_STATS_CHUNK_PIXELS", str(256 * 1024)))
+# fine histogram used to derive the median (bin width 0.001 over -1..1)
+MEDIAN_HIST_BINS = 2000
+HIST_BINS = 10
+
+
+@functools.lru_cache(maxsize=None)
+def histogram_edges(bins: int, dtype=np.dtype(np.float32), coarse_bins: int = HIST_BINS) -> np.ndarray:
+    """
+    Edges of `bins` uniform bins over -1..1 as np.histogram builds them for `dtype` data. Every
+    bins / coarse_bins-th edge is np.histogram's coarse edge, so groups of fine bins add up to
+    np.histogram(values, coarse_bins, (-1, 1)) exactly.
+    """
+    edges = np.linspace(-1.0, 1.0, bins + 1, dtype=dtype)
+    edges[::bins // coarse_bins] = np.linspace(-1.0, 1.0, coarse_bins + 1, dtype=dtype)
+    edges.flags.writeable = False
+    return edges
+
+
+def histogram_bin_index(values, bins: int, coarse_bins: int = HIST_BINS):
+    """
+    Bin (0..bins-1) of each finite value, by np.histogram's rule over -1..1: edges[i] <= v < edges[i + 1]
+    with the last bin closed. The scaled position can land in the neighbouring bin next to an edge
+    (float rounding), so values that close to an edge are checked against the edges, like
+    np.histogram does. Values outside -1..1 go to the first / last bin. Returns int32 (bins is small).
+    """
+    edges = histogram_edges(bins, values.dtype, coarse_bins)
+    pos = values + 1.0
+    pos *= bins / 2.0
+    idx = pos.astype(np.int32)
+    np.clip(idx, 0, bins - 1, out=idx)
+    # distance from the middle of the bin; rounding moves pos by far less than bins * 1e-6
+    pos -= idx
+    pos -= 0.5
+    near = np.flatnonzero(np.abs(pos, out=pos) > 0.5 - bins * 1e-6)
+    if near.size:
+        cand, v = idx[near], values[near]
+        cand -= (v < edges[cand]) & (cand > 0)
+        cand += (v >= edges[cand + 1]) & (cand < bins - 1)
+        idx[near] = cand
+    return idx
+
+
+class NDVIStatsAccumulator:
+    """
+    Incremental NDVI statistics over chunks of NDVI values (already clipped to -1..1).
+    Memory use is constant regardless of how many pixels are fed in.
+    """
+
+    def __init__(self, stress_threshold, bins=HIST_BINS, fine_bins=MEDIAN_HIST_BINS):
+        if fine_bins % bins:
+            raise ValueError("fine_bins must be a multiple of bins")
+        self.stress_threshold = float(stress_threshold)
+        self.bins = bins
+        self.fine_bins = fine_bins
+        self.pixels = 0  # every pixel seen, including NaN
+        self.count = 0  # finite pixels
+        self.total = 0.0
+        self.below = 0
+        self.fine_hist = np.zeros(fine_bins, dtype=np.int64)
+
+    def bin_index(self, values):
+        """Fine-histogram bin of each value (see histogram_bin_index)."""
+        return histogram_bin_index(values, self.fine_bins, self.bins)
+
+    def add(self, values):
+        self.pixels += int(values.size)
+        finite = np.isfinite(values)
+        if not finite.all():
+            values = values[finite]
+        if values.size == 0:
+            return
+        self.count += int(values.size)
+        self.total += float(values.sum(dtype=np.float64))
+        self.below += int(np.count_nonzero(values < self.stress_threshold))
+        self.fine_hist += np.bincount(self.bin_index(values), minlength=self.fine_bins)
+
+    def median_bins(self):
+        """Fine bins holding the two middle ranks, plus the ranks themselves and the count before the first bin."""
+        cum = np.cumsum(self.fine_hist)
+        lo_rank, hi_rank = (self.count - 1) // 2, self.count // 2
+        lo_bin = int(np.searchsorted(cum, lo_rank, side="right"))
+        hi_bin = int(np.searchsorted(cum, hi_rank, side="right"))
+        before = int(cum[lo_bin - 1]) if lo_bin > 0 else 0
+        return lo_bin, hi_bin, lo_rank - before, hi_rank - before
+
+    def approx_median(self):
+        if self.count == 0:
+            return float("nan")
+        cum = np.cumsum(self.fine_hist)
+        half = self.count / 2.0
+        idx = int(np.searchsorted(cum, half))
+        before = float(cum[idx - 1]) if idx > 0 else 0.0
+        in_bin = float(self.fine_hist[idx])
+        frac = (half - before) / in_bin if in_bin else 0.5
+        return -1.0 + (idx + frac) * (2.0 / self.fine_bins)
+
+    def result(self, median=None):
+        """The stats dict; mean_ndvi / median_ndvi are None (JSON null) when no pixel was finite."""
+        coarse = self.fine_hist.reshape(self.bins, -1).sum(axis=1)
+        edges = np.linspace(-1.0, 1.0, self.bins + 1)
+        if median is None:
+            median = self.approx_median()
+        return {
+            "mean_ndvi": (self.total / self.count) if self.count else None,
+            "median_ndvi": float(median) if self.count else None,
+            "pct_stress": (self.below / self.pixels) if self.pixels else 0.0,
+            "stress_threshold": self.stress_threshold,
+            "histogram": {"bins": coarse.tolist(), "edges": edges.tolist()},
+            "pixel_count": self.count,
+        }
+
+
+def ndvi_chunk(nir, red, diff, denom):
+    """
+    NDVI of one chunk written into the preallocated float32 buffer diff (denom is scratch).
+    Pixels with nir + red == 0 are 0; values are clipped to -1..1. Returns diff.
+    """
+    np.subtract(nir, red, out=diff, dtype=np.float32)
+    np.add(nir, red, out=denom, dtype=np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.divide(diff, denom, out=diff)
+    np.copyto(diff, 0.0, where=(denom == 0))
+    np.clip(diff, -1.0, 1.0, out=diff)
+    return diff
+
+
+def _iter_ndvi_chunks(nir_flat, red_flat, chunk_pixels, ndvi_out=None):
+    n = nir_flat.size
+    diff = np.empty(min(chunk_pixels, n), dtype=np.float32)
+    denom = np.empty_like(diff)
+    for start in range(0, n, chunk_pixels):
+        stop = min(start + chunk_pixels, n)
+        m = stop - start
+        if ndvi_out is not None:
+            out = ndvi_out[start:stop]
+            yield ndvi_chunk(nir_flat[start:stop], red_flat[start:stop], out, denom[:m])
+        else:
+            yield ndvi_chunk(nir_flat[start:stop], red_flat[start:stop], diff[:m], denom[:m])
+
+
+def exact_median(acc: NDVIStatsAccumulator, chunks):
+    """
+    Exact median from a second pass over the NDVI chunks: only values in the fine bin(s)
+    holding the middle rank(s) are gathered and partitioned.
+    """
+    if acc.count == 0:
+        return float("nan")
+    lo_bin, hi_bin, lo_rank, hi_rank = acc.median_bins()
+    picked = []
+    for values in chunks:
+        finite = np.isfinite(values)
+        if not finite.all():
+            values = values[finite]
+        idx = acc.bin_index(values)
+        sel = (idx >= lo_bin) & (idx <= hi_bin)
+        if sel.any():
+            picked.append(values[sel])
+    candidates = np.concatenate(picked)
+    part = np.partition(candidates, (lo_rank, hi_rank))
+    return (float(part[lo_rank]) + float(part[hi_rank])) / 2.0
+
+
+def coverage(valid_pixels: int, area_pixels: int) -> dict:
+    """
+    Coverage fields of a result: valid_pixel_count, area_pixel_count (pixels of the requested
+    area: polygon, zone or whole image) and coverage_fraction = valid / area.
+    """
+    return {
+        "valid_pixel_count": int(valid_pixels),
+        "area_pixel_count": int(area_pixels),
+        "coverage_fraction": (valid_pixels / area_pixels) if area_pixels else 0.0,
+    }
+
+
+def combine_masks(*masks):
+    """Logical AND of boolean masks; None entries mean "all valid" (None when every entry is None)."""
+    out = None
+    for m in masks:
+        if m is None:
+            continue
+        out = m.copy() if out is None else np.logical_and(out, m, out=out)
+    return out
+
+
+def compute_ndvi_stats(nir, red, stress_threshold, median="exact", chunk_pixels=CHUNK_PIXELS, ndvi_out=None,
+                       timings=None, valid=None):
+    """
+    Single-pass NDVI statistics for two same-shape bands (any numeric dtype; integer bands
+    are promoted to float32 per chunk, never as a whole).
+    median: "exact" (second, selective pass) or "approx" (fine-histogram interpolation).
+    ndvi_out: optional float32 array with nir.size elements that receives the NDVI raster
+              (flattened), e.g. for previews; the exact median then re-reads it instead of recomputing.
+    timings: optional dict that receives the seconds spent in the "ndvi" pass and the "median" pass.
+    valid: optional boolean mask of the band shape; only those pixels are computed (ndvi_out is NaN
+           elsewhere) and valid_pixel_count / area_pixel_count / coverage_fraction are added.
+    Returns mean_ndvi, median_ndvi, pct_stress, stress_threshold, histogram, pixel_count
+    (mean_ndvi / median_ndvi are None when no pixel is valid).
+    """
+    if nir.shape != red.shape:
+        raise ValueError("nir and red arrays must have the same shape")
+    if median not in ("exact", "approx"):
+        raise ValueError("median must be 'exact' or 'approx'")
+    if valid is not None:
+        if valid.shape != nir.shape:
+            raise ValueError("valid mask must have the same shape as the bands")
+        valid = valid.reshape(-1)
+        n_valid = int(np.count_nonzero(valid))
+        compact_out = np.empty(n_valid, dtype=np.float32) if ndvi_out is not None else None
+        stats = compute_ndvi_stats(nir.reshape(-1)[valid], red.reshape(-1)[valid], stress_threshold, median,
+                                   chunk_pixels, compact_out, timings)
+        if ndvi_out is not None:
+            flat = ndvi_out.reshape(-1)
+            flat.fill(np.nan)
+            flat[valid] = compact_out
+        stats.update(coverage(n_valid, valid.size))
+        return stats
+    nir_flat = nir.reshape(-1)
+    red_flat = red.reshape(-1)
+    if ndvi_out is not None:
+        ndvi_out = ndvi_out.reshape(-1)
+        if ndvi_out.size != nir_flat.size or ndvi_out.dtype != np.float32:
+            raise ValueError("ndvi_out must be a float32 array with the same number of pixels as the bands")
+
+    acc = NDVIStatsAccumulator(stress_threshold)
+    if nir_flat.size == 0:
+        return acc.result()
+    started = time.perf_counter()
+    for values in _iter_ndvi_chunks(nir_flat, red_flat, chunk_pixels, ndvi_out):
+        acc.add(values)
+    ndvi_done = time.perf_counter()
+    if timings is not None:
+        timings["ndvi"] = timings.get("ndvi", 0.0) + (ndvi_done - started)
+
+    if median == "approx":
+        return acc.result()
+    if ndvi_out is not None:
+        chunks = (ndvi_out[i:i + chunk_pixels] for i in range(0, ndvi_out.size, chunk_pixels))
+    else:
+        chunks = _iter_ndvi_chunks(nir_flat, red_flat, chunk_pixels)
+    value = exact_median(acc, chunks)
+    if timings is not None:
+        timings["median"] = timings.get("median", 0.0) + (time.perf_counter() - ndvi_done)
+    return acc.result(median=value)
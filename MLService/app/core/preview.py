@@ -0,0 +1,142 @@
+"""
+Fast NDVI preview rendering.
+
+The NDVI raster is reduced to (a small multiple of) the target size *before* any colour work:
+a strided pick of PREVIEW_SUPERSAMPLE x PREVIEW_SUPERSAMPLE samples per output pixel followed by
+their mean, so the cost depends on the preview size, not on the input resolution (on a memory-
+mapped raster only the picked rows/pixels are touched). The reduced values are quantised to
+0..255 and coloured through a precomputed 256-entry RGB lookup table.
+
+Palettes are defined by colour stops; "default" is the brown -> yellow -> green ramp the
+service has always used.
+
+Config (env):
+  NDVI_PREVIEW_SIZE         default longest side in pixels  (default: 256)
+  NDVI_PREVIEW_MAX_SIZE     largest size a client may ask   (default: 2048)
+  NDVI_PREVIEW_PALETTE      default palette                 (default: default)
+  NDVI_PREVIEW_SUPERSAMPLE  samples per output pixel, per axis (default: 2)
+"""
+
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+NDVI_PREVIEW_SIZE = int(os.getenv("NDVI_PREVIEW_SIZE", "256"))
+NDVI_PREVIEW_MAX_SIZE = int(os.getenv("NDVI_PREVIEW_MAX_SIZE", "2048"))
+NDVI_PREVIEW_PALETTE = os.getenv("NDVI_PREVIEW_PALETTE", "default")
+PREVIEW_SUPERSAMPLE = max(1, int(os.getenv("NDVI_PREVIEW_SUPERSAMPLE", "2")))
+
+IMAGE_FORMATS = {"png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+
+# colour stops (position 0..1 over vmin..vmax, (r, g, b))
+PALETTE_STOPS = {
+    "default": [(0.0, (220, 180, 150)), (1.0, (80, 200, 50))],
+    "rdylgn": [(0.0, (165, 0, 38)), (0.25, (244, 109, 67)), (0.5, (255, 255, 191)),
+               (0.75, (102, 189, 99)), (1.0, (0, 104, 55))],
+    "viridis": [(0.0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)),
+                (0.75, (94, 201, 98)), (1.0, (253, 231, 37))],
+    "gray": [(0.0, (0, 0, 0)), (1.0, (255, 255, 255))],
+}
+
+
+def _build_lut(stops) -> np.ndarray:
+    pos = np.array([p for p, _ in stops], dtype=np.float64)
+    cols = np.array([c for _, c in stops], dtype=np.float64)
+    x = np.arange(256) / 255.0
+    lut = np.stack([np.interp(x, pos, cols[:, i]) for i in range(3)], axis=-1)
+    return lut.astype(np.uint8)
+
+
+PALETTES = {name: _build_lut(stops) for name, stops in PALETTE_STOPS.items()}
+
+
+def get_palette(name=None) -> np.ndarray:
+    """256 x 3 uint8 LUT for a palette name (ValueError if unknown)."""
+    name = name or NDVI_PREVIEW_PALETTE
+    try:
+        return PALETTES[name]
+    except KeyError:
+        raise ValueError(f"unknown palette {name!r}; available: {sorted(PALETTES)}")
+
+
+def fit_size(height, width, max_side) -> tuple:
+    """(out_h, out_w) with the longest side max_side, keeping the aspect ratio and never upscaling."""
+    scale = min(1.0, float(max_side) / max(height, width, 1))
+    return max(1, int(round(height * scale))), max(1, int(round(width * scale)))
+
+
+def downsample(arr, out_h, out_w, supersample=PREVIEW_SUPERSAMPLE, nodata=None, scale=1.0) -> np.ndarray:
+    """
+    Reduce a 2D array to (out_h, out_w) float32: strided pick of supersample^2 samples per
+    output pixel, then their NaN-aware mean. Works on memory-mapped arrays without reading them whole.
+    Integer-encoded rasters are decoded on the picked samples only (nodata -> NaN, divided by scale).
+    """
+    h, w = arr.shape
+    sh, sw = min(h, out_h * supersample), min(w, out_w * supersample)
+    rows = (np.arange(sh) * h) // sh
+    cols = (np.arange(sw) * w) // sw
+    raw = arr[np.ix_(rows, cols)]
+    picked = raw.astype(np.float32)
+    if nodata is not None:
+        picked[raw == nodata] = np.nan
+    if scale != 1.0:
+        picked /= np.float32(scale)
+    if (sh, sw) == (out_h, out_w):
+        return picked
+    # uneven factors: map each picked sample to its output pixel and average with bincount
+    oy = (np.arange(sh) * out_h) // sh
+    ox = (np.arange(sw) * out_w) // sw
+    cell = (oy[:, None] * out_w + ox[None, :]).ravel()
+    values = picked.ravel()
+    finite = np.isfinite(values)
+    sums = np.bincount(cell[finite], weights=values[finite], minlength=out_h * out_w)
+    counts = np.bincount(cell[finite], minlength=out_h * out_w)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (sums / counts).astype(np.float32)
+    return out.reshape(out_h, out_w)
+
+
+def colorize(ndvi, palette=None, vmin=-1.0, vmax=1.0) -> np.ndarray:
+    """
+    NDVI (float, NaN = nodata) -> uint8 RGB, or RGBA with transparent nodata when any NaN is present.
+    """
+    lut = get_palette(palette) if not isinstance(palette, np.ndarray) else palette
+    finite = np.isfinite(ndvi)
+    scaled = (np.where(finite, ndvi, vmin) - vmin) * (255.0 / (vmax - vmin))
+    idx = np.clip(scaled, 0, 255).astype(np.uint8)
+    rgb = lut[idx]
+    if finite.all():
+        return rgb
+    alpha = np.where(finite, 255, 0).astype(np.uint8)
+    return np.dstack([rgb, alpha])
+
+
+def encode_image(pixels, fmt="png") -> bytes:
+    pil_format, _ = IMAGE_FORMATS[fmt]
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format=pil_format)
+    return buf.getvalue()
+
+
+def render_preview(ndvi, size=None, palette=None, fmt="png", vmin=-1.0, vmax=1.0, exact_size=None,
+                   nodata=None, scale=1.0) -> bytes:
+    """
+    Encoded preview of an NDVI array. size is the longest side (aspect kept); exact_size=(w, h)
+    forces the output dimensions instead. nodata / scale decode integer-encoded rasters.
+    """
+    size = min(int(size or NDVI_PREVIEW_SIZE), NDVI_PREVIEW_MAX_SIZE)
+    if size <= 0:
+        raise ValueError("preview size must be positive")
+    lut = get_palette(palette)
+    if exact_size:
+        out_w, out_h = exact_size
+    else:
+        out_h, out_w = fit_size(ndvi.shape[0], ndvi.shape[1], size)
+    small = downsample(ndvi, min(out_h, ndvi.shape[0]), min(out_w, ndvi.shape[1]), nodata=nodata, scale=scale)
+    pixels = colorize(small, lut, vmin, vmax)
+    if pixels.shape[:2] != (out_h, out_w):
+        # only reached when upscaling a raster smaller than the requested size
+        pixels = np.asarray(Image.fromarray(pixels).resize((out_w, out_h), Image.BILINEAR))
+    return encode_image(pixels, fmt)
@@ -0,0 +1,192 @@
+"""
+Opt-in per-request profiling of the NDVI compute pipeline.
+
+A profiled request runs its pool job under:
+  - a sampling profiler: a daemon thread snapshots the calling thread's Python stack every
+    NDVI_PROFILE_INTERVAL_MS (sys._current_frames) and counts collapsed stacks, so the output
+    feeds flamegraph.pl / speedscope directly and the overhead stays flat regardless of how many
+    functions are called;
+  - tracemalloc: peak traced memory and the top allocation sites of the job.
+Reports are JSON files under NDVI_PROFILE_DIR (newest NDVI_PROFILE_KEEP kept) and are served by
+GET /v1/ndvi/profiles/{id}. A request is profiled when it is picked by NDVI_PROFILE_SAMPLE_RATE
+or asks for it with the X-NDVI-Profile header; profiled requests always bypass the result cache.
+tracemalloc slows numpy-heavy code noticeably and every profile writes a file, which is why the
+header is ignored unless enabled:
+  - NDVI_PROFILE_TOKEN=<secret>: requests sending `X-NDVI-Profile: <secret>` are profiled;
+  - NDVI_PROFILE_ALLOW_HEADER=1 (trusted networks / dev only): any `X-NDVI-Profile: 1` is.
+
+Config (env):
+  NDVI_PROFILE_TOKEN           secret X-NDVI-Profile value that triggers a profile (default: unset)
+  NDVI_PROFILE_ALLOW_HEADER    honour `X-NDVI-Profile: 1` from any client   (default: 0)
+  NDVI_PROFILE_SAMPLE_RATE     fraction of compute requests profiled, 0..1  (default: 0)
+  NDVI_PROFILE_INTERVAL_MS     stack sampling interval                      (default: 5)
+  NDVI_PROFILE_TRACEMALLOC     1 / 0: also record allocations               (default: 1)
+  NDVI_PROFILE_DIR             report directory                             (default: data/profiles)
+  NDVI_PROFILE_KEEP            reports kept on disk                         (default: 50)
+"""
+
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger("ml_service")
+
+NDVI_PROFILE_TOKEN = os.getenv("NDVI_PROFILE_TOKEN") or None
+NDVI_PROFILE_ALLOW_HEADER = os.getenv("NDVI_PROFILE_ALLOW_HEADER", "0") not in ("0", "false", "False", "")
+NDVI_PROFILE_SAMPLE_RATE = float(os.getenv("NDVI_PROFILE_SAMPLE_RATE", "0"))
+NDVI_PROFILE_INTERVAL_MS = float(os.getenv("NDVI_PROFILE_INTERVAL_MS", "5"))
+NDVI_PROFILE_TRACEMALLOC = os.getenv("NDVI_PROFILE_TRACEMALLOC", "1") not in ("0", "false", "False", "")
+NDVI_PROFILE_DIR = os.getenv("NDVI_PROFILE_DIR", os.path.join("data", "profiles"))
+NDVI_PROFILE_KEEP = int(os.getenv("NDVI_PROFILE_KEEP", "50"))
+
+TOP_STACKS = 50
+TOP_ALLOCATIONS = 20
+
+
+def profile_trigger(header: Optional[str]) -> Optional[str]:
+    """'header' / 'sample' when this request should be profiled, else None."""
+    if header and _header_allowed(header.strip()):
+        return "header"
+    if NDVI_PROFILE_SAMPLE_RATE > 0 and random.random() < NDVI_PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+def _header_allowed(value: str) -> bool:
+    if NDVI_PROFILE_TOKEN:
+        return hmac.compare_digest(value.encode("utf-8"), NDVI_PROFILE_TOKEN.encode("utf-8"))
+    return NDVI_PROFILE_ALLOW_HEADER and value.lower() in ("1", "true", "yes", "on")
+
+
+class StackSampler:
+    """Samples one thread's stack on a background thread and counts collapsed stacks."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ndvi-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def profile_call(fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) under the stack sampler (and tracemalloc) in the current thread.
+    Returns (result, report). Safe to call on a pool worker: the report is a plain dict.
+    """
+    trace = NDVI_PROFILE_TRACEMALLOC and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with StackSampler(threading.get_ident(), NDVI_PROFILE_INTERVAL_MS / 1000.0) as sampler:
+            result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - started
+        report = {
+            "wall_ms": elapsed * 1000,
+            "interval_ms": NDVI_PROFILE_INTERVAL_MS,
+            "samples": sampler.samples,
+            "pid": os.getpid(),
+            "stacks": [{"stack": s, "count": c} for s, c in sampler.stacks.most_common(TOP_STACKS)],
+        }
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            report["tracemalloc"] = {
+                "peak_mb": peak / (1024 * 1024),
+                "top": [
+                    {"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                     "size_kb": stat.size / 1024, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+                ],
+            }
+    finally:
+        if trace:
+            tracemalloc.stop()
+    return result, report
+
+
+class ProfileStore:
+    """Profile reports as JSON files, newest NDVI_PROFILE_KEEP kept."""
+
+    def __init__(self, directory: str = NDVI_PROFILE_DIR, keep: int = NDVI_PROFILE_KEEP):
+        self.directory = directory
+        self.keep = max(1, keep)
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, report: dict) -> str:
+        profile_id = uuid.uuid4().hex
+        report = dict(report, id=profile_id, created_at=time.time())
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(profile_id) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        os.replace(tmp, self._path(profile_id))
+        self._prune()
+        logger.info(f"Stored NDVI profile {profile_id} ({report.get('wall_ms', 0):.0f} ms, {report.get('samples', 0)} samples)")
+        return profile_id
+
+    def load(self, profile_id: str) -> Optional[dict]:
+        if not profile_id.isalnum():
+            return None
+        try:
+            with open(self._path(profile_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list(self) -> list:
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".json")]
+        except FileNotFoundError:
+            return []
+        paths = sorted((os.path.join(self.directory, n) for n in names), key=os.path.getmtime, reverse=True)
+        return [os.path.basename(p)[:-5] for p in paths]
+
+    def _prune(self):
+        for profile_id in self.list()[self.keep:]:
+            try:
+                os.remove(self._path(profile_id))
+            except OSError:
+                pass
+
+
+def collapsed(report: dict) -> str:
+    """Brendan Gregg collapsed-stack text ("frame;frame;frame count") of a report."""
+    return "".join(f"{s['stack']} {s['count']}\n" for s in report.get("stacks", []))
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,202 @@
+"""
+Quick-look (approximate) NDVI statistics from a pixel sample, with confidence intervals.
+
+Exact stats touch every pixel twice (NDVI pass + selective median pass). A quick look instead
+evaluates NDVI on about NDVI_QUICK_SAMPLE_PIXELS pixels:
+  - strided: a regular grid (stride s in both directions, centred in each s x s cell); cheap,
+    cache friendly and deterministic, the default;
+  - random:  uniform random positions (fixed seed, so a repeat gives the same estimate);
+  - rasters (compute_ndvi_from_paths): a nearest-neighbour decimated read of the polygon
+    window, which GDAL serves from the overviews when the file has them.
+Both bands are sampled at the same normalised positions, so bands of different sizes need no
+resize first. Estimates come with CONFIDENCE-level intervals:
+  mean_ndvi    normal interval, mean +- z * sd / sqrt(n) (finite-population corrected)
+  median_ndvi  distribution-free order-statistic interval (ranks n/2 +- z * sqrt(n) / 2)
+  pct_stress   Wilson score interval
+and the histogram counts are scaled up to the population. When the sample would cover the
+whole grid anyway, the exact kernel runs instead (zero-width intervals). Nodata / masked
+pixels are dropped from the sample, and the population is the valid fraction of the sample
+times the grid size.
+
+Config (env):
+  NDVI_QUICK_SAMPLE_PIXELS   pixels sampled for a quick look                   (default: 65536)
+  NDVI_QUICK_CONFIDENCE      confidence level of the reported intervals        (default: 0.95)
+  NDVI_QUICK_SEED            seed of the random sampler                        (default: 0)
+"""
+
+import math
+import os
+import time
+from statistics import NormalDist
+from typing import Optional
+
+import numpy as np
+
+from app.core.ndvi_stats import NDVIStatsAccumulator, combine_masks, compute_ndvi_stats, coverage, ndvi_chunk
+
+NDVI_QUICK_SAMPLE_PIXELS = max(1, int(os.getenv("NDVI_QUICK_SAMPLE_PIXELS", "65536")))
+NDVI_QUICK_CONFIDENCE = float(os.getenv("NDVI_QUICK_CONFIDENCE", "0.95"))
+NDVI_QUICK_SEED = int(os.getenv("NDVI_QUICK_SEED", "0"))
+
+SAMPLE_METHODS = ("strided", "random")
+
+
+def approx_mode(value) -> Optional[str]:
+    """Sampling method requested by an `approx` flag: None (exact), "strided" or "random"."""
+    if value is None or value is False:
+        return None
+    text = str(value).strip().lower()
+    if text in ("", "0", "false", "no", "off", "exact"):
+        return None
+    if text in ("1", "true", "yes", "on"):
+        return "strided"
+    if text not in SAMPLE_METHODS:
+        raise ValueError(f"unknown approx mode {value!r}, expected one of {SAMPLE_METHODS} (or true / false)")
+    return text
+
+
+# ---------- sampling ----------
+def sample_positions(shape, sample_pixels: int = NDVI_QUICK_SAMPLE_PIXELS, method: str = "strided", seed: int = NDVI_QUICK_SEED):
+    """
+    Normalised (row, col) sample positions in [0, 1) over a grid of shape (h, w).
+    strided returns the two axes of a regular grid (to be combined with np.ix_), random
+    returns two aligned coordinate vectors.
+    """
+    h, w = int(shape[0]), int(shape[1])
+    if method == "random":
+        rng = np.random.default_rng(seed)
+        n = min(sample_pixels, h * w)
+        return (rng.integers(0, h, n) + 0.5) / h, (rng.integers(0, w, n) + 0.5) / w
+    stride = max(1, int(math.ceil(math.sqrt(h * w / float(sample_pixels)))))
+    return (np.arange(stride // 2, h, stride) + 0.5) / h, (np.arange(stride // 2, w, stride) + 0.5) / w
+
+
+def take_sample(arr: np.ndarray, rows: np.ndarray, cols: np.ndarray, grid: bool) -> np.ndarray:
+    """Pixels of a 2D band at normalised positions (nearest pixel in this band's own shape)."""
+    r = np.minimum((rows * arr.shape[0]).astype(np.intp), arr.shape[0] - 1)
+    c = np.minimum((cols * arr.shape[1]).astype(np.intp), arr.shape[1] - 1)
+    if grid:
+        return arr[np.ix_(r, c)].reshape(-1)
+    return arr[r, c]
+
+
+def sample_bands(nir: np.ndarray, red: np.ndarray, sample_pixels: int = NDVI_QUICK_SAMPLE_PIXELS,
+                 method: str = "strided", seed: int = NDVI_QUICK_SEED, valid_masks=()):
+    """
+    (nir sample, red sample, keep) at the same positions, sized by the nir grid. keep marks the
+    samples valid in every mask of valid_masks (each on its own band's grid; None entries are
+    skipped), or is None without masks.
+    """
+    if method not in SAMPLE_METHODS:
+        raise ValueError(f"unknown sampling method {method!r}, expected one of {SAMPLE_METHODS}")
+    rows, cols = sample_positions(nir.shape, sample_pixels, method, seed)
+    grid = method == "strided"
+    keep = combine_masks(*(take_sample(v, rows, cols, grid) for v in valid_masks if v is not None))
+    return take_sample(nir, rows, cols, grid), take_sample(red, rows, cols, grid), keep
+
+
+# ---------- estimates ----------
+def _z(level: float) -> float:
+    return NormalDist().inv_cdf(0.5 + level / 2.0)
+
+
+def _wilson(successes: int, n: int, z: float):
+    if n == 0:
+        return [0.0, 1.0]
+    p = successes / n
+    denom = 1.0 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return [max(0.0, centre - half), min(1.0, centre + half)]
+
+
+def sample_estimates(values: np.ndarray, stress_threshold: float, population: int, method: str,
+                     level: float = NDVI_QUICK_CONFIDENCE) -> dict:
+    """
+    Stats of a population estimated from an NDVI sample (values clipped to -1..1, NaN = nodata).
+    Returns the usual stats dict (mean_ndvi, median_ndvi, pct_stress, stress_threshold,
+    histogram, pixel_count) plus "approximate": {method, sample_pixels, population_pixels,
+    confidence, intervals}.
+    """
+    acc = NDVIStatsAccumulator(stress_threshold)
+    acc.add(values)
+    finite = values[np.isfinite(values)] if acc.count != values.size else values
+    # NaN samples carry no NDVI: every estimate is over the n finite ones, standing for the
+    # finite part of the population (the reported pixel_count)
+    n, sampled = acc.count, int(values.size)
+    scale = population / float(sampled) if sampled else 0.0
+    finite_population = n * scale
+    z = _z(level)
+    exact = sampled >= population
+
+    # undefined without a finite sample (None, like the exact stats)
+    median = None
+    median_ci = [None, None]
+    mean_ci = [None, None]
+    if n:
+        lo_rank = max(0, int(math.floor(n / 2.0 - z * math.sqrt(n) / 2.0)))
+        hi_rank = min(n - 1, int(math.ceil(n / 2.0 + z * math.sqrt(n) / 2.0)))
+        mid = ((n - 1) // 2, n // 2)
+        part = np.partition(finite, sorted({lo_rank, hi_rank, *mid}))
+        median = (float(part[mid[0]]) + float(part[mid[1]])) / 2.0
+        median_ci = [float(part[lo_rank]), float(part[hi_rank])]
+        mean = acc.total / n
+        sd = float(finite.std(dtype=np.float64)) if n > 1 else 0.0
+        fpc = math.sqrt(max(0.0, (finite_population - n) / (finite_population - 1))) if finite_population > 1 else 0.0
+        half = z * sd / math.sqrt(n) * fpc
+        mean_ci = [mean - half, mean + half]
+    pct = acc.below / n if n else 0.0
+    pct_ci = _wilson(acc.below, n, z)
+    if exact:
+        # the sample is the population: intervals collapse onto the estimates
+        median_ci, pct_ci = [median, median], [pct, pct]
+
+    result = acc.result(median=median)
+    result["pct_stress"] = pct
+    result["histogram"]["bins"] = [int(round(c * scale)) for c in result["histogram"]["bins"]]
+    result["pixel_count"] = int(round(finite_population))
+    result["approximate"] = {
+        "method": method,
+        "sample_pixels": sampled,
+        "population_pixels": int(population),
+        "confidence": level,
+        "intervals": {"mean_ndvi": mean_ci, "median_ndvi": median_ci, "pct_stress": pct_ci},
+    }
+    return result
+
+
+def sampled_ndvi_stats(nir: np.ndarray, red: np.ndarray, stress_threshold: float, method: str = "strided",
+                       sample_pixels: int = NDVI_QUICK_SAMPLE_PIXELS, seed: int = NDVI_QUICK_SEED,
+                       timings: Optional[dict] = None, nir_valid: Optional[np.ndarray] = None,
+                       red_valid: Optional[np.ndarray] = None) -> dict:
+    """
+    Quick-look counterpart of compute_ndvi_stats: NDVI on a sample of the nir grid (red is
+    sampled at the same relative positions, so the shapes may differ). When the sample would
+    cover the whole grid the exact kernel runs instead (still reported as a quick look, with
+    zero-width intervals). nir_valid / red_valid: optional validity masks of each band's grid;
+    the stats then carry valid_pixel_count / area_pixel_count / coverage_fraction (estimated).
+    """
+    area = int(nir.shape[0]) * int(nir.shape[1])
+    if area <= sample_pixels and nir.shape == red.shape:
+        stats = compute_ndvi_stats(nir, red, stress_threshold, timings=timings, valid=combine_masks(nir_valid, red_valid))
+        population = stats.get("valid_pixel_count", area)
+        stats["approximate"] = {
+            "method": "exact",
+            "sample_pixels": population,
+            "population_pixels": population,
+            "confidence": NDVI_QUICK_CONFIDENCE,
+            "intervals": {k: [stats[k], stats[k]] for k in ("mean_ndvi", "median_ndvi", "pct_stress")},
+        }
+        return stats
+    started = time.perf_counter()
+    nir_s, red_s, keep = sample_bands(nir, red, sample_pixels, method, seed, (nir_valid, red_valid))
+    values = ndvi_chunk(nir_s, red_s, np.empty(nir_s.size, dtype=np.float32), np.empty(nir_s.size, dtype=np.float32))
+    population = area
+    if keep is not None:
+        population = int(round(area * np.count_nonzero(keep) / float(keep.size))) if keep.size else 0
+        values = values[keep]
+    stats = sample_estimates(values, stress_threshold, population, method)
+    stats.update(coverage(population, area))
+    if timings is not None:
+        timings["sample"] = timings.get("sample", 0.0) + (time.perf_counter() - started)
+    return stats
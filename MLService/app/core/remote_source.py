@@ -0,0 +1,530 @@
+"""
+Range-read access to remote rasters (s3:// and http(s)://, e.g. Cloud Optimized GeoTIFFs).
+
+rasterio opens remote paths through a Python opener, so every byte GDAL asks for is served from
+fixed-size, aligned chunks of the object:
+  - chunks come from a shared bounded block cache (memory LRU per process + disk tier shared by
+    all workers), keyed by URL, object size and ETag,
+  - missing chunks are coalesced into contiguous ranges (small gaps are bridged) and fetched
+    concurrently over a pooled client (httpx for HTTP, boto3 for S3),
+  - before reading, callers can prefetch exactly the TIFF blocks that overlap a polygon
+    (prefetch_window), so a COG is fetched tile-by-tile instead of downloaded whole.
+Each opened raster gets a RemoteSession that counts requests, bytes fetched, bytes read by GDAL
+and how many of those read bytes came from chunks that were already cached, versus the object size.
+
+Config (env):
+  NDVI_RANGE_CHUNK_KB           cache / request granularity        (default: 256)
+  NDVI_RANGE_MAX_REQUEST_MB     largest single coalesced request   (default: 16)
+  NDVI_RANGE_MAX_GAP_CHUNKS     gap bridged when coalescing        (default: 1)
+  NDVI_RANGE_CONCURRENCY        parallel range requests per read   (default: 8)
+  NDVI_RANGE_META_TTL_SECONDS   how long size/ETag are trusted     (default: 300)
+  NDVI_BLOCK_CACHE_MEMORY_MB    per-process memory tier            (default: 128)
+  NDVI_BLOCK_CACHE_DIR          disk tier directory, empty = off   (default: data/block_cache)
+  NDVI_BLOCK_CACHE_DISK_MAX_MB  disk tier size cap                 (default: 2048)
+  NDVI_HTTP_TIMEOUT_SECONDS     per-request timeout                (default: 30)
+  NDVI_S3_ENDPOINT_URL          S3-compatible endpoint (MinIO, ...) (default: AWS)
+  NDVI_S3_REGION                region                              (default: boto3 default)
+"""
+
+import hashlib
+import io
+import logging
+import math
+import os
+import posixpath
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger("ml_service")
+
+NDVI_RANGE_CHUNK_BYTES = int(os.getenv("NDVI_RANGE_CHUNK_KB", "256")) * 1024
+NDVI_RANGE_MAX_REQUEST_BYTES = int(float(os.getenv("NDVI_RANGE_MAX_REQUEST_MB", "16")) * 1024 * 1024)
+NDVI_RANGE_MAX_GAP_CHUNKS = int(os.getenv("NDVI_RANGE_MAX_GAP_CHUNKS", "1"))
+NDVI_RANGE_CONCURRENCY = int(os.getenv("NDVI_RANGE_CONCURRENCY", "8"))
+NDVI_RANGE_META_TTL_SECONDS = float(os.getenv("NDVI_RANGE_META_TTL_SECONDS", "300"))
+NDVI_BLOCK_CACHE_MEMORY_MB = float(os.getenv("NDVI_BLOCK_CACHE_MEMORY_MB", "128"))
+NDVI_BLOCK_CACHE_DIR = os.getenv("NDVI_BLOCK_CACHE_DIR", os.path.join("data", "block_cache"))
+NDVI_BLOCK_CACHE_DISK_MAX_MB = float(os.getenv("NDVI_BLOCK_CACHE_DISK_MAX_MB", "2048"))
+NDVI_HTTP_TIMEOUT_SECONDS = float(os.getenv("NDVI_HTTP_TIMEOUT_SECONDS", "30"))
+NDVI_S3_ENDPOINT_URL = os.getenv("NDVI_S3_ENDPOINT_URL") or None
+NDVI_S3_REGION = os.getenv("NDVI_S3_REGION") or None
+
+_CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+def is_remote(path) -> bool:
+    return isinstance(path, str) and path.startswith(("s3://", "http://", "https://"))
+
+
+# ---------- block cache ----------
+class BlockCache:
+    """Bounded cache of object chunks: memory LRU (bytes-capped) in front of a size-capped disk tier."""
+
+    def __init__(self, memory_mb=NDVI_BLOCK_CACHE_MEMORY_MB, directory=NDVI_BLOCK_CACHE_DIR,
+                 disk_max_mb=NDVI_BLOCK_CACHE_DISK_MAX_MB):
+        self.memory_max_bytes = int(memory_mb * 1024 * 1024)
+        self.directory = directory or None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.blk")
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+        self._memory_put(key, data)
+        return data
+
+    def _memory_put(self, key, data):
+        if self.memory_max_bytes <= 0:
+            return
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= len(old)
+            self._memory[key] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_max_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def put(self, key, data: bytes):
+        self._memory_put(key, data)
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"block cache: could not write {path}: {e}")
+            return
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".blk"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict_disk(self):
+        entries = sorted(self._scan_disk())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def stats(self) -> dict:
+        return {
+            "memory_bytes": self._memory_bytes,
+            "memory_max_bytes": self.memory_max_bytes,
+            "memory_entries": len(self._memory),
+            "disk_dir": self.directory,
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+        }
+
+
+# ---------- transports ----------
+def _parse_content_range(value):
+    m = _CONTENT_RANGE_RE.match(value or "")
+    if not m or m.group(3) == "*":
+        return None
+    return int(m.group(3))
+
+
+class HttpTransport:
+    """Ranged GETs over one pooled httpx.Client (keep-alive, shared by all threads of a worker)."""
+
+    def __init__(self):
+        import httpx
+
+        self.client = httpx.Client(
+            timeout=NDVI_HTTP_TIMEOUT_SECONDS,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=NDVI_RANGE_CONCURRENCY * 2,
+                                max_keepalive_connections=NDVI_RANGE_CONCURRENCY),
+        )
+
+    def get_range(self, url, start, end):
+        """Bytes [start, end] (inclusive); returns (data, object_size, etag)."""
+        resp = self.client.get(url, headers={"Range": f"bytes={start}-{end}"})
+        if resp.status_code == 416:
+            return b"", _parse_content_range(resp.headers.get("content-range")) or 0, resp.headers.get("etag")
+        resp.raise_for_status()
+        data = resp.content
+        if resp.status_code == 200:
+            # server ignored the Range header: whole object came back
+            size = len(data)
+            data = data[start:end + 1]
+        else:
+            size = _parse_content_range(resp.headers.get("content-range"))
+        return data, size, resp.headers.get("etag")
+
+
+class S3Transport:
+    """Ranged get_object calls over one boto3 client (its urllib3 pool is reused across threads)."""
+
+    def __init__(self):
+        import boto3
+        from botocore.config import Config
+
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=NDVI_S3_ENDPOINT_URL,
+            region_name=NDVI_S3_REGION,
+            config=Config(max_pool_connections=NDVI_RANGE_CONCURRENCY * 2,
+                          s3={"addressing_style": "path" if NDVI_S3_ENDPOINT_URL else "auto"},
+                          connect_timeout=NDVI_HTTP_TIMEOUT_SECONDS, read_timeout=NDVI_HTTP_TIMEOUT_SECONDS),
+        )
+
+    @staticmethod
+    def _split(url):
+        bucket, _, key = url[len("s3://"):].partition("/")
+        return bucket, key
+
+    def get_range(self, url, start, end):
+        bucket, key = self._split(url)
+        resp = self.client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+        data = resp["Body"].read()
+        size = _parse_content_range(resp.get("ContentRange"))
+        if size is None:
+            # no ContentRange: ContentLength is the length of this response, not of the object
+            size = self.client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+            if len(data) > end - start + 1:
+                # the store ignored Range: whole object came back
+                data = data[start:end + 1]
+        return data, size, resp.get("ETag")
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def transport_for(url):
+    scheme = "s3" if url.startswith("s3://") else "http"
+    with _transports_lock:
+        if scheme not in _transports:
+            _transports[scheme] = S3Transport() if scheme == "s3" else HttpTransport()
+        return _transports[scheme]
+
+
+# ---------- remote objects ----------
+class RemoteSession:
+    """I/O accounting for one opened raster."""
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.bytes_read = 0
+        self.bytes_from_cache = 0
+        self.dataset = None
+        self._lock = threading.Lock()
+
+    def count(self, requests=0, fetched=0, read=0, cached=0):
+        with self._lock:
+            self.requests += requests
+            self.bytes_fetched += fetched
+            self.bytes_read += read
+            self.bytes_from_cache += cached
+
+    def stats(self) -> dict:
+        return {
+            "url": self.obj.url,
+            "file_bytes": self.obj.size,
+            "bytes_fetched": self.bytes_fetched,
+            "bytes_read": self.bytes_read,
+            "bytes_from_cache": self.bytes_from_cache,
+            "requests": self.requests,
+            "fetched_fraction": (self.bytes_fetched / self.obj.size) if self.obj.size else 0.0,
+        }
+
+
+class RemoteObject:
+    """Chunked, cached view of one remote object."""
+
+    def __init__(self, url, cache, chunk_bytes=NDVI_RANGE_CHUNK_BYTES):
+        self.url = url
+        self.cache = cache
+        self.chunk = chunk_bytes
+        self.transport = transport_for(url)
+        self.size = None
+        self.etag = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _key(self, index):
+        ident = f"{self.url}|{self.size}|{self.etag}|{self.chunk}|{index}"
+        return hashlib.blake2b(ident.encode("utf-8"), digest_size=20).hexdigest()
+
+    def refresh(self, session):
+        """(Re)learn size and ETag with a ranged GET of the first chunk, which is cached as well."""
+        with self._lock:
+            if self.size is not None and time.monotonic() - self._checked_at < NDVI_RANGE_META_TTL_SECONDS:
+                return
+            data, size, etag = self.transport.get_range(self.url, 0, self.chunk - 1)
+            session.count(requests=1, fetched=len(data))
+            self.size, self.etag, self._checked_at = size, etag, time.monotonic()
+            if self.size is None:
+                raise IOError(f"{self.url}: server did not report the object size")
+            self.cache.put(self._key(0), data)
+
+    def _ranges(self, indexes):
+        """Coalesce sorted chunk indexes into (first, last) runs, bridging small gaps."""
+        runs = []
+        per_request = max(1, NDVI_RANGE_MAX_REQUEST_BYTES // self.chunk)
+        for i in indexes:
+            if runs and i - runs[-1][1] <= NDVI_RANGE_MAX_GAP_CHUNKS + 1 and i - runs[-1][0] < per_request:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+        return runs
+
+    def _fetch_run(self, first, last, session):
+        start = first * self.chunk
+        end = min(self.size, (last + 1) * self.chunk) - 1
+        data, _, _ = self.transport.get_range(self.url, start, end)
+        session.count(requests=1, fetched=len(data))
+        chunks = {}
+        for i in range(first, last + 1):
+            piece = data[(i - first) * self.chunk:(i - first + 1) * self.chunk]
+            self.cache.put(self._key(i), piece)
+            chunks[i] = piece
+        return chunks
+
+    def chunks(self, indexes, session):
+        """
+        Chunk bytes for the given indexes: cached ones directly, missing ones in concurrent coalesced
+        requests. Returns ({index: bytes}, indexes that were served from the cache).
+        """
+        found, missing = {}, []
+        for i in sorted(set(indexes)):
+            data = self.cache.get(self._key(i))
+            if data is None:
+                missing.append(i)
+            else:
+                found[i] = data
+        cached = set(found)
+        if missing:
+            runs = self._ranges(missing)
+            if len(runs) == 1:
+                found.update(self._fetch_run(runs[0][0], runs[0][1], session))
+            else:
+                with ThreadPoolExecutor(max_workers=min(NDVI_RANGE_CONCURRENCY, len(runs))) as pool:
+                    for fetched in pool.map(lambda r: self._fetch_run(r[0], r[1], session), runs):
+                        found.update(fetched)
+        return found, cached
+
+    def read(self, offset, length, session) -> bytes:
+        if length <= 0 or offset >= self.size:
+            return b""
+        end = min(self.size, offset + length)
+        first, last = offset // self.chunk, (end - 1) // self.chunk
+        chunks, cached = self.chunks(range(first, last + 1), session)
+        # only the part of each cached chunk this read actually uses counts as served from the cache
+        from_cache = sum(min(end, (i + 1) * self.chunk) - max(offset, i * self.chunk) for i in cached)
+        session.count(read=end - offset, cached=from_cache)
+        buf = b"".join(chunks[i] for i in range(first, last + 1))
+        skip = offset - first * self.chunk
+        return buf[skip:skip + (end - offset)]
+
+    def prefetch(self, byte_ranges, session):
+        """Warm the cache for [(offset, length), ...] in as few concurrent requests as possible."""
+        indexes = set()
+        for offset, length in byte_ranges:
+            if length > 0:
+                indexes.update(range(offset // self.chunk, (min(self.size, offset + length) - 1) // self.chunk + 1))
+        if indexes:
+            self.chunks(indexes, session)
+
+
+class RemoteFile(io.RawIOBase):
+    """Seekable read-only file over a RemoteObject, handed to GDAL by the rasterio opener."""
+
+    def __init__(self, obj, session):
+        self.obj = obj
+        self.session = session
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.pos = self.obj.size + offset
+        return self.pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.obj.size - self.pos
+        data = self.obj.read(self.pos, size, self.session)
+        self.pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class _Opener:
+    """Filesystem-style rasterio opener exposing exactly one remote object (sidecar probes miss)."""
+
+    def __init__(self, obj, session):
+        self.obj = obj
+        self.session = session
+
+    def open(self, path, mode="rb"):
+        if path != self.obj.url:
+            raise FileNotFoundError(path)
+        return RemoteFile(self.obj, self.session)
+
+    def size(self, path):
+        return self.obj.size
+
+    def isfile(self, path):
+        return path == self.obj.url
+
+    def isdir(self, path):
+        return False
+
+    def ls(self, path):
+        # a listing with only the raster itself lets GDAL skip .aux.xml / .ovr / .msk probes
+        return [posixpath.basename(self.obj.url)]
+
+    def mtime(self, path):
+        return 0
+
+
+_objects = {}
+_objects_lock = threading.Lock()
+block_cache = BlockCache()
+
+
+def remote_object(url) -> RemoteObject:
+    with _objects_lock:
+        obj = _objects.get(url)
+        if obj is None:
+            obj = _objects[url] = RemoteObject(url, block_cache)
+        return obj
+
+
+@contextmanager
+def open_remote_raster(url):
+    """Open a remote raster with rasterio through the range-read layer; yields (dataset, session)."""
+    import rasterio
+
+    obj = remote_object(url)
+    session = RemoteSession(obj)
+    obj.refresh(session)
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"):
+        with rasterio.open(url, opener=_Opener(obj, session)) as src:
+            session.dataset = src
+            yield src, session
+
+
+def prefetch_window(src, session, window, geometry=None):
+    """
+    Fetch, in coalesced concurrent requests, every TIFF block of src that overlaps window
+    (and the prepared shapely geometry, if given). No-op when the format exposes no block offsets.
+    """
+    from rasterio.windows import Window, bounds as window_bounds
+    from shapely.geometry import box
+
+    block_h, block_w = src.block_shapes[0]
+    r0 = max(0, int(window.row_off)) // block_h
+    c0 = max(0, int(window.col_off)) // block_w
+    r1 = min(src.height, int(math.ceil(window.row_off + window.height)))
+    c1 = min(src.width, int(math.ceil(window.col_off + window.width)))
+    # pixel-interleaved blocks hold every band; band-separate layouts need one offset per band
+    bands = [1] if src.count == 1 or src.interleaving is None or src.interleaving.name == "PIXEL" else list(src.indexes)
+    ranges = []
+    for row in range(r0, (r1 - 1) // block_h + 1):
+        for col in range(c0, (c1 - 1) // block_w + 1):
+            if geometry is not None:
+                block = Window(col * block_w, row * block_h, block_w, block_h)
+                if not geometry.intersects(box(*window_bounds(block, src.transform))):
+                    continue
+            for bidx in bands:
+                offset = src.get_tag_item(f"BLOCK_OFFSET_{col}_{row}", "TIFF", bidx=bidx)
+                size = src.get_tag_item(f"BLOCK_SIZE_{col}_{row}", "TIFF", bidx=bidx)
+                if offset is None or size is None:
+                    return
+                ranges.append((int(offset), int(size)))
+    session.obj.prefetch(ranges, session)
+
+
+def summarize_io(sessions) -> dict:
+    """Aggregate I/O stats of the remote sessions used by one computation (None when all inputs were local)."""
+    sessions = list(sessions)
+    if not sessions:
+        return None
+    files = {}
+    for s in sessions:
+        files[s.obj.url] = s.obj.size or 0
+    fetched = sum(s.bytes_fetched for s in sessions)
+    total = sum(files.values())
+    return {
+        "sources": [s.stats() for s in sessions],
+        "file_bytes": total,
+        "bytes_fetched": fetched,
+        "bytes_read": sum(s.bytes_read for s in sessions),
+        "bytes_from_cache": sum(s.bytes_from_cache for s in sessions),
+        "requests": sum(s.requests for s in sessions),
+        "fetched_fraction": (fetched / total) if total else 0.0,
+    }
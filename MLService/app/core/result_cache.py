@@ -0,0 +1,235 @@
+"""
+Content-addressed cache of NDVI pipeline results.
+
+Keys are a BLAKE2b hash of the raw band inputs (uploaded bytes or JSON arrays) plus the stress
+threshold and pipeline version, so a re-upload of the same imagery (client retries, History
+re-analysis, n8n replays) is answered without decoding anything. Two tiers:
+  - memory: bounded LRU of recent results,
+  - disk: one small JSON file per key under NDVI_RESULT_CACHE_DIR, survives restarts, bounded
+          in total size with least-recently-used eviction (reads refresh the file mtime). The
+          directory is shared by every web worker of the host, so a result computed by one
+          worker is a disk hit (then a memory hit) for the others.
+
+Config (env):
+  NDVI_RESULT_CACHE_ENABLED         1 / 0                (default: 1)
+  NDVI_RESULT_CACHE_MEMORY_ENTRIES  memory tier entries  (default: 2048)
+  NDVI_RESULT_CACHE_DIR             disk tier directory  (default: data/ndvi_cache; empty disables)
+  NDVI_RESULT_CACHE_DISK_MAX_MB     disk tier size cap   (default: 256)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.upload_spool import SpooledUpload, content_digest
+
+logger = logging.getLogger("ml_service")
+
+# bump when the NDVI math changes so stale results are not served
+PIPELINE_VERSION = "3"
+
+NDVI_RESULT_CACHE_ENABLED = os.getenv("NDVI_RESULT_CACHE_ENABLED", "1") not in ("0", "false", "False", "")
+NDVI_RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv("NDVI_RESULT_CACHE_MEMORY_ENTRIES", "2048"))
+NDVI_RESULT_CACHE_DIR = os.getenv("NDVI_RESULT_CACHE_DIR", os.path.join("data", "ndvi_cache"))
+NDVI_RESULT_CACHE_DISK_MAX_MB = float(os.getenv("NDVI_RESULT_CACHE_DISK_MAX_MB", "256"))
+
+
+def input_cache_key(inputs: dict, threshold: float, params: Optional[dict] = None) -> str:
+    """
+    Hash pipeline inputs into a cache key. Every field contributes its own BLAKE2b digest:
+    byte buffers are digested as-is, spooled uploads bring the digest computed while spooling
+    (so a band gets the same key whether or not it was spooled), other values (JSON arrays,
+    dtype/shape strings) are digested through their compact JSON encoding.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    header = {"v": PIPELINE_VERSION, "threshold": float(threshold), "params": params or {}}
+    h.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+    for name in sorted(inputs):
+        value = inputs[name]
+        if isinstance(value, SpooledUpload):
+            size, digest = value.size, value.digest
+        else:
+            if not isinstance(value, (bytes, bytearray, memoryview)):
+                value = json.dumps(value, separators=(",", ":")).encode("utf-8")
+            size, digest = len(value), content_digest(value)
+        # length-prefix every field so different splits of the same bytes never collide
+        h.update(name.encode("utf-8") + b"\0" + size.to_bytes(8, "little"))
+        h.update(digest)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache of JSON-serializable pipeline results."""
+
+    def __init__(self, enabled=NDVI_RESULT_CACHE_ENABLED, memory_entries=NDVI_RESULT_CACHE_MEMORY_ENTRIES,
+                 directory=NDVI_RESULT_CACHE_DIR, disk_max_mb=NDVI_RESULT_CACHE_DISK_MAX_MB):
+        self.enabled = enabled
+        self.memory_entries = max(0, memory_entries)
+        self.directory = directory or None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None  # computed lazily on first disk write
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+    # ---------- memory tier ----------
+    def _memory_get(self, key):
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key, value):
+        if self.memory_entries == 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.memory_evictions += 1
+
+    # ---------- disk tier (sync, called via asyncio.to_thread) ----------
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _disk_get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # refresh recency for LRU eviction
+            return value
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"result cache: dropping unreadable entry {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _scan_disk(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _disk_put(self, key, value):
+        path = self._path(key)
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # atomic: readers never see a partial file
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_bytes += len(data)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        entries = sorted(self._scan_disk())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.disk_evictions += 1
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    # ---------- public API ----------
+    async def key_for(self, inputs: dict, threshold: float, params: Optional[dict] = None) -> str:
+        # hashlib releases the GIL on large buffers, so hashing big uploads in a thread keeps the loop free
+        return await asyncio.to_thread(input_cache_key, inputs, threshold, params)
+
+    async def get(self, key: str):
+        """Return (value, tier) where tier is "memory" / "disk", or (None, None) on a miss."""
+        if not self.enabled:
+            return None, None
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value, "memory"
+        if self.directory:
+            value = await asyncio.to_thread(self._disk_get, key)
+            if value is not None:
+                self.disk_hits += 1
+                self._memory_put(key, value)
+                return value, "disk"
+        self.misses += 1
+        return None, None
+
+    async def put(self, key: str, value):
+        if not self.enabled:
+            return
+        self.stores += 1
+        self._memory_put(key, value)
+        if self.directory:
+            try:
+                await asyncio.to_thread(self._disk_put, key, value)
+            except Exception as e:
+                logger.warning(f"result cache: could not write {key}: {e}")
+
+    def clear(self) -> int:
+        removed = len(self._memory)
+        self._memory.clear()
+        if self.directory and os.path.isdir(self.directory):
+            with self._disk_lock:
+                for _, _, path in self._scan_disk():
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+                self._disk_bytes = 0
+        return removed
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "memory_max_entries": self.memory_entries,
+            "disk_dir": self.directory,
+            "disk_bytes": self._disk_bytes,
+            "disk_max_bytes": self.disk_max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "memory_evictions": self.memory_evictions,
+            "disk_evictions": self.disk_evictions,
+            "hit_ratio": (hits / lookups) if lookups else 0.0,
+        }
+
+
+result_cache = ResultCache()
@@ -0,0 +1,155 @@
+"""
+Serving mode: lazy heavy imports, preload / warm-up hooks and boot timing.
+
+The geospatial stack (rasterio / GDAL, shapely) is imported lazily by the compute code, so
+`import app.main` stays cheap for tests, benchmarks and single-process dev runs. A production
+server pays for it once, before traffic:
+  - preload() imports the heavy modules. Under gunicorn (gunicorn.conf.py) it runs in the master
+    after the app is preloaded, so the forked web workers share those pages copy-on-write,
+    together with the import-time tables (palette LUTs, ...);
+  - warm_up() runs a tiny NDVI computation, a preview render and (when rasterio is installed)
+    a raster read from /vsimem, so numpy kernels, PIL encoders and GDAL drivers are initialised
+    before the first request;
+  - warm_worker() is the compute pool's process initializer: each pool process preloads and
+    warms itself (and imports the pipeline module) when it starts, and the lifespan starts
+    every pool process up front (ComputePool.warm) instead of on the first requests.
+Caches shared by all workers of a host live in local stores: the result cache's disk tier, the
+NDVI tile store, the farm metadata SQLite tier (FARM_CACHE_SHARED_PATH), the job store and the
+n8n outbox; the in-memory tiers in front of them stay per process.
+
+Boot timing (app import, heavy imports, warm-up, lifespan start) is collected in boot_timer,
+logged when the service is ready and exposed at GET /v1/ndvi/startup and as ndvi_boot_* gauges.
+
+Config (env):
+  NDVI_WARMUP               1 / 0: warm up at startup and in pool processes  (default: 1)
+  NDVI_PRELOAD_MODULES      comma-separated modules imported by preload()
+                            (default: rasterio, its feature / warp / mask modules and shapely)
+"""
+
+import importlib
+import importlib.util
+import logging
+import os
+import time
+
+import numpy as np
+
+from app.core.metrics import StageTimer
+
+logger = logging.getLogger("ml_service")
+
+NDVI_WARMUP = os.getenv("NDVI_WARMUP", "1") not in ("0", "false", "False", "")
+NDVI_PRELOAD_MODULES = [m.strip() for m in os.getenv(
+    "NDVI_PRELOAD_MODULES",
+    "rasterio,rasterio.features,rasterio.mask,rasterio.vrt,rasterio.windows,shapely,shapely.geometry,shapely.prepared",
+).split(",") if m.strip()]
+
+WARMUP_SIDE = 64
+
+# boot stages of this process (inherited from the gunicorn master when the app is preloaded)
+boot_timer = StageTimer()
+_preloaded = set()
+_warmed = False
+
+
+def module_available(name: str) -> bool:
+    """Whether a module can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+# ---------- hooks ----------
+def preload(modules=None) -> dict:
+    """Import the heavy modules now (each one once per process); returns {module: seconds}."""
+    timings = {}
+    for name in modules or NDVI_PRELOAD_MODULES:
+        if name in _preloaded:
+            continue
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"preload: could not import {name}: {e}")
+            continue
+        _preloaded.add(name)
+        timings[name] = time.perf_counter() - started
+    if timings:
+        boot_timer.add("preload", sum(timings.values()))
+    return timings
+
+
+def warm_up() -> dict:
+    """Run every compute path once on tiny inputs (once per process); returns {step: seconds}."""
+    global _warmed
+    if _warmed:
+        return {}
+    from app.core.ndvi_stats import compute_ndvi_stats
+    from app.core.preview import render_preview
+
+    timer = StageTimer()
+    rng = np.random.default_rng(0)
+    nir = rng.integers(1, 4096, (WARMUP_SIDE, WARMUP_SIDE), dtype=np.uint16)
+    red = rng.integers(1, 4096, (WARMUP_SIDE, WARMUP_SIDE), dtype=np.uint16)
+    with timer.stage("ndvi"):
+        ndvi = np.empty(nir.shape, dtype=np.float32)
+        compute_ndvi_stats(nir, red, 0.3, ndvi_out=ndvi, valid=nir > 100)
+        compute_ndvi_stats(nir.astype(np.float32), red.astype(np.float32), 0.3)
+    with timer.stage("preview"):
+        for fmt in ("png", "webp"):
+            render_preview(ndvi, size=WARMUP_SIDE, fmt=fmt)
+    if module_available("rasterio"):
+        with timer.stage("raster"):
+            try:
+                _warm_raster(nir, red)
+            except Exception as e:
+                logger.warning(f"warm-up: raster path failed: {e}")
+    _warmed = True
+    boot_timer.add("warmup", sum(timer.stages.values()))
+    return timer.stages
+
+
+def _warm_raster(nir: np.ndarray, red: np.ndarray):
+    """compute_ndvi_from_paths on two in-memory GeoTIFFs: GDAL drivers, masks, polygon rasterizing."""
+    from rasterio.io import MemoryFile
+    from rasterio.transform import from_origin
+
+    from app.core.compute_ndvi import compute_ndvi_from_paths
+
+    profile = {"driver": "GTiff", "width": nir.shape[1], "height": nir.shape[0], "count": 1, "dtype": "uint16",
+               "crs": "EPSG:32633", "transform": from_origin(500000, 4000000, 10, 10), "nodata": 0}
+    side = 10 * WARMUP_SIDE
+    polygon = {"type": "Polygon", "coordinates": [[[500000 + 10, 4000000 - 10], [500000 + side - 10, 4000000 - 10],
+                                                   [500000 + side / 2, 4000000 - side + 10], [500000 + 10, 4000000 - 10]]]}
+    with MemoryFile() as red_file, MemoryFile() as nir_file:
+        for memfile, band in ((red_file, red), (nir_file, nir)):
+            with memfile.open(**profile) as dst:
+                dst.write(band, 1)
+        compute_ndvi_from_paths(red_file.name, nir_file.name, polygon, save_preview=True, windowed=False)
+        compute_ndvi_from_paths(red_file.name, nir_file.name, polygon, save_preview=False, windowed=True)
+
+
+def warm_worker(*modules):
+    """Compute pool process initializer: preload, import the pipeline modules and warm up."""
+    preload()
+    for name in modules:
+        importlib.import_module(name)
+    if NDVI_WARMUP:
+        warm_up()
+
+
+# ---------- report ----------
+def boot_report() -> dict:
+    """Boot stage durations of this process in milliseconds, plus what was preloaded / warmed."""
+    return {
+        "pid": os.getpid(),
+        "stages_ms": {name: seconds * 1000 for name, seconds in boot_timer.stages.items()},
+        "preloaded": sorted(_preloaded),
+        "warmed": _warmed,
+    }
+
+
+def boot_stats() -> dict:
+    """Numeric boot durations (seconds) for the metrics collector."""
+    return {f"{name}_seconds": seconds for name, seconds in boot_timer.stages.items()}
@@ -0,0 +1,285 @@
+"""
+NDVI tile pyramids (XYZ, pixel space) built lazily from the computed NDVI raster.
+
+When a request is computed, the pipeline stores the full-resolution NDVI raster once as an
+int16 .npy (NDVI x 10000, -32768 = nodata) under NDVI_TILES_DIR/<content key>/, and the report
+id is linked to that content key. Tiles are rendered on first access only:
+  - the deepest zoom level (maxzoom) slices 256x256 windows straight out of the memory-mapped base,
+  - every coarser tile is the 2x2 mean of the four tiles below it,
+and each rendered level tile is kept as .npy (for the next level up) plus the encoded image,
+so a tile is never recomputed from full resolution.
+
+Config (env):
+  NDVI_TILES_ENABLED      1 / 0                            (default: 1)
+  NDVI_TILES_DIR          tile store root                  (default: data/tiles)
+  NDVI_TILES_DISK_MAX_MB  store size cap, LRU by scene     (default: 1024)
+  NDVI_TILES_PUBLIC_URL   prefix for tiles_url, e.g. https://ml.example.com (default: relative)
+"""
+
+import io
+import json
+import math
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+from app.core.preview import IMAGE_FORMATS, encode_image, get_palette, render_preview
+
+NDVI_TILES_ENABLED = os.getenv("NDVI_TILES_ENABLED", "1") not in ("0", "false", "False", "")
+NDVI_TILES_DIR = os.getenv("NDVI_TILES_DIR", os.path.join("data", "tiles"))
+NDVI_TILES_DISK_MAX_MB = float(os.getenv("NDVI_TILES_DISK_MAX_MB", "1024"))
+NDVI_TILES_PUBLIC_URL = os.getenv("NDVI_TILES_PUBLIC_URL", "").rstrip("/")
+
+TILE_SIZE = 256
+NODATA = -32768
+SCALE = 10000.0
+TILE_FORMATS = IMAGE_FORMATS
+
+_KEY_RE = re.compile(r"^[0-9a-f]{16,128}$")
+
+
+def encode_ndvi(ndvi: np.ndarray) -> np.ndarray:
+    """float NDVI (-1..1, NaN = nodata) -> int16 x 10000."""
+    out = np.full(ndvi.shape, NODATA, dtype=np.int16)
+    finite = np.isfinite(ndvi)
+    out[finite] = np.round(ndvi[finite] * SCALE).astype(np.int16)
+    return out
+
+
+def max_zoom(height: int, width: int) -> int:
+    return max(0, int(math.ceil(math.log2(max(height, width, 1) / TILE_SIZE))))
+
+
+def colorize_tile(tile: np.ndarray, palette=None) -> np.ndarray:
+    """int16 NDVI tile -> RGBA uint8 through the preview palette LUT (nodata transparent)."""
+    valid = tile != NODATA
+    # int16 x 10000 -> LUT index directly, no float NDVI intermediate
+    idx = ((tile.astype(np.int32) + int(SCALE)) * 255) // int(2 * SCALE)
+    np.clip(idx, 0, 255, out=idx)
+    rgba = np.empty(tile.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = get_palette(palette)[idx]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def _downsample_2x(block: np.ndarray) -> np.ndarray:
+    """2x2 mean of a (2N, 2N) int16 block, ignoring nodata."""
+    h, w = block.shape
+    quads = block.reshape(h // 2, 2, w // 2, 2).astype(np.int32)
+    valid = (quads != NODATA)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, quads, 0).sum(axis=(1, 3))
+    out = np.full(counts.shape, NODATA, dtype=np.int16)
+    has = counts > 0
+    out[has] = np.round(sums[has] / counts[has]).astype(np.int16)
+    return out
+
+
+class TileStore:
+    """On-disk base rasters, report links and lazily rendered tiles."""
+
+    def __init__(self, root=NDVI_TILES_DIR, enabled=NDVI_TILES_ENABLED, max_mb=NDVI_TILES_DISK_MAX_MB):
+        self.root = root
+        self.enabled = enabled
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+
+    # ---------- paths ----------
+    def _scene_dir(self, key):
+        if not _KEY_RE.match(key):
+            raise ValueError("invalid tile key")
+        return os.path.join(self.root, "scenes", key)
+
+    def _link_path(self, report_id):
+        if not _KEY_RE.match(report_id):
+            raise ValueError("invalid report id")
+        return os.path.join(self.root, "reports", report_id)
+
+    @staticmethod
+    def _atomic_write(path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    # ---------- base raster ----------
+    def has_base(self, key) -> bool:
+        return os.path.exists(os.path.join(self._scene_dir(key), "meta.json"))
+
+    def base_path(self, key):
+        return os.path.join(self._scene_dir(key), "base.npy")
+
+    def save_base(self, key, ndvi: np.ndarray):
+        """Store the full-resolution NDVI raster for key (no-op if it already exists)."""
+        if not self.enabled or self.has_base(key):
+            return
+        scene = self._scene_dir(key)
+        buf = io.BytesIO()
+        np.save(buf, encode_ndvi(ndvi))
+        self._atomic_write(os.path.join(scene, "base.npy"), buf.getvalue())
+        meta = {"height": int(ndvi.shape[0]), "width": int(ndvi.shape[1]),
+                "maxzoom": max_zoom(*ndvi.shape), "tile_size": TILE_SIZE}
+        # meta.json is written last: its presence marks the scene as complete
+        self._atomic_write(os.path.join(scene, "meta.json"), json.dumps(meta).encode("utf-8"))
+
+    def meta(self, key) -> dict:
+        with open(os.path.join(self._scene_dir(key), "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    # ---------- report links ----------
+    def link(self, report_id, key):
+        self._atomic_write(self._link_path(report_id), key.encode("ascii"))
+
+    def resolve(self, report_id):
+        try:
+            with open(self._link_path(report_id), "r", encoding="ascii") as f:
+                key = f.read().strip()
+        except (FileNotFoundError, ValueError):
+            return None
+        if not self.has_base(key):
+            return None
+        try:
+            os.utime(self._scene_dir(key))  # recency for prune()
+        except OSError:
+            pass
+        return key
+
+    # ---------- tiles ----------
+    def tile_array(self, key, z, x, y, meta=None):
+        """int16 NDVI values of tile (z, x, y), or None when it lies outside the raster."""
+        meta = meta or self.meta(key)
+        maxzoom = meta["maxzoom"]
+        if z < 0 or z > maxzoom:
+            return None
+        scale = 2 ** (maxzoom - z)
+        level_h = int(math.ceil(meta["height"] / scale))
+        level_w = int(math.ceil(meta["width"] / scale))
+        if x < 0 or y < 0 or x * TILE_SIZE >= level_w or y * TILE_SIZE >= level_h:
+            return None
+
+        cached = os.path.join(self._scene_dir(key), str(z), str(x), f"{y}.npy")
+        try:
+            return np.load(cached)
+        except FileNotFoundError:
+            pass
+
+        tile = np.full((TILE_SIZE, TILE_SIZE), NODATA, dtype=np.int16)
+        if z == maxzoom:
+            base = np.load(os.path.join(self._scene_dir(key), "base.npy"), mmap_mode="r")
+            window = base[y * TILE_SIZE:(y + 1) * TILE_SIZE, x * TILE_SIZE:(x + 1) * TILE_SIZE]
+            tile[:window.shape[0], :window.shape[1]] = window
+        else:
+            block = np.full((2 * TILE_SIZE, 2 * TILE_SIZE), NODATA, dtype=np.int16)
+            for dy in (0, 1):
+                for dx in (0, 1):
+                    child = self.tile_array(key, z + 1, 2 * x + dx, 2 * y + dy, meta)
+                    if child is not None:
+                        block[dy * TILE_SIZE:(dy + 1) * TILE_SIZE, dx * TILE_SIZE:(dx + 1) * TILE_SIZE] = child
+            tile = _downsample_2x(block)
+
+        buf = io.BytesIO()
+        np.save(buf, tile)
+        self._atomic_write(cached, buf.getvalue())
+        return tile
+
+    def render_tile(self, key, z, x, y, fmt="png", palette=None):
+        """Encoded tile bytes (cached on disk), or None when the tile lies outside the raster."""
+        get_palette(palette)  # validate before touching the disk
+        name = f"{y}.{fmt}" if not palette else f"{y}-{palette}.{fmt}"
+        path = os.path.join(self._scene_dir(key), str(z), str(x), name)
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        tile = self.tile_array(key, z, x, y)
+        if tile is None:
+            return None
+        data = encode_image(colorize_tile(tile, palette), fmt)
+        self._atomic_write(path, data)
+        return data
+
+    def render_preview(self, key, size=None, palette=None, fmt="png"):
+        """Whole-scene preview sampled from the memory-mapped base (cost independent of its resolution)."""
+        base = np.load(os.path.join(self._scene_dir(key), "base.npy"), mmap_mode="r")
+        return render_preview(base, size=size, palette=palette, fmt=fmt, nodata=NODATA, scale=SCALE)
+
+    # ---------- housekeeping ----------
+    def prune(self):
+        """
+        Evict least recently stored scenes until the store is below its size cap, then drop the
+        report links whose scene is gone. Returns the number of scenes removed.
+        """
+        scenes_root = os.path.join(self.root, "scenes")
+        if not os.path.isdir(scenes_root):
+            self._prune_links()
+            return 0
+        with self._lock:
+            scenes = []
+            total = 0
+            for key in os.listdir(scenes_root):
+                path = os.path.join(scenes_root, key)
+                size = 0
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        try:
+                            size += os.path.getsize(os.path.join(root, name))
+                        except OSError:
+                            pass
+                scenes.append((os.path.getmtime(path), size, path))
+                total += size
+            removed = 0
+            for _, size, path in sorted(scenes):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                removed += 1
+            self._prune_links()
+            return removed
+
+    def _prune_links(self) -> int:
+        """Remove report links pointing at scenes that no longer exist (resolve() ignores them anyway)."""
+        reports_root = os.path.join(self.root, "reports")
+        if not os.path.isdir(reports_root):
+            return 0
+        removed = 0
+        for name in os.listdir(reports_root):
+            if not _KEY_RE.match(name):
+                continue  # a link still being written (see _atomic_write)
+            path = os.path.join(reports_root, name)
+            try:
+                with open(path, "r", encoding="ascii") as f:
+                    key = f.read().strip()
+                if _KEY_RE.match(key) and self.has_base(key):
+                    continue
+                os.remove(path)
+                removed += 1
+            except (OSError, ValueError):
+                continue
+        return removed
+
+
+def tiles_url_for(report_id: str) -> str:
+    return f"{NDVI_TILES_PUBLIC_URL}/v1/ndvi/tiles/{report_id}/{{z}}/{{x}}/{{y}}.png"
+
+
+def preview_url_for(report_id: str) -> str:
+    return f"{NDVI_TILES_PUBLIC_URL}/v1/ndvi/preview/{report_id}.png"
+
+
+def render_tile(key, z, x, y, fmt="png", palette=None):
+    """Module-level entry point so tiles can be rendered on the compute pool."""
+    return tile_store.render_tile(key, z, x, y, fmt, palette)
+
+
+def render_scene_preview(key, size=None, palette=None, fmt="png"):
+    """Module-level entry point so scene previews can be rendered on the compute pool."""
+    return tile_store.render_preview(key, size, palette, fmt)
+
+
+tile_store = TileStore()
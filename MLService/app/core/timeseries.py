@@ -0,0 +1,270 @@
+"""
+Per-farm NDVI time series, so trends and "stress got worse" checks never need the source imagery again.
+
+Layout under NDVI_SERIES_DIR, one directory per farm (named by a hash of the farmId):
+  series.npz          columnar summary: one array per column (capture_date, capture_ts, report_id,
+                      mean_ndvi, median_ndvi, pct_stress, stress_threshold, pixel_count, histogram,
+                      has_raster), sorted by capture time; rewritten atomically on every upsert
+  rasters/<id>.npy    optional downsampled NDVI of a capture, int16 (x 10000, -32768 = nodata),
+                      opened memory-mapped for change maps
+Captures are keyed by (farmId, captureDate); recording the same captureDate again replaces it.
+
+Config (env):
+  NDVI_SERIES_ENABLED         1 / 0                                   (default: 1)
+  NDVI_SERIES_DIR             store root                              (default: data/series)
+  NDVI_SERIES_RASTER_SIDE     longest side of stored rasters, 0 = off (default: 256)
+  NDVI_CHANGE_THRESHOLD       NDVI drop / gain counted as change      (default: 0.1)
+"""
+
+import hashlib
+import io
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX dev machines: in-process locking only
+    fcntl = None
+
+from app.core.preview import downsample, fit_size, render_preview
+from app.core.tiles import NODATA, SCALE, encode_ndvi
+
+NDVI_SERIES_ENABLED = os.getenv("NDVI_SERIES_ENABLED", "1") not in ("0", "false", "False", "")
+NDVI_SERIES_DIR = os.getenv("NDVI_SERIES_DIR", os.path.join("data", "series"))
+NDVI_SERIES_RASTER_SIDE = int(os.getenv("NDVI_SERIES_RASTER_SIDE", "256"))
+NDVI_CHANGE_THRESHOLD = float(os.getenv("NDVI_CHANGE_THRESHOLD", "0.1"))
+
+HIST_BINS = 10
+SCALAR_COLUMNS = ("mean_ndvi", "median_ndvi", "pct_stress", "stress_threshold")
+
+
+def parse_capture_ts(capture_date: str) -> float:
+    """Epoch seconds of an ISO date / datetime (naive values are taken as UTC)."""
+    try:
+        dt = datetime.fromisoformat(str(capture_date).strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"captureDate {capture_date!r} is not an ISO date")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def _hash(value: str, size=16) -> str:
+    return hashlib.blake2b(str(value).encode("utf-8"), digest_size=size).hexdigest()
+
+
+def _empty_columns() -> dict:
+    return {
+        "capture_date": np.empty(0, dtype="U64"),
+        "capture_ts": np.empty(0, dtype=np.float64),
+        "report_id": np.empty(0, dtype="U64"),
+        **{name: np.empty(0, dtype=np.float64) for name in SCALAR_COLUMNS},
+        "pixel_count": np.empty(0, dtype=np.int64),
+        "histogram": np.empty((0, HIST_BINS), dtype=np.int64),
+        "has_raster": np.empty(0, dtype=bool),
+    }
+
+
+def _row(cols: dict, i: int) -> dict:
+    return {
+        "captureDate": str(cols["capture_date"][i]),
+        "reportId": str(cols["report_id"][i]) or None,
+        **{name: float(cols[name][i]) for name in SCALAR_COLUMNS},
+        "pixel_count": int(cols["pixel_count"][i]),
+        "histogram": cols["histogram"][i].tolist(),
+        "has_raster": bool(cols["has_raster"][i]),
+    }
+
+
+def _rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over the last `window` captures (fewer at the start), NaN-aware."""
+    finite = np.isfinite(values)
+    csum = np.concatenate([[0.0], np.cumsum(np.where(finite, values, 0.0))])
+    ccount = np.concatenate([[0], np.cumsum(finite)])
+    hi = np.arange(1, values.size + 1)
+    lo = np.maximum(hi - window, 0)
+    counts = ccount[hi] - ccount[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, (csum[hi] - csum[lo]) / counts, np.nan)
+
+
+class NDVISeriesStore:
+    """Columnar per-farm capture summaries plus optional memory-mapped downsampled rasters."""
+
+    def __init__(self, root=NDVI_SERIES_DIR, enabled=NDVI_SERIES_ENABLED, raster_side=NDVI_SERIES_RASTER_SIDE):
+        self.root = root
+        self.enabled = enabled
+        self.raster_side = raster_side
+        self._lock = threading.Lock()
+
+    # ---------- paths / io ----------
+    def _farm_dir(self, farm_id):
+        return os.path.join(self.root, _hash(farm_id))
+
+    def _raster_path(self, farm_id, capture_date):
+        return os.path.join(self._farm_dir(farm_id), "rasters", f"{_hash(capture_date, 10)}.npy")
+
+    @staticmethod
+    def _atomic_write(path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def load(self, farm_id) -> dict:
+        path = os.path.join(self._farm_dir(farm_id), "series.npz")
+        try:
+            with np.load(path) as npz:
+                return {name: npz[name] for name in _empty_columns()}
+        except FileNotFoundError:
+            return _empty_columns()
+
+    def _save(self, farm_id, cols):
+        buf = io.BytesIO()
+        np.savez(buf, farm_id=np.array(str(farm_id)), **cols)
+        self._atomic_write(os.path.join(self._farm_dir(farm_id), "series.npz"), buf.getvalue())
+
+    @contextmanager
+    def _farm_lock(self, farm_id):
+        """Exclusive lock across threads and (where available) worker processes."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self._farm_dir(farm_id), exist_ok=True)
+            with open(os.path.join(self._farm_dir(farm_id), ".lock"), "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    # ---------- write ----------
+    def _store_raster(self, farm_id, capture_date, ndvi_base_path) -> bool:
+        if not ndvi_base_path or self.raster_side <= 0:
+            return False
+        base = np.load(ndvi_base_path, mmap_mode="r")
+        out_h, out_w = fit_size(base.shape[0], base.shape[1], self.raster_side)
+        small = downsample(base, out_h, out_w, nodata=NODATA, scale=SCALE)
+        buf = io.BytesIO()
+        np.save(buf, encode_ndvi(small))
+        self._atomic_write(self._raster_path(farm_id, capture_date), buf.getvalue())
+        return True
+
+    def record(self, farm_id, report: dict, ndvi_base_path=None):
+        """
+        Upsert one capture from an ndviReport; ndvi_base_path (an int16 NDVI .npy, e.g. the tile base)
+        is downsampled into the farm's raster store. Returns the previous capture's row, or None.
+        """
+        capture_date = str(report["captureDate"])
+        ts = parse_capture_ts(capture_date)
+        has_raster = self._store_raster(farm_id, capture_date, ndvi_base_path)
+        hist = (report.get("histogram") or {}).get("bins") or [0] * HIST_BINS
+        with self._farm_lock(farm_id):
+            cols = self.load(farm_id)
+            keep = cols["capture_date"] != capture_date
+            cols = {name: col[keep] for name, col in cols.items()}
+            new = {
+                "capture_date": np.array([capture_date], dtype="U64"),
+                "capture_ts": np.array([ts]),
+                "report_id": np.array([report.get("reportId") or ""], dtype="U64"),
+                **{name: np.array([float(report.get(name, np.nan))]) for name in SCALAR_COLUMNS},
+                "pixel_count": np.array([int(report.get("pixel_count") or sum(hist))], dtype=np.int64),
+                "histogram": np.array([hist], dtype=np.int64).reshape(1, HIST_BINS),
+                "has_raster": np.array([has_raster]),
+            }
+            cols = {name: np.concatenate([cols[name], new[name]]) for name in cols}
+            order = np.argsort(cols["capture_ts"], kind="stable")
+            cols = {name: col[order] for name, col in cols.items()}
+            self._save(farm_id, cols)
+        pos = int(np.searchsorted(cols["capture_ts"], ts, side="left"))
+        return _row(cols, pos - 1) if pos > 0 else None
+
+    # ---------- queries ----------
+    def query(self, farm_id, start=None, end=None, window=None) -> list:
+        """Captures in [start, end] (ISO dates), oldest first; window adds trailing rolling means."""
+        cols = self.load(farm_id)
+        sel = np.ones(cols["capture_ts"].size, dtype=bool)
+        if start:
+            sel &= cols["capture_ts"] >= parse_capture_ts(start)
+        if end:
+            sel &= cols["capture_ts"] <= parse_capture_ts(end)
+        rows = [_row(cols, i) for i in np.flatnonzero(sel)]
+        if window and window > 1:
+            # rolling over the full history so the first rows of a range still see earlier captures
+            rolling = {name: _rolling_mean(cols[name], window) for name in ("mean_ndvi", "pct_stress")}
+            for row, i in zip(rows, np.flatnonzero(sel)):
+                row["rolling"] = {name: float(values[i]) for name, values in rolling.items()}
+        return rows
+
+    def _pair(self, farm_id, capture_date=None):
+        cols = self.load(farm_id)
+        n = cols["capture_ts"].size
+        if capture_date:
+            hits = np.flatnonzero(cols["capture_date"] == capture_date)
+            if hits.size == 0:
+                raise KeyError(f"no capture {capture_date!r} stored for farm {farm_id!r}")
+            i = int(hits[0])
+        else:
+            if n == 0:
+                raise KeyError(f"no captures stored for farm {farm_id!r}")
+            i = n - 1
+        if i == 0:
+            raise KeyError(f"capture {cols['capture_date'][i]!r} has no earlier capture to compare with")
+        return _row(cols, i), _row(cols, i - 1)
+
+    def _delta_raster(self, farm_id, current, previous):
+        if not (current["has_raster"] and previous["has_raster"]):
+            return None
+        cur = np.load(self._raster_path(farm_id, current["captureDate"]), mmap_mode="r")
+        prev = np.load(self._raster_path(farm_id, previous["captureDate"]), mmap_mode="r")
+        # rasters of different captures can differ in size: compare on the smaller grid
+        out_h, out_w = min(cur.shape[0], prev.shape[0]), min(cur.shape[1], prev.shape[1])
+        cur = downsample(cur, out_h, out_w, nodata=NODATA, scale=SCALE)
+        prev = downsample(prev, out_h, out_w, nodata=NODATA, scale=SCALE)
+        return cur - prev
+
+    def change(self, farm_id, capture_date=None, threshold=NDVI_CHANGE_THRESHOLD) -> dict:
+        """Stats deltas between a capture (default: latest) and the one before it, plus raster change stats."""
+        current, previous = self._pair(farm_id, capture_date)
+        result = {
+            "farmId": farm_id,
+            "captureDate": current["captureDate"],
+            "previousCaptureDate": previous["captureDate"],
+            "reportId": current["reportId"],
+            "previousReportId": previous["reportId"],
+            "delta_mean_ndvi": current["mean_ndvi"] - previous["mean_ndvi"],
+            "delta_median_ndvi": current["median_ndvi"] - previous["median_ndvi"],
+            "delta_pct_stress": current["pct_stress"] - previous["pct_stress"],
+            "stress_worsened": current["pct_stress"] > previous["pct_stress"],
+            "raster": None,
+        }
+        delta = self._delta_raster(farm_id, current, previous)
+        if delta is not None:
+            valid = delta[np.isfinite(delta)]
+            n = valid.size
+            result["raster"] = {
+                "shape": list(delta.shape),
+                "valid_pixels": int(n),
+                "mean_delta": float(valid.mean()) if n else None,
+                "change_threshold": threshold,
+                "pct_declined": float(np.count_nonzero(valid < -threshold) / n) if n else None,
+                "pct_improved": float(np.count_nonzero(valid > threshold) / n) if n else None,
+            }
+        return result
+
+    def change_map(self, farm_id, capture_date=None, size=None, fmt="png", span=0.5) -> bytes:
+        """Delta NDVI image (red = decline, green = gain, +-span saturates)."""
+        current, previous = self._pair(farm_id, capture_date)
+        delta = self._delta_raster(farm_id, current, previous)
+        if delta is None:
+            raise KeyError("no stored rasters for these captures")
+        return render_preview(delta, size=size, palette="rdylgn", fmt=fmt, vmin=-span, vmax=span)
+
+
+ndvi_series = NDVISeriesStore()
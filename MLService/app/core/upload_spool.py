@@ -0,0 +1,185 @@
+"""
+Bounded-memory reading of band uploads for /v1/ndvi/compute.
+
+Small uploads are read into memory as before. Larger ones (past NDVI_UPLOAD_SPOOL_MB) are already
+on disk in the file Starlette spooled the multipart part to, so they are left there: the pipeline
+receives a SpooledUpload (a duplicate of that file's descriptor + size + digest) instead of the bytes:
+  - the compute pool gets a small picklable handle instead of a copy of the body,
+  - workers memory-map the file (zero-copy .npy / raw decode, lazy image decode) and unmap it
+    once the stats are computed (SpooledUpload.mapped),
+  - the result-cache key uses the digest taken when the upload was read, so nothing is re-read.
+Workers in other processes reopen the file through /proc/<pid>/fd; where /proc is not available
+the upload is copied once into NDVI_UPLOAD_SPOOL_DIR instead. The handle belongs to the request
+(or its refine task) and is released by the caller (SpooledUpload.close).
+
+Config (env):
+  NDVI_UPLOAD_SPOOL_MB     uploads larger than this are passed on as files     (default: 16)
+  NDVI_UPLOAD_SPOOL_DIR    copy directory when /proc is not available          (default: system temp dir)
+  NDVI_UPLOAD_MAX_MB       larger band uploads are rejected with 413           (default: 1024)
+  NDVI_UPLOAD_CHUNK_KB     read size while copying                             (default: 1024)
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger("ml_service")
+
+NDVI_UPLOAD_SPOOL_BYTES = int(float(os.getenv("NDVI_UPLOAD_SPOOL_MB", "16")) * 1024 * 1024)
+NDVI_UPLOAD_SPOOL_DIR = os.getenv("NDVI_UPLOAD_SPOOL_DIR") or tempfile.gettempdir()
+NDVI_UPLOAD_MAX_BYTES = int(float(os.getenv("NDVI_UPLOAD_MAX_MB", "1024")) * 1024 * 1024)
+NDVI_UPLOAD_CHUNK_BYTES = int(os.getenv("NDVI_UPLOAD_CHUNK_KB", "1024")) * 1024
+
+DIGEST_SIZE = 20
+
+
+def content_digest(buf) -> bytes:
+    """BLAKE2b digest of an in-memory upload (the same digest SpooledUpload carries)."""
+    return hashlib.blake2b(buf, digest_size=DIGEST_SIZE).digest()
+
+
+class UploadTooLarge(ValueError):
+    """Raised when a band upload exceeds NDVI_UPLOAD_MAX_MB."""
+
+
+class SpooledUpload:
+    """
+    A band upload kept on disk. fd (when set) is this process's own descriptor of the file, so the
+    file outlives the request's UploadFile; otherwise path is a copy that close() removes.
+    Picklable: only the path, size and digest travel (the receiving side owns nothing).
+    """
+
+    def __init__(self, path: str, size: int, digest: bytes, fd: Optional[int] = None):
+        self.path = path
+        self.size = size
+        self.digest = digest
+        self.fd = fd
+        self._owned = True
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"SpooledUpload({self.path!r}, {self.size} bytes)"
+
+    def __getstate__(self):
+        return {"path": self.path, "size": self.size, "digest": self.digest}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, fd=None, _owned=False)
+
+    def map(self):
+        """Read-only memory map of the file (supports the buffer protocol, e.g. np.frombuffer)."""
+        if self.size == 0:
+            return b""
+        if self.fd is not None:
+            return mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        with open(self.path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @contextlib.contextmanager
+    def mapped(self):
+        """map() for the duration of the block; views of the map must not outlive it."""
+        buf = self.map()
+        try:
+            yield buf
+        finally:
+            if isinstance(buf, mmap.mmap):
+                try:
+                    buf.close()
+                except BufferError:
+                    # an array still views the map (e.g. held by a traceback); it is unmapped with that view
+                    logger.debug(f"{self!r} is still referenced, leaving its map to the garbage collector")
+
+    def head(self, n: int) -> bytes:
+        if self.fd is not None:
+            return os.pread(self.fd, n, 0)
+        with open(self.path, "rb") as f:
+            return f.read(n)
+
+    def close(self):
+        """Release the upload: close our descriptor, or remove the copy."""
+        if not self._owned:
+            return
+        self._owned = False
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _file_size(file) -> int:
+    size = file.seek(0, os.SEEK_END)
+    file.seek(0)
+    return size
+
+
+def _share_file(file, size: int, directory: str) -> SpooledUpload:
+    """SpooledUpload of an upload's spool file (blocking: hashes the file, run in a worker thread)."""
+    if os.path.isdir(f"/proc/{os.getpid()}/fd"):
+        fd = os.dup(file.fileno())
+        try:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as buf:
+                digest = content_digest(buf)
+        except BaseException:
+            os.close(fd)
+            raise
+        return SpooledUpload(f"/proc/{os.getpid()}/fd/{fd}", size, digest, fd=fd)
+    # no /proc: other processes cannot reopen the (unlinked) spool file, so copy it once
+    os.makedirs(directory, exist_ok=True)
+    out_fd, path = tempfile.mkstemp(prefix="band-", suffix=".upload", dir=directory)
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    try:
+        with os.fdopen(out_fd, "wb") as out:
+            file.seek(0)
+            while chunk := file.read(NDVI_UPLOAD_CHUNK_BYTES):
+                h.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledUpload(path, size, h.digest())
+
+
+async def read_upload(upload, spool_bytes: int = NDVI_UPLOAD_SPOOL_BYTES, max_bytes: int = NDVI_UPLOAD_MAX_BYTES,
+                      directory: str = NDVI_UPLOAD_SPOOL_DIR):
+    """
+    Read an UploadFile: bytes when it stays within spool_bytes, otherwise a SpooledUpload of the
+    file it is already spooled to (nothing is copied). Raises UploadTooLarge past max_bytes.
+    """
+    size = upload.size
+    if size is None:
+        size = await asyncio.to_thread(_file_size, upload.file)
+    if size > max_bytes:
+        raise UploadTooLarge(f"upload {upload.filename!r} exceeds {max_bytes // (1024 * 1024)} MB")
+    await upload.seek(0)
+    if size <= spool_bytes:
+        return await upload.read()
+    spooled = await asyncio.to_thread(_share_file, upload.file, size, directory)
+    logger.info(f"Band upload {upload.filename!r} stays on disk ({size / (1024 * 1024):.1f} MB)")
+    return spooled
+
+
+def band_buffer(value, buffers: Optional[contextlib.ExitStack] = None):
+    """
+    The decodable buffer of a band input: the bytes themselves or a map of the spooled file.
+    With buffers, the map is closed when that stack exits; without, it lives as long as its views.
+    """
+    if not isinstance(value, SpooledUpload):
+        return value
+    return buffers.enter_context(value.mapped()) if buffers is not None else value.map()
+
+
+def remove_spooled(inputs: dict):
+    for value in inputs.values():
+        if isinstance(value, SpooledUpload):
+            value.close()
@@ -0,0 +1,96 @@
+"""
+Grouped (zonal) NDVI statistics: one label per zone, reductions with np.bincount.
+
+Pixels are tagged with an integer zone label (0 = outside every zone) and all statistics are
+accumulated for every zone at once from the same NDVI chunk, so the cost is one pass over the
+labelled pixels regardless of how many zones there are. Per zone it keeps the pixel count,
+finite count, NDVI sum, stressed-pixel count and a ZONAL_MEDIAN_BINS histogram over -1..1,
+from which the reported coarse histogram and an approximate median (within one bin) derive.
+Zone areas (every labelled pixel, valid or not) are counted separately with add_area, so each
+zone also reports how much of it had valid pixels (coverage_fraction).
+"""
+
+import os
+
+import numpy as np
+
+from app.core.ndvi_stats import HIST_BINS, histogram_bin_index
+
+# per-zone histogram resolution used for the median (bin width 0.01); memory is zones x bins x 8 bytes
+ZONAL_MEDIAN_BINS = int(os.getenv("NDVI_ZONAL_MEDIAN_BINS", "200"))
+
+
+class ZonalAccumulator:
+    """Incremental statistics for zones 1..n_zones (label 0 is ignored)."""
+
+    def __init__(self, n_zones, stress_threshold, bins=HIST_BINS, fine_bins=ZONAL_MEDIAN_BINS):
+        if fine_bins % bins:
+            raise ValueError("fine_bins must be a multiple of bins")
+        self.n = int(n_zones) + 1
+        self.stress_threshold = float(stress_threshold)
+        self.bins = bins
+        self.fine_bins = fine_bins
+        self.area = np.zeros(self.n, dtype=np.int64)
+        self.pixels = np.zeros(self.n, dtype=np.int64)
+        self.count = np.zeros(self.n, dtype=np.int64)
+        self.total = np.zeros(self.n, dtype=np.float64)
+        self.below = np.zeros(self.n, dtype=np.int64)
+        self.fine_hist = np.zeros((self.n, fine_bins), dtype=np.int64)
+
+    def add_area(self, labels):
+        """Count the pixels of each zone, including masked ones (labels: int array, 0 = no zone)."""
+        self.area += np.bincount(labels.reshape(-1), minlength=self.n)
+
+    def add(self, labels, values):
+        """labels: int array of zone ids, values: NDVI of the same pixels (clipped to -1..1)."""
+        labels = labels.reshape(-1)
+        values = values.reshape(-1)
+        self.pixels += np.bincount(labels, minlength=self.n)
+        finite = np.isfinite(values)
+        if not finite.all():
+            labels, values = labels[finite], values[finite]
+        if values.size == 0:
+            return
+        self.count += np.bincount(labels, minlength=self.n)
+        self.total += np.bincount(labels, weights=values, minlength=self.n)
+        self.below += np.bincount(labels[values < self.stress_threshold], minlength=self.n)
+        idx = labels.astype(np.intp) * self.fine_bins
+        idx += histogram_bin_index(values, self.fine_bins, self.bins)
+        self.fine_hist += np.bincount(idx, minlength=self.n * self.fine_bins).reshape(self.n, self.fine_bins)
+
+    def _medians(self):
+        # interpolate inside the bin holding half of each zone's finite pixels
+        cum = np.cumsum(self.fine_hist, axis=1)
+        half = self.count / 2.0
+        idx = np.minimum((cum < half[:, None]).sum(axis=1), self.fine_bins - 1)
+        rows = np.arange(self.n)
+        before = np.where(idx > 0, cum[rows, np.maximum(idx - 1, 0)], 0)
+        in_bin = self.fine_hist[rows, idx]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(in_bin > 0, (half - before) / in_bin, 0.5)
+        medians = -1.0 + (idx + frac) * (2.0 / self.fine_bins)
+        return np.where(self.count > 0, medians, np.nan)
+
+    def results(self, zone_ids) -> list:
+        """One dict per zone, in label order (zone_ids[i] is the id of label i + 1)."""
+        coarse = self.fine_hist.reshape(self.n, self.bins, -1).sum(axis=2)
+        edges = np.linspace(-1.0, 1.0, self.bins + 1).tolist()
+        medians = self._medians()
+        out = []
+        for label, zone_id in enumerate(zone_ids, start=1):
+            count = int(self.count[label])
+            pixels = int(self.pixels[label])
+            area = int(self.area[label])
+            out.append({
+                "zone_id": zone_id,
+                "mean_ndvi": float(self.total[label] / count) if count else None,
+                "median_ndvi": float(medians[label]) if count else None,
+                "pct_stress": float(self.below[label] / pixels) if pixels else 0.0,
+                "stress_threshold": self.stress_threshold,
+                "histogram": {"bins": coarse[label].tolist(), "edges": edges},
+                "pixel_count": count,
+                "valid_pixel_count": pixels,
+                "area_pixel_count": area,
+                "coverage_fraction": pixels / area if area else 0.0,
+            })
+        return out
@@ -1,22 +1,83 @@
 # ml_service/app.py
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+import time
+
+_import_started = time.perf_counter()  # boot timing, see app.core.serving
+
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body, Header
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List, Any
 from datetime import datetime
 import numpy as np
 from PIL import Image
 import io
+import base64
 import hashlib
 import logging
 import os
 import asyncio
 import json
-import httpx
-from fastapi import BackgroundTasks
+from contextlib import ExitStack, asynccontextmanager
+
+from app.core.executor import compute_pool, PoolSaturated
+from app.core.farm_metadata import backend_client
+from app.core.alert_outbox import alert_outbox
+from app.core.result_cache import result_cache
+from app.core.ndvi_stats import combine_masks, compute_ndvi_stats, coverage
+from app.core.tiles import tile_store, tiles_url_for, preview_url_for, render_tile, render_scene_preview, TILE_FORMATS
+from app.core.preview import NDVI_PREVIEW_MAX_SIZE, PALETTES, get_palette
+from app.core.timeseries import ndvi_series
+from app.core.coregister import plan_cache, resample_array
+from app.core.image_decode import NDVI_MAX_SOURCE_PIXELS, BandTooLarge, check_source_pixels, decode_band_image, decode_band_pair
+from app.core.upload_spool import SpooledUpload, UploadTooLarge, band_buffer, read_upload, remove_spooled
+from app.core.metrics import NDVI_METRICS_ENABLED, MetricsMiddleware, StageTimer, observe_result, profiles_total, registry
+from app.core.profiling import collapsed, profile_call, profile_store, profile_trigger
+from app.core.remote_source import block_cache
+from app.core.jobs import FINAL_STATUSES, job_manager
+from app.core.quicklook import NDVI_QUICK_SAMPLE_PIXELS, approx_mode, sampled_ndvi_stats
+from app.core.indices import normalize_indices
+from app.core.serving import NDVI_WARMUP, boot_report, boot_stats, boot_timer, preload, warm_up, warm_worker
+from app.api.ndvi import router as raster_router
+from app.models.schemas import NDVIComputeRequest, IndicesComputeRequest, ZonalComputeRequest, NDVIJobRequest
+from app.core.array_ingest import (
+    band_to_float,
+    decode_binary_array,
+    describe_binary_array,
+    is_npy,
+    split_stacked_bands,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # pool processes import this module (the pipeline functions live here) and warm up as they start
+    compute_pool.start(warm_worker, (__name__,))
+    await backend_client.start()
+    await alert_outbox.start()
+    await job_manager.start()
+    if NDVI_WARMUP:
+        # no-ops for what a preloading parent (gunicorn.conf.py) already did
+        await asyncio.to_thread(preload)
+        await asyncio.to_thread(warm_up)
+        with boot_timer.stage("pool_warmup"):
+            await compute_pool.warm()
+    boot_timer.add("lifespan", time.perf_counter() - started)
+    logger.info(f"NDVI service ready (pid={os.getpid()}): "
+                + ", ".join(f"{name}={ms:.0f}ms" for name, ms in boot_report()["stages_ms"].items()))
+    try:
+        yield
+    finally:
+        await job_manager.stop()
+        await alert_outbox.stop()
+        await backend_client.close()
+        compute_pool.shutdown()
 
 
-app = FastAPI(title="AgriSense-360 ML Service - NDVI (with auto-resize)")
+app = FastAPI(title="AgriSense-360 ML Service - NDVI (with auto-resize)", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+# raster (path / URL) endpoints: /v1/ndvi/raster/compute, /indices, /zonal
+app.include_router(raster_router, prefix="/v1/ndvi/raster", tags=["raster"])
 
 logger = logging.getLogger("ml_service")
 logging.basicConfig(level=logging.INFO)
@@ -25,45 +86,9 @@ logging.basicConfig(level=logging.INFO)
 # ---------- helpers ----------
 def imagefile_to_gray_array(file_bytes: bytes) -> np.ndarray:
     """
-    Load an image (RGB or grayscale) and return a 2D float array 0..1
-    """
-    img = Image.open(io.BytesIO(file_bytes))
-    # convert to RGB when necessary
-    if img.mode == "RGBA":
-        img = img.convert("RGB")
-    if img.mode == "RGB":
-        arr = np.asarray(img).astype("float32") / 255.0  # HxWx3
-        # luminance conversion to single channel
-        gray = 0.2989 * arr[..., 0] + 0.5870 * arr[..., 1] + 0.1140 * arr[..., 2]
-        return gray
-    else:
-        # convert to L (single channel)
-        arr = np.asarray(img.convert("L")).astype("float32") / 255.0
-        return arr
-
-
-# envs
-BACKEND_URL = os.getenv("BACKEND_URL")
-BACKEND_FARMS_PATH = os.getenv("BACKEND_FARMS_PATH", "/api/farms")
-
-async def fetch_farm_metadata(farm_id: Optional[str]):
-    """
-    Fetch farm metadata from backend: expected shape { farmId, farmName, owner: { telegramChatId, ... }, tiles_url?... }
-    Returns dict or None.
+    Load an image (RGB or grayscale, 8 or 16 bit) and return a 2D float array 0..1
     """
-    if not BACKEND_URL or not farm_id:
-        return None
-    url = f"{BACKEND_URL.rstrip('/')}{BACKEND_FARMS_PATH.rstrip('/')}/{farm_id}"
-    try:
-        async with httpx.AsyncClient(verify=False, timeout=5.0) as client:
-            r = await client.get(url)
-            if r.status_code == 200:
-                return r.json()
-            logger.warning(f"fetch_farm_metadata: backend returned {r.status_code} for farm {farm_id}: {r.text}")
-    except Exception as e:
-        logger.warning(f"fetch_farm_metadata error for {farm_id}: {e}")
-    return None
-
+    return band_to_float(decode_band_image(io.BytesIO(file_bytes)))
 
 
 def arrays_to_ndvi(nir: np.ndarray, red: np.ndarray) -> np.ndarray:
@@ -97,63 +122,327 @@ def deterministic_report_id(farm_id: Optional[str], capture_date: str, pct_stres
 
 def resize_array_to_shape(arr: np.ndarray, target_shape: tuple) -> np.ndarray:
     """
-    Resize a 2D float32 array (0..1) to target_shape (height, width).
-    Uses PIL.Image.resize with bilinear interpolation.
+    Resize a 2D band to target_shape (height, width) with bilinear interpolation in float32
+    (see app.core.coregister.resample_array): the result is in the band's own units, with no
+    8-bit round trip, so 16-bit bands keep their precision.
     """
     if arr.shape == target_shape:
         return arr
-    # convert float 0..1 -> uint8 0..255
-    arr_uint8 = np.clip((arr * 255.0), 0, 255).astype("uint8")
-    img = Image.fromarray(arr_uint8, mode="L")
-    # PIL expects (width, height)
-    resized = img.resize((target_shape[1], target_shape[0]), resample=Image.BILINEAR)
-    resized_arr = np.asarray(resized).astype("float32") / 255.0
+    resized_arr = resample_array(arr, target_shape)
     logger.info(f"Resized array from {arr.shape} to {target_shape}")
     return resized_arr
 
-# ---------- n8n sender helper ----------
-N8N_WEBHOOK = os.getenv("N8N_WEBHOOK_URL")  # e.g. https://localhost:5678/webhook/ndvi-alert
-N8N_SERVICE_TOKEN = os.getenv("N8N_SERVICE_TOKEN")  # optional, for your webhook auth
-N8N_MAX_RETRIES = int(os.getenv("N8N_MAX_RETRIES", "3"))
-N8N_RETRY_BASE_SECONDS = float(os.getenv("N8N_RETRY_BASE_SECONDS", "1.0"))
 
-async def send_to_n8n(payload: dict):
+def normalize_band_pair(nir_arr: np.ndarray, red_arr: np.ndarray):
     """
-    Async send to n8n webhook with retries.
-    Payload should be JSON-serializable.
+    Simple normalization heuristic: if values > 1, scale both bands by their common max.
     """
-    if not N8N_WEBHOOK:
-        logger.info("N8N_WEBHOOK_URL not set — skipping send_to_n8n")
-        return {"sent": False, "reason": "no_webhook_configured"}
+    maxv = float(max(np.nanmax(nir_arr), np.nanmax(red_arr)))
+    if maxv > 1.0:
+        nir_arr = nir_arr / maxv
+        red_arr = red_arr / maxv
+    return nir_arr, red_arr
 
-    headers = {"Content-Type": "application/json"}
-    if N8N_SERVICE_TOKEN:
-        headers["X-Service-Token"] = N8N_SERVICE_TOKEN
 
-    last_exc = None
-    async with httpx.AsyncClient(verify=False, timeout=10.0) as client:
-        for attempt in range(1, N8N_MAX_RETRIES + 1):
+def binary_band_pair(nir_raw: np.ndarray, red_raw: np.ndarray):
+    """
+    Bands decoded from .npy / raw buffers. Integer bands of one dtype stay in their native dtype
+    (zero-copy views of the upload: NDVI is scale-invariant and the stats kernel promotes per
+    chunk); anything else goes to float32 and through normalize_band_pair.
+    """
+    if nir_raw.dtype == red_raw.dtype and nir_raw.dtype.kind in "ui":
+        return nir_raw, red_raw
+    return normalize_band_pair(band_to_float(nir_raw), band_to_float(red_raw))
+
+
+# ---------- compute pipeline (runs on the compute pool) ----------
+def load_band_arrays(inputs: dict, timer: Optional[StageTimer] = None, with_valid: bool = False,
+                     buffers: Optional[ExitStack] = None):
+    """
+    Decode raw request inputs into (nir, red) 2D float arrays, reducing
+    3-channel inputs to luminance and resizing mismatched shapes.
+    inputs holds either 'nir'/'red' nested lists, 'nir_bytes'/'red_bytes' (images, .npy or raw
+    buffers described by 'array_dtype'/'array_shape'), a stacked 'bands_bytes' buffer or 'image_bytes',
+    plus an optional 'nodata' value.
+    timer (optional) receives the "decode" and "resize" stage durations.
+    with_valid: return (nir, red, valid) where valid masks the pixels that hold a value in both
+    bands (None when all do).
+    buffers (optional): spooled bands are mapped on this stack (see band_buffer); the arrays may
+    view those maps, so they must be dropped before it exits.
+    """
+    timer = timer or StageTimer()
+    with timer.stage("decode"):
+        nir_arr, red_arr, nir_valid, red_valid = _decode_band_inputs(inputs, buffers)
+
+    # ---------- resize mismatched shapes (best-effort) ----------
+    if nir_arr.shape != red_arr.shape:
+        with timer.stage("resize"):
             try:
-                logger.info(f"Sending NDVI payload to n8n (attempt {attempt})")
-                r = await client.post(N8N_WEBHOOK, json=payload, headers=headers)
-                # Accept 2xx as success
-                if 200 <= r.status_code < 300:
-                    logger.info(f"n8n accepted payload (status={r.status_code})")
-                    return {"sent": True, "status_code": r.status_code, "body": r.text}
-                else:
-                    logger.warning(f"n8n returned status {r.status_code}: {r.text}")
-                    last_exc = Exception(f"status {r.status_code}: {r.text}")
+                target = nir_arr.shape
+                red_arr = resize_array_to_shape(red_arr, target)
+                red_valid = _resize_valid(red_valid, target)
+            except Exception as e:
+                logger.warning(f"Failed to resize red->nir: {e}, trying reverse resize")
+                target = red_arr.shape
+                nir_arr = resize_array_to_shape(nir_arr, target)
+                nir_valid = _resize_valid(nir_valid, target)
+
+    if with_valid:
+        return nir_arr, red_arr, combine_masks(nir_valid, red_valid)
+    return nir_arr, red_arr
+
+
+def _band_valid(arr: np.ndarray, nodata: Optional[float]) -> Optional[np.ndarray]:
+    """Pixels of a decoded (native dtype) band that hold a value: not nodata, not NaN. None when all do."""
+    valid = np.isfinite(arr) if arr.dtype.kind == "f" else None
+    if nodata is not None and not np.isnan(nodata):
+        valid = combine_masks(arr != nodata, valid)
+    if valid is None or valid.all():
+        return None
+    if valid.ndim == 3:
+        valid = valid.all(axis=-1)
+    return valid
+
+
+def _resize_valid(valid: Optional[np.ndarray], target_shape: tuple) -> Optional[np.ndarray]:
+    """Nearest-neighbour resize of a validity mask to the other band's grid."""
+    if valid is None:
+        return None
+    return resample_array(valid.astype(np.float32), target_shape, "nearest") > 0.5
+
+
+def _image_source(value):
+    """Zero-argument opener for an image band held in memory or spooled to disk."""
+    if isinstance(value, SpooledUpload):
+        return lambda: value.path
+    return lambda: io.BytesIO(value)
+
+
+def _decode_band_inputs(inputs: dict, buffers: Optional[ExitStack] = None):
+    """
+    Decode the band inputs of load_band_arrays to 2D arrays (shapes may still differ).
+    Returns (nir, red, nir_valid, red_valid); the validity masks are taken on the raw values
+    (inputs['nodata'] is in the units of the upload) and are None when every pixel is valid.
+    """
+    nodata = inputs.get("nodata")
+    if "nir" in inputs and "red" in inputs:
+        nir_arr = np.array(inputs["nir"], dtype="float32")
+        red_arr = np.array(inputs["red"], dtype="float32")
+        nir_valid, red_valid = _band_valid(nir_arr, nodata), _band_valid(red_arr, nodata)
+        nir_arr, red_arr = normalize_band_pair(nir_arr, red_arr)
+    elif "bands_bytes" in inputs:
+        stacked = decode_binary_array(band_buffer(inputs["bands_bytes"], buffers), inputs.get("array_dtype"), inputs.get("array_shape"))
+        nir_raw, red_raw = split_stacked_bands(stacked)
+        nir_valid, red_valid = _band_valid(nir_raw, nodata), _band_valid(red_raw, nodata)
+        nir_arr, red_arr = binary_band_pair(nir_raw, red_raw)
+    elif "nir_bytes" in inputs and "red_bytes" in inputs:
+        nir_buf, red_buf = band_buffer(inputs["nir_bytes"], buffers), band_buffer(inputs["red_bytes"], buffers)
+        if inputs.get("array_dtype") or is_npy(nir_buf):
+            nir_raw = decode_binary_array(nir_buf, inputs.get("array_dtype"), inputs.get("array_shape"))
+            red_raw = decode_binary_array(red_buf, inputs.get("array_dtype"), inputs.get("array_shape"))
+            nir_valid, red_valid = _band_valid(nir_raw, nodata), _band_valid(red_raw, nodata)
+            nir_arr, red_arr = binary_band_pair(nir_raw, red_raw)
+        else:
+            nir_arr, red_arr = decode_band_pair(_image_source(inputs["nir_bytes"]), _image_source(inputs["red_bytes"]))
+            nir_valid, red_valid = _band_valid(nir_arr, nodata), _band_valid(red_arr, nodata)
+            # same bit depth: NDVI is scale-invariant, so the bands stay in their native dtype
+            # (promoted per chunk by the stats kernel); otherwise compare on a common 0..1 scale
+            if nir_arr.dtype != red_arr.dtype:
+                nir_arr, red_arr = band_to_float(nir_arr), band_to_float(red_arr)
+    elif "image_bytes" in inputs:
+        with Image.open(_image_source(inputs["image_bytes"])()) as img:
+            # fallback: use red channel for both (synthetic)
+            raw = np.asarray(img.convert("RGB").getchannel("R"))
+        arr = band_to_float(raw)
+        nir_arr = arr
+        red_arr = arr
+        nir_valid = red_valid = _band_valid(raw, nodata)
+    else:
+        raise ValueError("no band inputs supplied")
+
+    # ---------- normalize / reduce channels ----------
+    if nir_arr.ndim == 3:
+        nir_arr = 0.2989 * nir_arr[..., 0] + 0.5870 * nir_arr[..., 1] + 0.1140 * nir_arr[..., 2]
+    if red_arr.ndim == 3:
+        red_arr = 0.2989 * red_arr[..., 0] + 0.5870 * red_arr[..., 1] + 0.1140 * red_arr[..., 2]
+    return nir_arr, red_arr, nir_valid, red_valid
+
+
+def run_ndvi_pipeline(inputs: dict, threshold: float, tiles_key: Optional[str] = None, profile: bool = False,
+                      approx: Optional[str] = None) -> dict:
+    """
+    Decode + NDVI math for one request. Executed on the compute pool, so it must
+    stay a module-level function and return only small, picklable stats.
+    With tiles_key, the NDVI raster is also stored as the base of a tile pyramid (nodata pixels
+    stay NaN there). Only valid pixels (see _band_valid) are computed; the stats report coverage.
+    approx ("strided" / "random"): quick look from a pixel sample (see app.core.quicklook);
+    no resize, no tile base, and the stats carry an "approximate" block with confidence intervals.
+    The worker-side stage durations come back under "timings" (and the profiler report under
+    "profile" when profile is set); callers strip both before caching.
+    """
+    if profile:
+        stats, report = profile_call(run_ndvi_pipeline, inputs, threshold, tiles_key, False, approx)
+        stats["profile"] = report
+        return stats
+    # spooled bands are mapped for the duration of the job; the arrays viewing them are locals of
+    # _ndvi_pipeline and gone by the time the maps are closed
+    with ExitStack() as buffers:
+        return _ndvi_pipeline(inputs, threshold, tiles_key, approx, buffers)
+
+
+def _ndvi_pipeline(inputs: dict, threshold: float, tiles_key: Optional[str], approx: Optional[str],
+                   buffers: ExitStack) -> dict:
+    timer = StageTimer()
+    if approx:
+        # both bands are sampled at the same relative positions, so mismatched shapes need no resize
+        with timer.stage("decode"):
+            nir_arr, red_arr, nir_valid, red_valid = _decode_band_inputs(inputs, buffers)
+        stats = sampled_ndvi_stats(nir_arr, red_arr, threshold, approx, timings=timer.stages,
+                                   nir_valid=nir_valid, red_valid=red_valid)
+        return {
+            "mean_ndvi": stats["mean_ndvi"],
+            "median_ndvi": stats["median_ndvi"],
+            "pct_stress": stats["pct_stress"],
+            "histogram": stats["histogram"],
+            "pixel_count": stats["pixel_count"],
+            **_coverage_fields(stats, nir_arr.size),
+            "approximate": stats["approximate"],
+            "timings": timer.stages,
+        }
+    nir_arr, red_arr, valid = load_band_arrays(inputs, timer, with_valid=True, buffers=buffers)
+    if tiles_key and tile_store.enabled:
+        ndvi = np.empty(nir_arr.shape, dtype=np.float32)
+        stats = compute_ndvi_stats(nir_arr, red_arr, threshold, ndvi_out=ndvi, timings=timer.stages, valid=valid)
+        with timer.stage("tiles"):
+            try:
+                tile_store.save_base(tiles_key, ndvi)
             except Exception as e:
-                logger.warning(f"send_to_n8n attempt {attempt} failed: {e}")
-                last_exc = e
+                logger.warning(f"Could not store NDVI tile base {tiles_key}: {e}")
+    else:
+        stats = compute_ndvi_stats(nir_arr, red_arr, threshold, timings=timer.stages, valid=valid)
+    return {
+        "mean_ndvi": stats["mean_ndvi"],
+        "median_ndvi": stats["median_ndvi"],
+        "pct_stress": stats["pct_stress"],
+        "histogram": stats["histogram"],
+        "pixel_count": stats["pixel_count"],
+        **_coverage_fields(stats, nir_arr.size),
+        "timings": timer.stages,
+    }
+
+
+def _coverage_fields(stats: dict, area_pixels: int) -> dict:
+    """Coverage of an upload (the whole image is the requested area); every pixel is valid without a mask."""
+    if "valid_pixel_count" in stats:
+        return coverage(stats["valid_pixel_count"], stats["area_pixel_count"])
+    return coverage(area_pixels, area_pixels)
+
+
+# ---------- report / alert payload builders ----------
+def build_ndvi_report(stats: dict, farm_id: Optional[str], cap_date: str, threshold: float) -> dict:
+    """
+    Shape pipeline stats into the ndviReport returned to clients and forwarded to n8n.
+    Quick-look stats keep their "approximate" block (sample size, confidence intervals).
+    """
+    report = {
+        "reportId": deterministic_report_id(farm_id, cap_date, stats["pct_stress"]),
+        "captureDate": cap_date,
+        "mean_ndvi": stats["mean_ndvi"],
+        "median_ndvi": stats["median_ndvi"],
+        "pct_stress": stats["pct_stress"],
+        "stress_threshold": threshold,
+        "histogram": stats["histogram"],
+        "tiles_url": None,  # may be filled from farm metadata below
+    }
+    if "coverage_fraction" in stats:
+        report.update(coverage(stats["valid_pixel_count"], stats["area_pixel_count"]))
+    if "approximate" in stats:
+        report["approximate"] = stats["approximate"]
+    return report
+
+
+def report_has_pixels(ndvi_report: dict) -> bool:
+    """
+    False for a capture without one valid pixel (all nodata / masked): its mean / median are
+    None, so it is neither added to the time series nor alerted on.
+    """
+    return ndvi_report.get("valid_pixel_count", 1) > 0
+
+
+def _normalize_owner(owner_candidate: Optional[dict]) -> Optional[dict]:
+    """
+    Canonicalize the telegram id (telegramChatId / telegram_id / chat_id) into a telegramChatId string.
+    """
+    if not owner_candidate:
+        return None
+    telegram_id = owner_candidate.get("telegramChatId") or owner_candidate.get("telegram_id") or owner_candidate.get("chat_id")
+    if telegram_id is not None:
+        # make sure it's a string (Telegram accepts numeric, but we keep consistent)
+        owner_candidate = {**owner_candidate, "telegramChatId": str(telegram_id)}
+    return owner_candidate
+
+
+def payload_farm_metadata(payload: Optional[dict], farm_id: Optional[str]) -> Optional[dict]:
+    """
+    Farm metadata supplied inline by the caller (owner, farmName, ndviReport.tiles_url), if any.
+    """
+    if payload and isinstance(payload, dict):
+        if any(k in payload for k in ("owner", "farmName")) or (payload.get("ndviReport") or {}).get("tiles_url"):
+            return {
+                "farmId": farm_id,
+                "farmName": payload.get("farmName"),
+                "owner": payload.get("owner"),
+                "tiles_url": (payload.get("ndviReport") or {}).get("tiles_url")
+            }
+    return None
+
+
+def build_n8n_payload(ndvi_report: dict, farm_id: Optional[str], farm_meta: Optional[dict], payload: Optional[dict] = None) -> dict:
+    """
+    Compose the n8n alert payload (accepted shape) from the report and farm metadata.
+    """
+    # normalize owner / farmName / tiles_url for payload
+    owner_obj = None
+    farm_name_final = None
+    tiles_url_final = None
+
+    if farm_meta and isinstance(farm_meta, dict):
+        farm_name_final = farm_meta.get("farmName")
+        # ndvi_report.tiles_url takes precedence if present (e.g., generated preview)
+        tiles_url_final = ndvi_report.get("tiles_url") or farm_meta.get("tiles_url")
+        owner_obj = _normalize_owner(farm_meta.get("owner"))
 
-            # exponential backoff
-            backoff = N8N_RETRY_BASE_SECONDS * (2 ** (attempt - 1))
-            await asyncio.sleep(backoff)
+    # Also, if no farm_meta was found but payload contained farmName/owner fields individually, prefer them
+    if owner_obj is None and payload and isinstance(payload, dict) and payload.get("owner"):
+        owner_obj = _normalize_owner(payload.get("owner"))
+        if not farm_name_final and payload.get("farmName"):
+            farm_name_final = payload.get("farmName")
+        if not tiles_url_final:
+            tiles_url_final = (payload.get("ndviReport") or {}).get("tiles_url")
 
-    logger.error(f"Failed to send to n8n after {N8N_MAX_RETRIES} attempts: {last_exc}")
-    return {"sent": False, "reason": "failed_after_retries", "error": str(last_exc)}
+    pct_stress = ndvi_report["pct_stress"]
+    # friendly advisory text (localized later if you add translate step)
+    advisory_text = (
+        f"⚠️ AgriSense Alert — {farm_name_final or 'Unknown Farm'}\n"
+        f"Stress detected in {int(round(pct_stress * 100))}% of the field (mean NDVI {ndvi_report['mean_ndvi']:.2f}).\n"
+        f"Capture: {ndvi_report['captureDate']}\n"
+        f"Recommended: Inspect for pests/disease; check irrigation/fertilizer scheduling.\n"
+        f"NDVI tiles: {tiles_url_final or 'N/A'}"
+    )
 
+    return {
+        "farmId": farm_id,
+        "farmName": farm_name_final,
+        "owner": owner_obj,
+        "ndviReport": {
+            **ndvi_report,
+            "tiles_url": tiles_url_final
+        },
+        "advisory_en": advisory_text,
+        "pct_stress_numeric": pct_stress,
+        "stress_threshold_numeric": ndvi_report["stress_threshold"],
+        "sendAlert": True
+    }
 
 
 # ---------- request/response models ----------
@@ -165,210 +454,828 @@ class SimpleArrays(BaseModel):
     stress_threshold: Optional[float] = 0.3
 
 
+class BatchItem(BaseModel):
+    farmId: Optional[str] = None
+    captureDate: Optional[str] = None  # ISO string allowed
+    nir: Optional[List[List[float]]] = None
+    red: Optional[List[List[float]]] = None
+    nir_b64: Optional[str] = None  # base64 image, .npy or raw buffer (see array_dtype / array_shape)
+    red_b64: Optional[str] = None
+    array_dtype: Optional[str] = None
+    array_shape: Optional[str] = None
+    nodata: Optional[float] = None  # band value marking missing pixels (skipped, reported via coverage_fraction)
+    stress_threshold: Optional[float] = None  # defaults to the batch threshold
+
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    stress_threshold: Optional[float] = 0.3
+    sendAlerts: Optional[bool] = True
+
+
+# ---------- cached pipeline execution ----------
+def cache_bypass_requested(x_ndvi_cache: Optional[str], cache_control: Optional[str]) -> bool:
+    """
+    Clients skip the result-cache lookup with `X-NDVI-Cache: bypass` or `Cache-Control: no-cache`
+    (the fresh result is still stored).
+    """
+    if x_ndvi_cache and x_ndvi_cache.strip().lower() in ("bypass", "refresh", "no-cache"):
+        return True
+    return bool(cache_control and "no-cache" in cache_control.lower())
+
+
+async def cached_ndvi_stats(inputs: dict, threshold: float, bypass: bool = False, saturation_retries: int = 0,
+                            timer: Optional[StageTimer] = None, profile: Optional[str] = None, approx: Optional[str] = None):
+    """
+    Return (stats, cache_status, cache_key) for the inputs, serving repeats from the
+    content-addressed result cache and computing misses on the compute pool.
+    cache_status is one of hit-memory / hit-disk / miss / bypass; cache_key also names
+    the stored NDVI tile base.
+    timer (optional) receives the cache, pool (queue + transfer) and worker stage durations.
+    profile: trigger name ("header" / "sample") to run the pool job under the profiler; the
+    result cache is bypassed and the stored report id is left in timer.profile_id.
+    approx: quick-look sampling method; approximate results are cached under their own key.
+    """
+    timer = timer or StageTimer()
+    with timer.stage("cache"):
+        params = {"approx": approx, "sample_pixels": NDVI_QUICK_SAMPLE_PIXELS} if approx else None
+        key = await result_cache.key_for(inputs, threshold, params)
+        if bypass or profile:
+            result_cache.bypassed += 1
+        else:
+            stats, tier = await result_cache.get(key)
+            if stats is not None:
+                return stats, f"hit-{tier}", key
+    started = time.perf_counter()
+    for attempt in range(saturation_retries + 1):
+        try:
+            stats = await compute_pool.run(run_ndvi_pipeline, inputs, threshold, key, bool(profile), approx)
+            break
+        except PoolSaturated as e:
+            if attempt == saturation_retries:
+                raise
+            await asyncio.sleep(e.retry_after)
+    elapsed = time.perf_counter() - started
+    worker_timings = stats.pop("timings", None) or {}
+    report = stats.pop("profile", None)
+    timer.add("pool", max(0.0, elapsed - sum(worker_timings.values())))
+    timer.merge(worker_timings)
+    if report:
+        report.update({"trigger": profile, "stages_ms": {k: v * 1000 for k, v in worker_timings.items()}})
+        try:
+            timer.profile_id = await asyncio.to_thread(profile_store.save, report)
+            profiles_total.inc(trigger=profile)
+        except Exception as e:
+            logger.warning(f"Could not store NDVI profile: {e}")
+    await result_cache.put(key, stats)
+    return stats, ("bypass" if bypass or profile else "miss"), key
+
+
+NDVI_TILES_PRUNE_INTERVAL_SECONDS = float(os.getenv("NDVI_TILES_PRUNE_INTERVAL_SECONDS", "300"))
+_last_tiles_prune = 0.0
+
+
+async def attach_tiles(ndvi_report: dict, cache_key: str):
+    """
+    Link the report to its stored NDVI raster and fill tiles_url / preview_url (best-effort).
+    """
+    global _last_tiles_prune
+    if not tile_store.enabled:
+        return
+    try:
+        if not await asyncio.to_thread(tile_store.has_base, cache_key):
+            return
+        await asyncio.to_thread(tile_store.link, ndvi_report["reportId"], cache_key)
+        ndvi_report["tiles_url"] = tiles_url_for(ndvi_report["reportId"])
+        ndvi_report["preview_url"] = preview_url_for(ndvi_report["reportId"])
+        now = time.monotonic()
+        if now - _last_tiles_prune > NDVI_TILES_PRUNE_INTERVAL_SECONDS:
+            _last_tiles_prune = now
+            asyncio.create_task(asyncio.to_thread(tile_store.prune))
+    except Exception as e:
+        logger.warning(f"Could not attach tiles to report {ndvi_report.get('reportId')}: {e}")
+
+
 # ---------- endpoint ----------
+async def record_series(ndvi_report: dict, farm_id: Optional[str], cache_key: str):
+    """
+    Append the capture to the farm's NDVI time series (best-effort) and attach the change
+    versus the previous stored capture as ndviReport.change. Captures without valid pixels are skipped.
+    """
+    if not ndvi_series.enabled or not farm_id or not report_has_pixels(ndvi_report):
+        return
+    try:
+        base_path = None
+        if tile_store.enabled and await asyncio.to_thread(tile_store.has_base, cache_key):
+            base_path = tile_store.base_path(cache_key)
+        previous = await asyncio.to_thread(ndvi_series.record, farm_id, ndvi_report, base_path)
+        if previous:
+            ndvi_report["change"] = {
+                "previousCaptureDate": previous["captureDate"],
+                "previousReportId": previous["reportId"],
+                "delta_mean_ndvi": ndvi_report["mean_ndvi"] - previous["mean_ndvi"],
+                "delta_pct_stress": ndvi_report["pct_stress"] - previous["pct_stress"],
+                "stress_worsened": ndvi_report["pct_stress"] > previous["pct_stress"],
+            }
+    except Exception as e:
+        logger.warning(f"Could not record NDVI time series for farm {farm_id}: {e}")
+
+
+NDVI_REFINE_SATURATION_RETRIES = int(os.getenv("NDVI_REFINE_SATURATION_RETRIES", "10"))
+_refine_tasks = set()
+refine_counts = {"scheduled": 0, "completed": 0, "failed": 0}
+
+
+async def refine_exact(inputs: dict, threshold: float, farm_id: Optional[str], cap_date: str,
+                       farm_meta: Optional[dict], payload: Optional[dict]):
+    """
+    Background follow-up of a quick look: compute the exact stats (stored in the result cache
+    and as tile base), replace the capture's time-series entry, and queue the n8n alert that
+    the quick look held back. Owns the request inputs (spooled bands are released at the end).
+    """
+    try:
+        stats, _, cache_key = await cached_ndvi_stats(inputs, threshold, saturation_retries=NDVI_REFINE_SATURATION_RETRIES)
+        ndvi_report = build_ndvi_report(stats, farm_id, cap_date, threshold)
+        await attach_tiles(ndvi_report, cache_key)
+        await record_series(ndvi_report, farm_id, cache_key)
+        if report_has_pixels(ndvi_report):
+            await alert_outbox.enqueue(build_n8n_payload(ndvi_report, farm_id, farm_meta, payload))
+        refine_counts["completed"] += 1
+        logger.info(f"Refined quick-look NDVI for farm {farm_id} ({cap_date}) -> report {ndvi_report['reportId']}")
+    except Exception:
+        refine_counts["failed"] += 1
+        logger.exception(f"Could not refine quick-look NDVI for farm {farm_id} ({cap_date})")
+    finally:
+        remove_spooled(inputs)
+
+
+def schedule_refine(*args):
+    refine_counts["scheduled"] += 1
+    task = asyncio.create_task(refine_exact(*args))
+    _refine_tasks.add(task)
+    task.add_done_callback(_refine_tasks.discard)
+
+
+async def read_band_uploads(files: dict) -> dict:
+    """
+    Read the band uploads concurrently (bytes, or SpooledUpload past NDVI_UPLOAD_SPOOL_MB).
+    On failure no SpooledUpload is left open.
+    """
+    results = await asyncio.gather(*(read_upload(f) for f in files.values()), return_exceptions=True)
+    inputs = {k: v for k, v in zip(files, results) if not isinstance(v, BaseException)}
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        remove_spooled(inputs)
+        raise errors[0]
+    return inputs
+
+
 @app.post("/v1/ndvi/compute")
 async def compute_ndvi(
     nir_file: Optional[UploadFile] = File(None),
     red_file: Optional[UploadFile] = File(None),
     image: Optional[UploadFile] = File(None),
+    bands_file: Optional[UploadFile] = File(None),
     payload: Optional[dict] = Body(None),
     farmId: Optional[str] = Form(None),
     captureDate: Optional[str] = Form(None),
     stress_threshold: Optional[float] = Form(0.3),
-    background_tasks: BackgroundTasks = None,
+    array_dtype: Optional[str] = Form(None),
+    array_shape: Optional[str] = Form(None),
+    nodata: Optional[float] = Form(None),
+    approx: Optional[str] = Form(None),
+    refine: Optional[bool] = Form(False),
+    x_ndvi_cache: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+    x_ndvi_profile: Optional[str] = Header(None),
 ):
     """
-    Compute NDVI -> produce ndvi_report and schedule a background send to n8n
+    Compute NDVI -> produce ndvi_report and queue an alert for n8n
+    Results are cached by input content (see cache_bypass_requested for skipping the cache);
+    the X-NDVI-Cache response header reports hit-memory / hit-disk / miss / bypass.
+    Stage durations are returned in a Server-Timing header; when picked by NDVI_PROFILE_SAMPLE_RATE
+    or asked for with the X-NDVI-Profile header (off unless NDVI_PROFILE_TOKEN or
+    NDVI_PROFILE_ALLOW_HEADER is set, see app.core.profiling) the compute job is profiled and the
+    X-NDVI-Profile response header names the report under /v1/ndvi/profiles/{id}.
+    Band inputs: JSON nir/red arrays, image files, or binary arrays (.npy, or raw little-endian
+    float32/uint16 with array_dtype + array_shape), either as nir_file+red_file or one stacked
+    (2, H, W) bands_file. nodata (form field or payload key) marks missing pixels in the band's own
+    units; they are skipped (as are NaNs) and ndviReport reports valid_pixel_count,
+    area_pixel_count and coverage_fraction. Without a single valid pixel mean_ndvi / median_ndvi
+    are null and the capture is neither added to the time series nor alerted on.
+    Quick look: approx=true (strided sample) or approx=random estimates the stats from about
+    NDVI_QUICK_SAMPLE_PIXELS pixels and adds ndviReport.approximate (sample size, confidence
+    intervals). Quick looks queue no n8n alert and are not added to the time series; with
+    refine=true the exact stats are computed in the background, which records the capture in
+    the time series, links its tiles, caches the exact result and queues the alert.
     Attempts to enrich payload with farm metadata (owner, farmName, tiles_url) by:
       1) using fields present in incoming payload
       2) otherwise calling backend /api/farms/{farmId} (if BACKEND_URL env set)
     """
+    timer = StageTimer()
+    inputs = {}
+    refining = False
     try:
-        # ---------- load input arrays ----------
+        try:
+            approx = approx_mode(approx if approx is not None else (payload or {}).get("approx"))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        refine = bool(approx) and bool(refine or (payload or {}).get("refine"))
+
+        # ---------- collect raw inputs (I/O only, stays on the event loop) ----------
         if payload:
             if "nir" in payload and "red" in payload:
-                nir_arr = np.array(payload["nir"], dtype="float32")
-                red_arr = np.array(payload["red"], dtype="float32")
-                # simple normalization heuristic if values > 1
-                maxv = float(max(np.nanmax(nir_arr), np.nanmax(red_arr)))
-                if maxv > 1.0:
-                    nir_arr = nir_arr / maxv
-                    red_arr = red_arr / maxv
+                inputs = {"nir": payload["nir"], "red": payload["red"]}
             else:
                 raise HTTPException(status_code=400, detail="JSON payload must include 'nir' and 'red' arrays")
         else:
-            if nir_file and red_file:
-                nir_bytes = await nir_file.read()
-                red_bytes = await red_file.read()
-                nir_arr = imagefile_to_gray_array(nir_bytes)
-                red_arr = imagefile_to_gray_array(red_bytes)
-            elif image:
-                img_bytes = await image.read()
-                img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-                arr = np.asarray(img).astype("float32") / 255.0
-                # fallback: use red channel for both (synthetic)
-                nir_arr = arr[..., 0]
-                red_arr = arr[..., 0]
-            else:
-                raise HTTPException(status_code=400, detail="Provide JSON payload or multipart with files ('nir_file'+'red_file' or 'image')")
-
-        # ---------- normalize / reduce channels ----------
-        if nir_arr.ndim == 3:
-            nir_arr = 0.2989 * nir_arr[..., 0] + 0.5870 * nir_arr[..., 1] + 0.1140 * nir_arr[..., 2]
-        if red_arr.ndim == 3:
-            red_arr = 0.2989 * red_arr[..., 0] + 0.5870 * red_arr[..., 1] + 0.1140 * red_arr[..., 2]
-
-        # ---------- resize mismatched shapes (best-effort) ----------
-        if nir_arr.shape != red_arr.shape:
+            with timer.stage("read"):
+                if nir_file and red_file:
+                    inputs = await read_band_uploads({"nir_bytes": nir_file, "red_bytes": red_file})
+                elif bands_file:
+                    inputs = await read_band_uploads({"bands_bytes": bands_file})
+                elif image:
+                    inputs = await read_band_uploads({"image_bytes": image})
+                else:
+                    raise HTTPException(status_code=400, detail="Provide JSON payload or multipart with files ('nir_file'+'red_file', 'bands_file' or 'image')")
+            if array_dtype or array_shape:
+                inputs.update({"array_dtype": array_dtype, "array_shape": array_shape})
+        nodata = nodata if nodata is not None else (payload or {}).get("nodata")
+        if nodata is not None:
             try:
-                target = nir_arr.shape
-                red_arr = resize_array_to_shape(red_arr, target)
-            except Exception as e:
-                logger.warning(f"Failed to resize red->nir: {e}, trying reverse resize")
-                target = red_arr.shape
-                nir_arr = resize_array_to_shape(nir_arr, target)
+                inputs["nodata"] = float(nodata)
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"nodata must be a number, got {nodata!r}")
 
-        # ---------- compute NDVI and stats ----------
-        ndvi = arrays_to_ndvi(nir_arr, red_arr)
-        mean_ndvi = float(np.nanmean(ndvi))
-        median_ndvi = float(np.nanmedian(ndvi))
+        # ---------- validate binary array headers (cheap, no decode) ----------
+        for key in ("nir_bytes", "red_bytes", "bands_bytes"):
+            if key not in inputs:
+                continue
+            with ExitStack() as buffers:
+                buf = band_buffer(inputs[key], buffers)
+                if not (array_dtype or key == "bands_bytes" or is_npy(buf)):
+                    continue
+                try:
+                    _, shape, _, _ = describe_binary_array(buf, array_dtype, array_shape)
+                    if key == "bands_bytes" and (len(shape) != 3 or shape[0] != 2):
+                        raise ValueError(f"stacked bands must have shape (2, H, W), got {shape}")
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=f"Invalid binary array in {key[:-6]}_file: {e}")
+                if shape[-1] * shape[-2] > NDVI_MAX_SOURCE_PIXELS:
+                    raise HTTPException(status_code=413, detail=f"{key[:-6]} band has {shape[-1] * shape[-2]} pixels, "
+                                                                f"limit is {NDVI_MAX_SOURCE_PIXELS}")
+
+        # ---------- decode + compute NDVI stats on the compute pool (or serve from cache) ----------
         threshold = float(stress_threshold or 0.3)
-        pct_stress = percent_below_threshold(ndvi, threshold)
+        try:
+            stats, cache_status, cache_key = await cached_ndvi_stats(
+                inputs, threshold, bypass=cache_bypass_requested(x_ndvi_cache, cache_control),
+                timer=timer, profile=profile_trigger(x_ndvi_profile), approx=approx,
+            )
+        except PoolSaturated as e:
+            raise HTTPException(
+                status_code=503,
+                detail="NDVI compute pool is saturated, retry later",
+                headers={"Retry-After": str(e.retry_after)},
+            )
 
         # capture date
         cap_date = captureDate or (payload.get("captureDate") if payload else None) or datetime.utcnow().isoformat() + "Z"
 
-        # deterministic id
-        report_id = deterministic_report_id(farmId or (payload.get("farmId") if payload else None), cap_date, pct_stress)
-
-        # histogram
-        hist, edges = np.histogram(ndvi.flatten(), bins=10, range=(-1.0, 1.0))
-        histogram = {"bins": hist.tolist(), "edges": edges.tolist()}
-
-        ndvi_report = {
-            "reportId": report_id,
-            "captureDate": cap_date,
-            "mean_ndvi": mean_ndvi,
-            "median_ndvi": median_ndvi,
-            "pct_stress": pct_stress,
-            "stress_threshold": threshold,
-            "histogram": histogram,
-            "tiles_url": None,  # may be filled from farm metadata below
-        }
+        # prefer farmId from form param, else payload
+        farm_id_for_n8n = farmId or (payload.get("farmId") if payload else None)
+
+        ndvi_report = build_ndvi_report(stats, farm_id_for_n8n, cap_date, threshold)
+        if not approx:
+            with timer.stage("tiles_link"):
+                await attach_tiles(ndvi_report, cache_key)
+            with timer.stage("series"):
+                await record_series(ndvi_report, farm_id_for_n8n, cache_key)
 
         # ---------- Build response payload (immediate) ----------
         response_payload = {"success": True, "ndviReport": ndvi_report}
+        if refine:
+            response_payload["refine"] = {"status": "scheduled"}
 
         # ---------- Enrichment: obtain farm metadata (owner, farmName, tiles_url) ----------
-        # prefer farmId from form param, else payload
-        farm_id_for_n8n = farmId or (payload.get("farmId") if payload else None)
-
-        # local helper to fetch farm metadata from backend (best-effort)
-        async def _fetch_farm_metadata_from_backend(fid: Optional[str]):
-            BACKEND_URL = os.getenv("BACKEND_URL")
-            BACKEND_FARMS_PATH = os.getenv("BACKEND_FARMS_PATH", "/api/farms")
-            if not BACKEND_URL or not fid:
-                return None
-            url = f"{BACKEND_URL.rstrip('/')}{BACKEND_FARMS_PATH.rstrip('/')}/{fid}"
-            try:
-                async with httpx.AsyncClient(verify=False, timeout=6.0) as client:
-                    r = await client.get(url)
-                    if r.status_code == 200:
-                        return r.json()
-                    logger.warning(f"fetch_farm_metadata: backend returned {r.status_code} for farm {fid}: {r.text}")
-            except Exception as e:
-                logger.warning(f"fetch_farm_metadata error for {fid}: {e}")
-            return None
-
         # 1) prefer any metadata passed in the incoming payload
-        farm_meta = None
-        if payload and isinstance(payload, dict):
-            if any(k in payload for k in ("owner", "farmName")) or (payload.get("ndviReport") or {}).get("tiles_url"):
-                farm_meta = {
-                    "farmId": farm_id_for_n8n,
-                    "farmName": payload.get("farmName"),
-                    "owner": payload.get("owner"),
-                    "tiles_url": (payload.get("ndviReport") or {}).get("tiles_url")
-                }
+        farm_meta = payload_farm_metadata(payload, farm_id_for_n8n)
 
         # 2) if missing, try backend
         if farm_meta is None and farm_id_for_n8n:
-            try:
-                farm_meta_backend = await _fetch_farm_metadata_from_backend(farm_id_for_n8n)
-                if farm_meta_backend:
-                    farm_meta = farm_meta_backend
-            except Exception as e:
-                logger.warning(f"Failed to fetch farm metadata for {farm_id_for_n8n}: {e}")
-
-        # normalize owner / farmName / tiles_url for payload
-        owner_obj = None
-        farm_name_final = None
-        tiles_url_final = None
-
-        if farm_meta:
-            farm_name_final = farm_meta.get("farmName") if isinstance(farm_meta, dict) else None
-            # ndvi_report.tiles_url takes precedence if present (e.g., generated preview)
-            tiles_url_final = ndvi_report.get("tiles_url") or farm_meta.get("tiles_url")
-            # owner normalization - accept multiple possible key names
-            owner_candidate = farm_meta.get("owner") if isinstance(farm_meta, dict) else None
-            if owner_candidate:
-                # canonicalize telegram id into telegramChatId string if possible
-                telegram_id = owner_candidate.get("telegramChatId") or owner_candidate.get("telegram_id") or owner_candidate.get("chat_id")
-                if telegram_id is not None:
-                    # make sure it's a string (Telegram accepts numeric, but we keep consistent)
-                    owner_candidate = {**owner_candidate, "telegramChatId": str(telegram_id)}
-                owner_obj = owner_candidate
-
-        # Also, if no farm_meta was found but payload contained farmName/owner fields individually, prefer them
-        if owner_obj is None and payload and isinstance(payload, dict) and payload.get("owner"):
-            owner_candidate = payload.get("owner")
-            telegram_id = owner_candidate.get("telegramChatId") or owner_candidate.get("telegram_id") or owner_candidate.get("chat_id")
-            if telegram_id is not None:
-                owner_candidate = {**owner_candidate, "telegramChatId": str(telegram_id)}
-            owner_obj = owner_candidate
-            if not farm_name_final and payload.get("farmName"):
-                farm_name_final = payload.get("farmName")
-            if not tiles_url_final:
-                tiles_url_final = (payload.get("ndviReport") or {}).get("tiles_url")
-
-        # ---------- Compose the final n8n payload (accepted shape) ----------
-        # friendly advisory text (localized later if you add translate step)
-        advisory_text = (
-            f"⚠️ AgriSense Alert — {farm_name_final or 'Unknown Farm'}\n"
-            f"Stress detected in {int(round(pct_stress * 100))}% of the field (mean NDVI {mean_ndvi:.2f}).\n"
-            f"Capture: {cap_date}\n"
-            f"Recommended: Inspect for pests/disease; check irrigation/fertilizer scheduling.\n"
-            f"NDVI tiles: {tiles_url_final or 'N/A'}"
-        )
-
-        n8n_payload = {
-            "farmId": farm_id_for_n8n,
-            "farmName": farm_name_final,
-            "owner": owner_obj,
-            "ndviReport": {
-                **ndvi_report,
-                "tiles_url": tiles_url_final
-            },
-            "advisory_en": advisory_text,
-            "pct_stress_numeric": pct_stress,
-            "stress_threshold_numeric": threshold,
-            "sendAlert": True
-        }
+            with timer.stage("enrich"):
+                try:
+                    farm_meta_backend = await backend_client.fetch_farm_metadata(farm_id_for_n8n)
+                    if farm_meta_backend:
+                        farm_meta = farm_meta_backend
+                except Exception as e:
+                    logger.warning(f"Failed to fetch farm metadata for {farm_id_for_n8n}: {e}")
 
-        # ---------- Schedule background send to n8n (non-blocking) ----------
-        try:
-            if background_tasks is not None:
-                background_tasks.add_task(send_to_n8n, n8n_payload)
-            else:
-                asyncio.create_task(send_to_n8n(n8n_payload))
-        except Exception as e:
-            logger.warning(f"Could not schedule send_to_n8n: {e}")
+        # ---------- Queue alert in the durable n8n outbox (delivered by the sender worker) ----------
+        if refine:
+            # the exact result is alerted on; the refine task now owns the (spooled) inputs
+            schedule_refine(inputs, threshold, farm_id_for_n8n, cap_date, farm_meta, payload)
+            refining = True
+        elif not approx and report_has_pixels(ndvi_report):
+            n8n_payload = build_n8n_payload(ndvi_report, farm_id_for_n8n, farm_meta, payload)
+            with timer.stage("alert"):
+                try:
+                    await alert_outbox.enqueue(n8n_payload)
+                except Exception as e:
+                    logger.warning(f"Could not queue n8n alert: {e}")
 
         # return immediate ML response
-        return JSONResponse(status_code=200, content=response_payload)
+        with timer.stage("serialize"):
+            response = JSONResponse(status_code=200, content=response_payload, headers={"X-NDVI-Cache": cache_status})
+        observe_result("compute", timer, inputs, stats, cache_status)
+        if NDVI_METRICS_ENABLED:
+            response.headers["Server-Timing"] = timer.server_timing()
+        if timer.profile_id:
+            response.headers["X-NDVI-Profile"] = timer.profile_id
+        return response
 
     except HTTPException:
         raise
+    except (UploadTooLarge, BandTooLarge) as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.exception("NDVI processing error")
         raise HTTPException(status_code=500, detail=f"NDVI processing failed: {str(e)}")
+    finally:
+        # spooled band handles only live as long as the request (or its refine task)
+        if not refining:
+            remove_spooled(inputs)
+
+
+# ---------- batch endpoint ----------
+NDVI_BATCH_MAX_ITEMS = int(os.getenv("NDVI_BATCH_MAX_ITEMS", "500"))
+NDVI_BATCH_SATURATION_RETRIES = int(os.getenv("NDVI_BATCH_SATURATION_RETRIES", "3"))
+
+
+def _batch_item_inputs(item: BatchItem) -> dict:
+    """
+    Build pipeline inputs for one batch item (validates binary headers and applies the same
+    NDVI_MAX_SOURCE_PIXELS guard as /v1/ndvi/compute; raises ValueError / BandTooLarge).
+    Image buffers are checked from their header when decoded.
+    """
+    nodata = {"nodata": item.nodata} if item.nodata is not None else {}
+    if item.nir is not None and item.red is not None:
+        for name, band in (("nir", item.nir), ("red", item.red)):
+            check_source_pixels(len(band[0]) if band else 0, len(band), f"{name} band")
+        return {"nir": item.nir, "red": item.red, **nodata}
+    if item.nir_b64 and item.red_b64:
+        inputs = {"nir_bytes": base64.b64decode(item.nir_b64), "red_bytes": base64.b64decode(item.red_b64), **nodata}
+        if item.array_dtype or item.array_shape:
+            inputs.update({"array_dtype": item.array_dtype, "array_shape": item.array_shape})
+        for key in ("nir_bytes", "red_bytes"):
+            if item.array_dtype or is_npy(inputs[key]):
+                _, shape, _, _ = describe_binary_array(inputs[key], item.array_dtype, item.array_shape)
+                check_source_pixels(shape[-1], shape[-2], f"{key[:-6]} band")
+        return inputs
+    raise ValueError("item needs 'nir'+'red' arrays or 'nir_b64'+'red_b64' buffers")
+
+
+async def _run_batch_item(index: int, item: BatchItem, default_threshold: float, slots: asyncio.Semaphore,
+                          bypass_cache: bool = False) -> dict:
+    """
+    Compute one batch item; errors are reported in the item's result line instead of raised.
+    """
+    threshold = float(item.stress_threshold if item.stress_threshold is not None else (default_threshold or 0.3))
+    timer = StageTimer()
+    try:
+        async with slots:
+            # base64 decode + header checks are CPU work on large items: off the event loop, and
+            # only for as many items at a time as hold a slot
+            with timer.stage("read"):
+                inputs = await asyncio.to_thread(_batch_item_inputs, item)
+            stats, cache_status, cache_key = await cached_ndvi_stats(
+                inputs, threshold, bypass=bypass_cache, saturation_retries=NDVI_BATCH_SATURATION_RETRIES, timer=timer
+            )
+        cap_date = item.captureDate or datetime.utcnow().isoformat() + "Z"
+        ndvi_report = build_ndvi_report(stats, item.farmId, cap_date, threshold)
+        with timer.stage("tiles_link"):
+            await attach_tiles(ndvi_report, cache_key)
+        with timer.stage("series"):
+            await record_series(ndvi_report, item.farmId, cache_key)
+        observe_result("batch", timer, inputs, stats, cache_status)
+        return {"index": index, "farmId": item.farmId, "success": True, "cache": cache_status, "ndviReport": ndvi_report}
+    except Exception as e:
+        logger.warning(f"Batch item {index} (farm {item.farmId}) failed: {e}")
+        return {"index": index, "farmId": item.farmId, "success": False, "error": str(e)}
+
+
+async def _fetch_farm_metadata_many(farm_ids) -> dict:
+    """
+    Look up metadata for every distinct farm in a batch concurrently (through the shared cache).
+    """
+    farm_ids = list(farm_ids)
+    results = await asyncio.gather(*(backend_client.fetch_farm_metadata(fid) for fid in farm_ids), return_exceptions=True)
+    return {fid: (meta if isinstance(meta, dict) else None) for fid, meta in zip(farm_ids, results)}
+
+
+@app.post("/v1/ndvi/compute/batch")
+async def compute_ndvi_batch(
+    batch: BatchRequest,
+    x_ndvi_cache: Optional[str] = Header(None),
+    cache_control: Optional[str] = Header(None),
+):
+    """
+    Compute NDVI for many (farmId, captureDate, nir, red) items in one request.
+    Items run concurrently on the compute pool and each ndviReport is streamed back as one
+    NDJSON line ({"index", "farmId", "success", "ndviReport" | "error"}) as soon as it finishes,
+    followed by a final {"done": true, ...} summary line. A failing item never fails the batch.
+    Farm metadata is fetched once per distinct farmId and n8n alerts are queued together
+    when the batch completes.
+    """
+    if not batch.items:
+        raise HTTPException(status_code=400, detail="Batch must include at least one item")
+    if len(batch.items) > NDVI_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {NDVI_BATCH_MAX_ITEMS} items)")
+    bypass_cache = cache_bypass_requested(x_ndvi_cache, cache_control)
+
+    async def stream():
+        farm_ids = {item.farmId for item in batch.items if item.farmId}
+        meta_task = asyncio.create_task(_fetch_farm_metadata_many(farm_ids))
+        slots = asyncio.Semaphore(compute_pool.workers)
+        tasks = [
+            asyncio.create_task(_run_batch_item(i, item, batch.stress_threshold, slots, bypass_cache))
+            for i, item in enumerate(batch.items)
+        ]
+        reports = []
+        try:
+            for fut in asyncio.as_completed(tasks):
+                line = await fut
+                if line["success"]:
+                    reports.append((line["farmId"], line["ndviReport"]))
+                yield json.dumps(line) + "\n"
+
+            queued = 0
+            if batch.sendAlerts and reports:
+                farm_meta = await meta_task
+                alerts = [build_n8n_payload(report, fid, farm_meta.get(fid)) for fid, report in reports
+                          if report_has_pixels(report)]
+                try:
+                    queued = (await alert_outbox.enqueue_many(alerts)).get("queued", 0)
+                except Exception as e:
+                    logger.warning(f"Could not queue n8n alerts for batch: {e}")
+            yield json.dumps({
+                "done": True,
+                "total": len(tasks),
+                "succeeded": len(reports),
+                "failed": len(tasks) - len(reports),
+                "alertsQueued": queued,
+            }) + "\n"
+        finally:
+            # client went away: stop remaining work
+            for t in tasks:
+                t.cancel()
+            meta_task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+# ---------- background jobs ----------
+def _job_params(job: NDVIJobRequest) -> dict:
+    """Validate a job body like the matching synchronous endpoint would; returns the stored params."""
+    if job.kind == "zonal":
+        return ZonalComputeRequest(**job.params).model_dump()
+    polygons = job.polygons or ([job.params["polygon_geojson"]] if job.params.get("polygon_geojson") else [])
+    if not polygons:
+        raise ValueError("Provide params.polygon_geojson or polygons")
+    if job.kind == "indices":
+        params = IndicesComputeRequest(**dict(job.params, polygon_geojson=polygons[0])).model_dump()
+        params["indices"] = normalize_indices(params["indices"])
+        if not params["band_paths"] and not params["image_path"]:
+            raise ValueError("Provide band_paths and/or image_path")
+    elif job.kind == "compute":
+        params = NDVIComputeRequest(**dict(job.params, polygon_geojson=polygons[0])).model_dump()
+        if params["save_preview"] and params["preview_palette"]:
+            get_palette(params["preview_palette"])
+    else:
+        raise ValueError(f"Unknown job kind {job.kind!r}")
+    params.pop("polygon_geojson")
+    params["polygons"] = polygons
+    return params
+
+
+@app.post("/v1/ndvi/jobs", status_code=202)
+async def submit_ndvi_job(job: NDVIJobRequest):
+    """
+    Queue a long-running compute / indices / zonal run and return its job id at once.
+    Follow it with GET /v1/ndvi/jobs/{jobId} (polling) or /events (Server-Sent Events);
+    the result is at /v1/ndvi/jobs/{jobId}/result once it has finished.
+    """
+    try:
+        params = _job_params(job)
+        state = await job_manager.submit(job.kind, params, job.priority)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(status_code=202, content=state,
+                        headers={"Location": f"/v1/ndvi/jobs/{state['jobId']}"})
+
+
+@app.get("/v1/ndvi/jobs")
+async def list_ndvi_jobs(status: Optional[str] = None, limit: int = 50):
+    """
+    Recent jobs, newest first (optionally one status: queued / running / succeeded / failed / cancelled).
+    """
+    return {"jobs": await job_manager.list(status, max(1, min(limit, 500)))}
+
+
+async def _job_state(job_id: str) -> dict:
+    state = await job_manager.state(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return state
+
+
+@app.get("/v1/ndvi/jobs/{job_id}")
+async def get_ndvi_job(job_id: str):
+    """
+    Job status and progress ({done, failed, total, fraction} units).
+    """
+    return await _job_state(job_id)
+
+
+@app.get("/v1/ndvi/jobs/{job_id}/result")
+async def get_ndvi_job_result(job_id: str):
+    """
+    Results of a finished job: per-polygon results (compute / indices) or all zones (zonal).
+    409 while the job is still queued or running.
+    """
+    state = await _job_state(job_id)
+    if state["status"] not in FINAL_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job is {state['status']}")
+    return {**state, **await job_manager.result(job_id, state["kind"])}
+
+
+@app.delete("/v1/ndvi/jobs/{job_id}")
+async def cancel_ndvi_job(job_id: str):
+    """
+    Cancel a queued or running job. Units already on the compute pool finish, but their results are dropped.
+    """
+    state = await job_manager.cancel(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return state
+
+
+@app.get("/v1/ndvi/jobs/{job_id}/events")
+async def ndvi_job_events(job_id: str):
+    """
+    Server-Sent Events stream of a job: a `progress` event per finished unit, then a final
+    `done` event carrying the terminal state. Comment lines keep idle connections alive.
+    """
+    await _job_state(job_id)
+
+    async def stream():
+        async for state in job_manager.watch(job_id):
+            if state is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = "done" if state["status"] in FINAL_STATUSES else "progress"
+            yield f"event: {event}\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ---------- tiles & previews ----------
+async def _resolve_scene(report_id: str) -> str:
+    key = await asyncio.to_thread(tile_store.resolve, report_id) if tile_store.enabled else None
+    if not key:
+        raise HTTPException(status_code=404, detail="No NDVI raster stored for this report")
+    return key
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    return bool(if_none_match) and etag in [t.strip() for t in if_none_match.split(",")]
+
+
+@app.get("/v1/ndvi/tiles/{report_id}")
+async def ndvi_tiles_info(report_id: str):
+    """
+    TileJSON-style description of a report's NDVI pyramid (pixel-space XYZ, 256px tiles).
+    """
+    key = await _resolve_scene(report_id)
+    meta = await asyncio.to_thread(tile_store.meta, key)
+    return {
+        "tilejson": "2.2.0",
+        "tiles": [tiles_url_for(report_id)],
+        "minzoom": 0,
+        "maxzoom": meta["maxzoom"],
+        "tileSize": meta["tile_size"],
+        "width": meta["width"],
+        "height": meta["height"],
+    }
+
+
+@app.get("/v1/ndvi/tiles/{report_id}/{z}/{x}/{y}.{fmt}")
+async def ndvi_tile(report_id: str, z: int, x: int, y: int, fmt: str, palette: Optional[str] = None,
+                    if_none_match: Optional[str] = Header(None)):
+    """
+    One NDVI tile (png / webp). Tiles are rendered on first request from the level below
+    and are immutable for a report, so they carry a strong ETag and long-lived Cache-Control.
+    """
+    if fmt not in TILE_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unsupported tile format {fmt!r}")
+    if palette and palette not in PALETTES:
+        raise HTTPException(status_code=400, detail=f"Unknown palette {palette!r}; available: {sorted(PALETTES)}")
+    key = await _resolve_scene(report_id)
+
+    etag = f'"{key[:20]}-{z}-{x}-{y}-{palette or ""}-{fmt}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = await compute_pool.run(render_tile, key, z, x, y, fmt, palette)
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    if data is None:
+        raise HTTPException(status_code=404, detail="Tile outside the raster")
+    return Response(content=data, media_type=TILE_FORMATS[fmt][1], headers=headers)
+
+
+@app.get("/v1/ndvi/preview/{report_id}.{fmt}")
+async def ndvi_preview(report_id: str, fmt: str, size: Optional[int] = None, palette: Optional[str] = None,
+                       if_none_match: Optional[str] = Header(None)):
+    """
+    Whole-scene preview as raw image bytes (png / webp) instead of base64 in JSON.
+    size is the longest side in pixels (aspect kept); palette one of default / rdylgn / viridis / gray.
+    """
+    if fmt not in TILE_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unsupported preview format {fmt!r}")
+    if palette and palette not in PALETTES:
+        raise HTTPException(status_code=400, detail=f"Unknown palette {palette!r}; available: {sorted(PALETTES)}")
+    if size is not None and not (0 < size <= NDVI_PREVIEW_MAX_SIZE):
+        raise HTTPException(status_code=400, detail=f"size must be between 1 and {NDVI_PREVIEW_MAX_SIZE}")
+    key = await _resolve_scene(report_id)
+
+    etag = f'"{key[:20]}-preview-{size or ""}-{palette or ""}-{fmt}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = await compute_pool.run(render_scene_preview, key, size, palette, fmt)
+    except PoolSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return Response(content=data, media_type=TILE_FORMATS[fmt][1], headers=headers)
+
+
+# ---------- time series ----------
+@app.get("/v1/farms/{farm_id}/ndvi/series")
+async def ndvi_series_query(farm_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                            window: Optional[int] = None):
+    """
+    Stored captures of a farm between start and end (ISO dates), oldest first.
+    window=N adds trailing N-capture rolling means of mean_ndvi and pct_stress.
+    """
+    if window is not None and window < 1:
+        raise HTTPException(status_code=400, detail="window must be >= 1")
+    try:
+        rows = await asyncio.to_thread(ndvi_series.query, farm_id, start, end, window)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"farmId": farm_id, "count": len(rows), "captures": rows}
+
+
+@app.get("/v1/farms/{farm_id}/ndvi/change")
+async def ndvi_series_change(farm_id: str, captureDate: Optional[str] = None):
+    """
+    Change between a stored capture (default: latest) and the previous one: stats deltas and,
+    when both rasters are stored, pixel-level decline / gain fractions. No source imagery is reprocessed.
+    """
+    try:
+        return await asyncio.to_thread(ndvi_series.change, farm_id, captureDate)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+
+@app.get("/v1/farms/{farm_id}/ndvi/change.{fmt}")
+async def ndvi_series_change_map(farm_id: str, fmt: str, captureDate: Optional[str] = None, size: Optional[int] = None):
+    """
+    Delta-NDVI map (png / webp) between a stored capture and the previous one.
+    """
+    if fmt not in TILE_FORMATS:
+        raise HTTPException(status_code=404, detail=f"Unsupported image format {fmt!r}")
+    if size is not None and not (0 < size <= NDVI_PREVIEW_MAX_SIZE):
+        raise HTTPException(status_code=400, detail=f"size must be between 1 and {NDVI_PREVIEW_MAX_SIZE}")
+    try:
+        data = await asyncio.to_thread(ndvi_series.change_map, farm_id, captureDate, size, fmt)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return Response(content=data, media_type=TILE_FORMATS[fmt][1], headers={"Cache-Control": "no-cache"})
+
+
+# ---------- metrics & profiling ----------
+registry.add_stats_collector("pool", "NDVI compute pool", compute_pool.stats)
+registry.add_stats_collector("result_cache", "NDVI result cache", result_cache.stats)
+registry.add_stats_collector("farm_cache", "Farm metadata cache", lambda: backend_client.cache.stats())
+registry.add_stats_collector("alert_outbox", "n8n alert outbox", lambda: alert_outbox.stats())
+registry.add_stats_collector("boot", "Boot stage durations of this worker", boot_stats)
+registry.add_stats_collector("block_cache", "Remote raster block cache", block_cache.stats)
+registry.add_stats_collector("align_cache", "Band co-registration plan cache", plan_cache.stats)
+registry.add_stats_collector("jobs", "Background NDVI jobs", job_manager.stats)
+registry.add_stats_collector("refine", "Quick-look refinements", lambda: {**refine_counts, "running": len(_refine_tasks)})
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus text exposition: request / stage latency histograms, input sizes and the
+    pool / cache / outbox gauges (this process only).
+    """
+    if not NDVI_METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    body = await asyncio.to_thread(registry.render)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/v1/ndvi/profiles")
+async def list_profiles():
+    """
+    Ids of the stored per-request profiles, newest first.
+    """
+    return {"profiles": await asyncio.to_thread(profile_store.list)}
+
+
+@app.get("/v1/ndvi/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json"):
+    """
+    One stored profile: sampled stacks, tracemalloc top allocations and stage timings as JSON,
+    or ?format=collapsed for flamegraph.pl / speedscope input.
+    """
+    report = await asyncio.to_thread(profile_store.load, profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Unknown profile")
+    if format == "collapsed":
+        return Response(content=collapsed(report), media_type="text/plain; charset=utf-8")
+    return report
+
+
+@app.get("/v1/ndvi/pool")
+async def compute_pool_stats():
+    """
+    Compute pool queue-depth / throughput counters (for dashboards and autoscaling).
+    """
+    return compute_pool.stats()
+
+
+@app.get("/v1/ndvi/cache")
+async def result_cache_stats():
+    """
+    NDVI result cache counters (memory / disk hits, misses, evictions, hit ratio).
+    """
+    return result_cache.stats()
+
+
+@app.delete("/v1/ndvi/cache")
+async def clear_result_cache():
+    """
+    Drop every cached NDVI result (memory and disk tiers).
+    """
+    removed = await asyncio.to_thread(result_cache.clear)
+    return {"success": True, "removed": removed}
+
+
+@app.get("/v1/farms/cache")
+async def farm_cache_stats():
+    """
+    Farm metadata cache counters (hits / misses / coalesced lookups / evictions).
+    """
+    return await asyncio.to_thread(backend_client.cache.stats)
+
+
+@app.delete("/v1/farms/cache")
+async def invalidate_farm_cache(farmId: Optional[str] = None):
+    """
+    Invalidate cached farm metadata: one farm with ?farmId=..., or the whole cache (this worker's
+    memory tier and the shared tier; other workers drop their copies within FARM_CACHE_LOCAL_TTL_SECONDS).
+    Call this from the backend after a farm (or its owner) is updated.
+    """
+    removed = await backend_client.cache.invalidate_all_workers(farmId)
+    return {"success": True, "removed": removed}
+
+
+@app.get("/v1/alerts/outbox")
+async def alert_outbox_stats():
+    """
+    n8n outbox counters (pending / sent / dead alerts, webhook calls, de-duplicated submissions).
+    """
+    return await asyncio.to_thread(alert_outbox.stats)
+
+
+@app.get("/v1/ndvi/startup")
+async def startup_report():
+    """
+    Boot timing of the worker answering: app import, heavy module preload, warm-up, compute pool
+    warm-up and lifespan start (ms), plus the preloaded modules.
+    """
+    return {**boot_report(), "pool": {"mode": compute_pool.mode, "workers": compute_pool.workers}}
+
+
+boot_timer.add("import_app", time.perf_counter() - _import_started)
@@ -1,23 +1,112 @@
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
 class NDVIComputeRequest(BaseModel):
     """
     red_path and nir_path can be:
       - local filesystem path (for testing)
-      - s3://bucket/key (if S3 adapter implemented)
-      - presigned url (http)
+      - s3://bucket/key (range reads, endpoint via NDVI_S3_ENDPOINT_URL)
+      - http(s) / presigned url (range reads; Cloud Optimized GeoTIFFs fetch only the overlapping tiles)
     polygon_geojson: GeoJSON dict (Polygon / MultiPolygon) in same CRS as raster or WGS84
     """
     red_path: str
     nir_path: str
     polygon_geojson: Dict[str, Any]
     save_preview: Optional[bool] = True  # return a small PNG preview (base64) for quick tests
+    windowed: Optional[bool] = None  # stream block windows (bounded memory); None = auto for large polygons
+    preview_size: Optional[int] = None  # preview side in pixels (default NDVI_PREVIEW_SIZE)
+    preview_palette: Optional[str] = None  # default / rdylgn / viridis / gray
+    approx: Optional[bool] = None  # quick look: stats estimated from a decimated read, with confidence intervals
+    mask_path: Optional[str] = None  # cloud / quality mask raster: nonzero (or mask_values) pixels are skipped
+    mask_values: Optional[List[int]] = None  # mask classes to skip, e.g. Sentinel-2 SCL [3, 8, 9, 10]
 
 class NDVIComputeResponse(BaseModel):
-    mean_ndvi: float
-    median_ndvi: float
+    mean_ndvi: Optional[float] = None  # None when no pixel of the polygon is valid
+    median_ndvi: Optional[float] = None
     pct_stress: float
     stress_threshold: float
+    histogram: Optional[Dict[str, Any]] = None
+    pixel_count: Optional[int] = None
     preview_png_base64: Optional[str] = None
     message: Optional[str] = None
+    io: Optional[Dict[str, Any]] = None  # remote (s3:// / http) sources: bytes fetched vs. file size
+    approximate: Optional[Dict[str, Any]] = None  # quick look: sample size and confidence intervals
+    valid_pixel_count: Optional[int] = None  # pixels computed (not nodata / masked)
+    area_pixel_count: Optional[int] = None  # pixels of the requested area
+    coverage_fraction: Optional[float] = None  # valid_pixel_count / area_pixel_count
+
+class IndicesComputeRequest(BaseModel):
+    """
+    Several spectral indices (ndvi, gndvi, ndwi, savi, evi) over one polygon, reading each band once.
+    Bands come from band_paths ({"nir": ..., "red": ..., "green": ..., "blue": ...}, band 1 of each file)
+    and/or one multi-band image_path with band_map (1-based, default blue=1 green=2 red=3 nir=4).
+    """
+    polygon_geojson: Dict[str, Any]
+    indices: List[str] = ["ndvi"]
+    band_paths: Optional[Dict[str, str]] = None
+    image_path: Optional[str] = None
+    band_map: Optional[Dict[str, int]] = None
+    stress_threshold: float = 0.3
+    stress_thresholds: Optional[Dict[str, float]] = None  # per-index override of stress_threshold
+    reflectance_scale: Optional[float] = None  # e.g. 0.0001 for integer Sentinel-2 L2A bands (matters for savi/evi)
+    mask_path: Optional[str] = None  # cloud / quality mask raster: nonzero (or mask_values) pixels are skipped
+    mask_values: Optional[List[int]] = None  # mask classes to skip, e.g. Sentinel-2 SCL [3, 8, 9, 10]
+
+class IndexStats(BaseModel):
+    mean: Optional[float] = None  # None when no pixel of the polygon is valid
+    median: Optional[float] = None
+    pct_stress: float
+    stress_threshold: float
+    histogram: Optional[Dict[str, Any]] = None
+    pixel_count: Optional[int] = None
+
+class IndicesComputeResponse(BaseModel):
+    indices: Dict[str, IndexStats]
+    valid_pixel_count: Optional[int] = None  # pixels computed (not nodata / masked)
+    area_pixel_count: Optional[int] = None  # pixels of the requested area
+    coverage_fraction: Optional[float] = None  # valid_pixel_count / area_pixel_count
+    message: Optional[str] = None
+    io: Optional[Dict[str, Any]] = None
+
+class ZonalComputeRequest(BaseModel):
+    """
+    NDVI statistics for every feature of a GeoJSON FeatureCollection (e.g. all farms inside one
+    satellite tile) in one pass over the scene. Zone ids come from properties[id_property],
+    falling back to the feature id or its position.
+    """
+    red_path: str
+    nir_path: str
+    features: Dict[str, Any]
+    id_property: str = "farmId"
+    stress_threshold: float = 0.3
+    mask_path: Optional[str] = None  # cloud / quality mask raster: nonzero (or mask_values) pixels are skipped
+    mask_values: Optional[List[int]] = None  # mask classes to skip, e.g. Sentinel-2 SCL [3, 8, 9, 10]
+
+class ZoneStats(BaseModel):
+    zone_id: Any
+    mean_ndvi: Optional[float] = None
+    median_ndvi: Optional[float] = None
+    pct_stress: float
+    stress_threshold: float
+    histogram: Optional[Dict[str, Any]] = None
+    pixel_count: int
+    valid_pixel_count: Optional[int] = None  # pixels computed (not nodata / masked)
+    area_pixel_count: Optional[int] = None  # pixels of the requested area
+    coverage_fraction: Optional[float] = None  # valid_pixel_count / area_pixel_count
+
+class ZonalComputeResponse(BaseModel):
+    zones: List[ZoneStats]
+    message: Optional[str] = None
+    io: Optional[Dict[str, Any]] = None
+
+class NDVIJobRequest(BaseModel):
+    """
+    Background job (POST /v1/ndvi/jobs): the body of /v1/ndvi/raster/compute, /indices or /zonal in `params`,
+    run unit by unit off the request. compute / indices jobs run one unit per polygon: `polygons`
+    (a list of GeoJSON geometries) replaces params.polygon_geojson. zonal jobs split params.features
+    into chunks. priority: interactive | bulk (default: interactive for a single unit, else bulk).
+    """
+    kind: str = "compute"  # compute / indices / zonal
+    params: Dict[str, Any]
+    polygons: Optional[List[Dict[str, Any]]] = None
+    priority: Optional[str] = None
@@ -0,0 +1,108 @@
+"""
+Stored benchmark baselines and regression checks.
+
+Results are flattened to {"metric.path": value}. Metrics ending in "_rps" are higher-is-better,
+everything else (times, latencies, memory) is lower-is-better. A metric regresses when it is worse
+than its baseline by more than the tolerance (relative; times must also be MIN_DELTA_MS worse);
+metrics missing on either side are ignored.
+
+Baselines live in benchmarks/baselines/<name>.json. They are machine-specific: record one per
+machine / CI runner class with --update-baseline and compare against it with --baseline.
+"""
+
+import json
+import os
+import platform
+import time
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+DEFAULT_TOLERANCE = 0.25
+# timing jitter on tiny stages is larger than any relative tolerance; _ms metrics must also move this much
+MIN_DELTA_MS = 2.0
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = float(value)
+    return flat
+
+
+def _path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def load_baseline(name: str) -> dict:
+    with open(_path(name), "r", encoding="utf-8") as f:
+        return json.load(f)["metrics"]
+
+
+def save_baseline(name: str, metrics: dict, merge: bool = True):
+    """Write metrics to baselines/<name>.json (merged into the existing baseline by default)."""
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    existing = {}
+    if merge and os.path.exists(_path(name)):
+        existing = load_baseline(name)
+    existing.update(metrics)
+    doc = {
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "metrics": dict(sorted(existing.items())),
+    }
+    with open(_path(name), "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+        f.write("\n")
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """[(metric, baseline, current, relative change)] for every regression beyond tolerance."""
+    regressions = []
+    for name, current in sorted(metrics.items()):
+        base = baseline.get(name)
+        if base is None or base == 0:
+            continue
+        change = (current - base) / abs(base)
+        worse = -change if name.endswith("_rps") else change
+        if name.endswith("_ms") and current - base < MIN_DELTA_MS:
+            continue
+        if worse > tolerance:
+            regressions.append((name, base, current, change))
+    return regressions
+
+
+def report(metrics: dict, baseline_name: str = None, update_name: str = None,
+           tolerance: float = DEFAULT_TOLERANCE) -> int:
+    """Shared CLI tail of the bench scripts: compare and/or update; returns the process exit code."""
+    code = 0
+    if baseline_name:
+        try:
+            baseline = load_baseline(baseline_name)
+        except FileNotFoundError:
+            print(f"no baseline {baseline_name!r} yet (record one with --update-baseline {baseline_name})")
+            baseline = None
+        if baseline is not None:
+            regressions = compare(metrics, baseline, tolerance)
+            checked = sum(1 for m in metrics if m in baseline)
+            if regressions:
+                print(f"\nREGRESSIONS vs baseline {baseline_name!r} (tolerance {tolerance:.0%}):")
+                for name, base, current, change in regressions:
+                    print(f"  {name}: {base:.3f} -> {current:.3f} ({change:+.1%})")
+                code = 1
+            else:
+                print(f"\nno regressions vs baseline {baseline_name!r} ({checked} metrics, tolerance {tolerance:.0%})")
+    if update_name:
+        save_baseline(update_name, metrics)
+        print(f"baseline {update_name!r} updated ({len(metrics)} metrics)")
+    return code
+
+
+def add_arguments(parser):
+    parser.add_argument("--baseline", help="compare against benchmarks/baselines/<name>.json; exit 1 on regression")
+    parser.add_argument("--update-baseline", metavar="NAME", help="store these results as baseline <name>")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="allowed relative slowdown")
+    parser.add_argument("--json", metavar="PATH", help="also write the raw results as JSON")
@@ -0,0 +1,166 @@
+"""
+Parse-time / peak-RSS comparison of the /v1/ndvi/compute band ingest paths.
+
+Each mode decodes one synthetic nir+red pair the way the service does (load_band_arrays) and
+runs in a fresh process that only loads its own request body from disk; "peak growth" is
+the peak RSS reached while decoding, above the RSS held once the body is in memory.
+
+Image modes upload 3-channel PNG / JPEG and 16-bit TIFF bands; "png_rgb_legacy" is the
+previous float HxWx3 luminance decode, kept for comparison. "npy_spooled" decodes .npy bands
+spooled to disk (memory-mapped, as large uploads are).
+
+Usage (from MLService/; `python benchmarks/bench_ingest.py ...` works as well):
+    python -m benchmarks.bench_ingest --size 2000
+    python -m benchmarks.bench_ingest --size 10000 --modes png_rgb_legacy,png_rgb,jpeg_rgb
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import pickle
+import resource
+import sys
+import tempfile
+import time
+
+if __package__ in (None, ""):
+    # run as a script rather than with -m: make app / benchmarks importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+
+def _payloads(size: int):
+    rng = np.random.default_rng(0)
+    nir = rng.random((size, size), dtype=np.float32)
+    red = rng.random((size, size), dtype=np.float32) * 0.5
+    npy_nir, npy_red = io.BytesIO(), io.BytesIO()
+    np.save(npy_nir, nir)
+    np.save(npy_red, red)
+    rgb = lambda band: (np.stack([band, band * 0.9, band * 0.8], axis=-1) * 255).astype(np.uint8)
+    return {
+        "json": json.dumps({"nir": nir.tolist(), "red": red.tolist()}).encode("utf-8"),
+        "png_rgb": (_encode_image(rgb(nir), "PNG"), _encode_image(rgb(red), "PNG")),
+        "png_rgb_legacy": (_encode_image(rgb(nir), "PNG"), _encode_image(rgb(red), "PNG")),
+        "jpeg_rgb": (_encode_image(rgb(nir), "JPEG", quality=90), _encode_image(rgb(red), "JPEG", quality=90)),
+        "tiff16": (_encode_image((nir * 65535).astype(np.uint16), "TIFF"), _encode_image((red * 65535).astype(np.uint16), "TIFF")),
+        "npy_spooled": (npy_nir.getvalue(), npy_red.getvalue()),
+        "npy": (npy_nir.getvalue(), npy_red.getvalue()),
+        "raw_float32": (nir.tobytes(), red.tobytes()),
+        "raw_uint16": ((nir * 65535).astype("<u2").tobytes(), (red * 65535).astype("<u2").tobytes()),
+        "stacked": np.stack([nir, red]).tobytes(),
+    }
+
+
+def _encode_image(arr, fmt, **kwargs) -> bytes:
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+def _legacy_gray(file_bytes: bytes):
+    from PIL import Image
+
+    arr = np.asarray(Image.open(io.BytesIO(file_bytes)).convert("RGB")).astype("float32") / 255.0
+    return 0.2989 * arr[..., 0] + 0.5870 * arr[..., 1] + 0.1140 * arr[..., 2]
+
+
+def _spool(body: bytes, workdir: str, name: str):
+    from app.core.upload_spool import SpooledUpload, content_digest
+
+    path = os.path.join(workdir, name)
+    with open(path, "wb") as f:
+        f.write(body)
+    return SpooledUpload(path, len(body), content_digest(body))
+
+
+def _status_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM, so the peak below excludes import-time usage
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _run_mode(mode: str, size: int, body_path: str, out):
+    from app.main import load_band_arrays
+
+    with open(body_path, "rb") as f:
+        body = pickle.load(f)
+    if mode == "npy_spooled":
+        # the request body is on disk, not in memory
+        body = (_spool(body[0], os.path.dirname(body_path), "nir.spool"), _spool(body[1], os.path.dirname(body_path), "red.spool"))
+    _reset_peak_rss()
+    rss_before = _status_kb("VmRSS")
+    start = time.perf_counter()
+    if mode == "json":
+        # body parsing is part of the JSON path's cost
+        doc = json.loads(body)
+        inputs = {"nir": doc["nir"], "red": doc["red"]}
+    elif mode in ("npy", "npy_spooled", "png_rgb", "jpeg_rgb", "tiff16"):
+        inputs = {"nir_bytes": body[0], "red_bytes": body[1]}
+    elif mode == "stacked":
+        inputs = {"bands_bytes": body, "array_dtype": "float32", "array_shape": f"2,{size},{size}"}
+    else:
+        dtype = mode.split("_", 1)[1]
+        inputs = {"nir_bytes": body[0], "red_bytes": body[1], "array_dtype": dtype, "array_shape": f"{size},{size}"}
+    if mode == "png_rgb_legacy":
+        nir, red = _legacy_gray(body[0]), _legacy_gray(body[1])
+    else:
+        nir, red = load_band_arrays(inputs)
+    elapsed = time.perf_counter() - start
+    rss_after = _status_kb("VmHWM") or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out.put({
+        "mode": mode,
+        "bytes": len(body) if isinstance(body, bytes) else sum(len(b) for b in body),
+        "parse_ms": elapsed * 1000.0,
+        "peak_rss_mb": rss_after / 1024.0,
+        "peak_growth_mb": max(0, rss_after - rss_before) / 1024.0,
+        "shape": list(nir.shape),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=2000, help="band height/width in pixels")
+    parser.add_argument("--modes", default="json,npy,npy_spooled,raw_float32,raw_uint16,stacked,png_rgb_legacy,png_rgb,jpeg_rgb,tiff16")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    modes = args.modes.split(",")
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    payloads = _payloads(args.size)
+    for mode in modes:
+        with open(os.path.join(workdir, mode), "wb") as f:
+            pickle.dump(payloads[mode], f, protocol=pickle.HIGHEST_PROTOCOL)
+    del payloads
+
+    print(f"{'mode':<12} {'body MB':>8} {'parse ms':>10} {'peak RSS MB':>12} {'peak growth MB':>15}")
+    for mode in modes:
+        q = ctx.Queue()
+        p = ctx.Process(target=_run_mode, args=(mode, args.size, os.path.join(workdir, mode), q))
+        p.start()
+        r = q.get()
+        p.join()
+        for name in (mode, "nir.spool", "red.spool"):
+            if os.path.exists(os.path.join(workdir, name)):
+                os.remove(os.path.join(workdir, name))
+        print(f"{r['mode']:<12} {r['bytes'] / 1e6:>8.1f} {r['parse_ms']:>10.1f} {r['peak_rss_mb']:>12.1f} {r['peak_growth_mb']:>15.1f}")
+    os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+In-process concurrent load driver for POST /v1/ndvi/compute.
+
+The real app (lifespan, compute pool, result cache, tiles, outbox) is driven through an httpx
+ASGI transport, so no server or network is involved. Every request carries a .npy nir/red pair
+and `X-NDVI-Cache: bypass` so each one runs the full decode + NDVI path; --cache lets the
+result cache answer instead. Per concurrency level it reports p50/p95/p99 latency,
+throughput and errors (503s from a saturated pool are counted, not retried), plus the peak RSS
+of the service process and of its pool workers.
+
+Data directories are redirected to a temporary directory before the app is imported.
+
+Usage (from MLService/; `python benchmarks/bench_load.py ...` works as well):
+    python -m benchmarks.bench_load --size 1024 --concurrency 1,4,16 --requests 64
+    python -m benchmarks.bench_load --baseline default
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+if __package__ in (None, ""):
+    # run as a script rather than with -m: make app / benchmarks importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from benchmarks import baseline
+from benchmarks.synthetic import encode_npy, synthetic_bands
+
+
+def _isolate_data_dirs(root: str):
+    for var, sub in (("NDVI_RESULT_CACHE_DIR", "cache"), ("NDVI_TILES_DIR", "tiles"),
+                     ("NDVI_SERIES_DIR", "series"), ("NDVI_BLOCK_CACHE_DIR", "blocks")):
+        os.environ.setdefault(var, os.path.join(root, sub))
+    os.environ.setdefault("N8N_OUTBOX_PATH", os.path.join(root, "outbox.sqlite3"))
+
+
+def _percentile(samples, q):
+    return float(np.percentile(samples, q)) * 1000 if samples else 0.0
+
+
+async def _run_level(client, files, concurrency, n_requests, headers):
+    latencies, errors = [], {}
+    queue = asyncio.Queue()
+    for _ in range(n_requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            resp = await client.post("/v1/ndvi/compute", files=files, data={"stress_threshold": "0.3"}, headers=headers)
+            if resp.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[str(resp.status_code)] = errors.get(str(resp.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "ok": len(latencies),
+        "errors": errors,
+    }
+
+
+async def run(size, levels, n_requests, use_cache):
+    import httpx
+    from app.main import app
+
+    nir, red = synthetic_bands(size)
+    files = {
+        "nir_file": ("nir.npy", encode_npy(nir), "application/octet-stream"),
+        "red_file": ("red.npy", encode_npy(red), "application/octet-stream"),
+    }
+    headers = {} if use_cache else {"X-NDVI-Cache": "bypass"}
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # warm-up: spawns pool workers and imports their modules outside the measured window
+            await _run_level(client, files, min(levels), max(1, min(levels)), headers)
+            for concurrency in levels:
+                results[f"c{concurrency}"] = await _run_level(client, files, concurrency, n_requests, headers)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=1024, help="band side in pixels")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=48, help="requests per concurrency level")
+    parser.add_argument("--cache", action="store_true", help="let the result cache answer repeats")
+    parser.add_argument("--workers", type=int, help="NDVI_POOL_WORKERS for the run (default: service default)")
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    if args.workers:
+        os.environ["NDVI_POOL_WORKERS"] = str(args.workers)
+    with tempfile.TemporaryDirectory(prefix="ndvi-bench-") as root:
+        _isolate_data_dirs(root)
+        results = asyncio.run(run(args.size, levels, args.requests, args.cache))
+
+    # ru_maxrss is KiB on Linux; children are the pool workers, reaped at lifespan shutdown
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results["peak_worker_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    print(f"size {args.size}^2, {args.requests} requests per level, cache {'on' if args.cache else 'bypassed'}")
+    print(f"{'conc':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'ok':>5}  errors")
+    for concurrency in levels:
+        r = results[f"c{concurrency}"]
+        print(f"{concurrency:>5} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} "
+              f"{r['throughput_rps']:>8.2f} {r['ok']:>5}  {r['errors'] or '-'}")
+    print(f"peak RSS: service {results['peak_rss_mb']:.0f} MB, largest pool worker {results['peak_worker_rss_mb']:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"load": results}, f, indent=2)
+    metrics = baseline.flatten({"load": {str(args.size): results}})
+    metrics = {k: v for k, v in metrics.items() if k.endswith(("_ms", "_rps", "_mb"))}
+    raise SystemExit(baseline.report(metrics, args.baseline, args.update_baseline, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
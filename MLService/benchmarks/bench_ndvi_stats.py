@@ -0,0 +1,75 @@
+"""
+Legacy NDVI statistics vs. the fused kernel in app/core/ndvi_stats.py.
+
+"legacy" is what run_ndvi_pipeline did before: arrays_to_ndvi + nanmean + nanmedian +
+percent_below_threshold + np.histogram(ndvi.flatten()). Peak allocation is measured with
+tracemalloc (numpy reports its buffers to it), time is the best of --repeat runs.
+
+Usage (from MLService/; `python benchmarks/bench_ndvi_stats.py ...` works as well):
+    python -m benchmarks.bench_ndvi_stats --sizes 512,2048,4096
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+if __package__ in (None, ""):
+    # run as a script rather than with -m: make app / benchmarks importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from app.core.ndvi_stats import compute_ndvi_stats
+from app.main import arrays_to_ndvi, percent_below_threshold
+
+
+def legacy_stats(nir, red, threshold):
+    ndvi = arrays_to_ndvi(nir, red)
+    hist, edges = np.histogram(ndvi.flatten(), bins=10, range=(-1.0, 1.0))
+    return {
+        "mean_ndvi": float(np.nanmean(ndvi)),
+        "median_ndvi": float(np.nanmedian(ndvi)),
+        "pct_stress": percent_below_threshold(ndvi, threshold),
+        "histogram": {"bins": hist.tolist(), "edges": edges.tolist()},
+    }
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="512,2048,4096", help="comma-separated band sizes (square)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=0.3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'variant':<14} {'time ms':>9} {'peak alloc MB':>14} {'median':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        nir = rng.random((size, size), dtype=np.float32)
+        red = rng.random((size, size), dtype=np.float32) * 0.6
+        variants = [
+            ("legacy", lambda: legacy_stats(nir, red, args.threshold)),
+            ("fused-exact", lambda: compute_ndvi_stats(nir, red, args.threshold, median="exact")),
+            ("fused-approx", lambda: compute_ndvi_stats(nir, red, args.threshold, median="approx")),
+        ]
+        for name, fn in variants:
+            result, seconds, peak = measure(fn, args.repeat)
+            print(f"{size:>6} {name:<14} {seconds * 1000:>9.1f} {peak / 1e6:>14.1f} {result['median_ndvi']:>10.5f}")
+
+
+if __name__ == "__main__":
+    main()
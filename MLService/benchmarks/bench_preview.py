@@ -0,0 +1,80 @@
+"""
+Preview rendering: the legacy full-resolution to_png_base64 vs. app/core/preview.py.
+
+"legacy" colours every pixel with three float64 channels, then resizes to 256x256 and
+base64-encodes (the pre-LUT utils.to_png_base64). "lut" downsamples first and colours through the
+palette LUT; "lut-mmap" renders from an int16 base memory-mapped from disk, the way
+/v1/ndvi/preview serves stored scenes. Time is the best of --repeat runs.
+
+Usage (from MLService/; `python benchmarks/bench_preview.py ...` works as well):
+    python -m benchmarks.bench_preview --sizes 512,2048,8192
+"""
+
+import argparse
+import base64
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+if __package__ in (None, ""):
+    # run as a script rather than with -m: make app / benchmarks importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from app.core.preview import render_preview
+from app.core.tiles import NODATA, SCALE, encode_ndvi
+
+
+def legacy_png_base64(ndvi_arr, vmin=-1.0, vmax=1.0, size=(256, 256)):
+    nd = np.clip((ndvi_arr - vmin) / (vmax - vmin), 0, 1)
+    r = (1 - nd) * 220 + nd * 80
+    g = (1 - nd) * 180 + nd * 200
+    b = (1 - nd) * 150 + nd * 50
+    rgb = np.stack([r, g, b], axis=-1).astype('uint8')
+    img = Image.fromarray(rgb).resize(size, Image.BILINEAR)
+    buf = BytesIO()
+    img.save(buf, format='PNG')
+    return base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="512,2048,8192", help="comma-separated NDVI raster sizes (square)")
+    parser.add_argument("--preview", type=int, default=256, help="preview side in pixels")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>6} {'variant':<10} {'time ms':>9} {'bytes':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (int(s) for s in args.sizes.split(",")):
+            ndvi = (rng.random((size, size), dtype=np.float32) * 2 - 1)
+            base_path = os.path.join(tmp, f"base_{size}.npy")
+            np.save(base_path, encode_ndvi(ndvi))
+            base = np.load(base_path, mmap_mode="r")
+            side = (args.preview, args.preview)
+            variants = [
+                ("legacy", lambda: legacy_png_base64(ndvi, size=side)),
+                ("lut", lambda: render_preview(ndvi, exact_size=side)),
+                ("lut-mmap", lambda: render_preview(base, size=args.preview, nodata=NODATA, scale=SCALE)),
+            ]
+            for name, fn in variants:
+                out, seconds = best_of(fn, args.repeat)
+                print(f"{size:>6} {name:<10} {seconds * 1000:>9.1f} {len(out):>9}")
+
+
+if __name__ == "__main__":
+    main()
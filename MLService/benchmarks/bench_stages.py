@@ -0,0 +1,100 @@
+"""
+Per-stage micro-benchmarks of the /v1/ndvi/compute hot path on synthetic bands.
+
+Stages (each timed in isolation, median and best of --repeat runs):
+  decode_png            imagefile_to_gray_array on an 8-bit PNG upload
+  decode_npy            load_band_arrays on a float32 .npy pair
+  resize                resize_array_to_shape to 3/4 of the side (mismatched uploads)
+  arrays_to_ndvi        legacy full-array NDVI
+  compute_ndvi_stats    fused NDVI statistics kernel
+  to_png_base64         JSON preview
+  render_preview        binary preview (png)
+  pipeline_npy          run_ndvi_pipeline end to end on a .npy pair
+
+Usage (from MLService/; `python benchmarks/bench_stages.py ...` works as well):
+    python -m benchmarks.bench_stages                       # 256,1024,2048,4096
+    python -m benchmarks.bench_stages --full                # ... and 10000
+    python -m benchmarks.bench_stages --baseline default    # flag regressions (exit 1)
+    python -m benchmarks.bench_stages --update-baseline default
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+if __package__ in (None, ""):
+    # run as a script rather than with -m: make app / benchmarks importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import baseline
+from benchmarks.synthetic import encode_npy, encode_png, parse_sizes, synthetic_bands
+
+from app.core.ndvi_stats import compute_ndvi_stats
+from app.core.preview import render_preview
+from app.core.utils import to_png_base64
+from app.main import arrays_to_ndvi, imagefile_to_gray_array, load_band_arrays, resize_array_to_shape, run_ndvi_pipeline
+
+
+def time_stage(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"median_ms": statistics.median(samples) * 1000, "best_ms": min(samples) * 1000}
+
+
+def stages_for(size, threshold=0.3):
+    nir, red = synthetic_bands(size)
+    png = encode_png(nir)
+    npy_inputs = {"nir_bytes": encode_npy(nir), "red_bytes": encode_npy(red)}
+    ndvi = arrays_to_ndvi(nir, red)
+    side = (size * 3 // 4, size * 3 // 4)
+    return [
+        ("decode_png", lambda: imagefile_to_gray_array(png)),
+        ("decode_npy", lambda: load_band_arrays(npy_inputs)),
+        ("resize", lambda: resize_array_to_shape(red, side)),
+        ("arrays_to_ndvi", lambda: arrays_to_ndvi(nir, red)),
+        ("compute_ndvi_stats", lambda: compute_ndvi_stats(nir, red, threshold)),
+        ("to_png_base64", lambda: to_png_base64(ndvi)),
+        ("render_preview", lambda: render_preview(ndvi)),
+        ("pipeline_npy", lambda: run_ndvi_pipeline(npy_inputs, threshold)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", help="comma-separated band sizes (square)")
+    parser.add_argument("--full", action="store_true", help="include 10000^2")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--stages", help="comma-separated subset of stages")
+    baseline.add_arguments(parser)
+    args = parser.parse_args()
+    only = set(args.stages.split(",")) if args.stages else None
+
+    results = {}
+    print(f"{'size':>6} {'stage':<20} {'median ms':>10} {'best ms':>10}")
+    for size in parse_sizes(args.sizes, args.full):
+        # fewer repeats for the largest inputs keeps a --full run in minutes
+        repeat = max(1, args.repeat if size <= 2048 else args.repeat // 2)
+        for name, fn in stages_for(size):
+            if only and name not in only:
+                continue
+            fn()  # warm-up (imports, allocator, caches)
+            timing = time_stage(fn, repeat)
+            results.setdefault(name, {})[str(size)] = timing
+            print(f"{size:>6} {name:<20} {timing['median_ms']:>10.2f} {timing['best_ms']:>10.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"stages": results}, f, indent=2)
+    # only the median feeds regression checks; best-of is informational
+    metrics = {k: v for k, v in baseline.flatten({"stages": results}).items() if k.endswith("median_ms")}
+    raise SystemExit(baseline.report(metrics, args.baseline, args.update_baseline, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Deterministic synthetic NIR / red bands for the benchmarks.
+
+Fields look like farmland rather than white noise (so PNG/deflate sizes and NDVI histograms are
+realistic): a few smooth "parcels" of different vigour, a gentle gradient and some sensor noise.
+The same (size, seed) always yields the same bands.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+# default sizes of the suite; 10000 is opt-in (--full), it needs several GB of RAM in the legacy stages
+SIZES = (256, 1024, 2048, 4096)
+SIZES_FULL = SIZES + (10000,)
+
+
+def parse_sizes(value: str, full: bool = False) -> tuple:
+    if value:
+        return tuple(int(s) for s in value.split(",") if s.strip())
+    return SIZES_FULL if full else SIZES
+
+
+def synthetic_bands(size, seed=0, dtype=np.float32):
+    """
+    (nir, red) of shape (size, size). float dtypes are reflectance in 0..1, integer dtypes
+    are scaled to the dtype range (e.g. uint16 DN).
+    """
+    rng = np.random.default_rng(seed)
+    # built on a coarse grid and upsampled with np.repeat to stay cheap at 10k^2
+    coarse = max(8, size // 64)
+    vigour = rng.random((coarse, coarse), dtype=np.float32)
+    rep = -(-size // coarse)
+    vigour = np.repeat(np.repeat(vigour, rep, axis=0), rep, axis=1)[:size, :size]
+    gradient = np.linspace(0.0, 0.2, size, dtype=np.float32)[None, :]
+    noise = rng.standard_normal((size, size), dtype=np.float32) * np.float32(0.03)
+    nir = np.clip(0.25 + 0.5 * vigour + gradient + noise, 0.0, 1.0)
+    red = np.clip(0.35 - 0.25 * vigour + noise * np.float32(0.5), 0.0, 1.0)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        scale = np.iinfo(dtype).max
+        return (nir * scale).astype(dtype), (red * scale).astype(dtype)
+    return nir.astype(dtype, copy=False), red.astype(dtype, copy=False)
+
+
+def encode_png(band: np.ndarray) -> bytes:
+    """8-bit greyscale PNG of a 0..1 band (what phone / drone uploads look like)."""
+    buf = io.BytesIO()
+    Image.fromarray((np.clip(band, 0, 1) * 255).astype(np.uint8), mode="L").save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def encode_npy(band: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, band)
+    return buf.getvalue()
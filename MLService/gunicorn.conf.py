@@ -0,0 +1,45 @@
+"""
+Production serving: gunicorn master + uvicorn workers (see app/core/serving.py).
+
+The master imports the app once (preload_app), then preloads the heavy geospatial modules and
+runs the warm-up before forking, so every worker starts with numpy / PIL / GDAL initialised and
+shares those pages copy-on-write. Each worker runs the app lifespan: its own compute pool
+(NDVI_POOL_WORKERS defaults to cpu count / NDVI_WEB_WORKERS), job runners and n8n sender, over
+the stores shared on the host (result cache disk tier, tiles, farm metadata, jobs, outbox).
+
+Config (env):
+  NDVI_WEB_WORKERS        uvicorn worker processes               (default: WEB_CONCURRENCY or 2)
+  NDVI_BIND               listen address                         (default: 0.0.0.0:8001)
+  NDVI_WEB_TIMEOUT        seconds before a silent worker is restarted (default: 120)
+  NDVI_GRACEFUL_TIMEOUT   seconds a worker gets to finish on shutdown (default: 30)
+"""
+
+import logging
+import os
+import time
+
+workers = int(os.getenv("NDVI_WEB_WORKERS") or os.getenv("WEB_CONCURRENCY") or 2)
+# the compute pool sizes itself from this (app/core/executor.py)
+os.environ.setdefault("NDVI_WEB_WORKERS", str(workers))
+
+worker_class = "uvicorn_worker.UvicornWorker"
+bind = os.getenv("NDVI_BIND", "0.0.0.0:8001")
+preload_app = True
+timeout = int(os.getenv("NDVI_WEB_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("NDVI_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+_started = time.perf_counter()
+
+
+def when_ready(server):
+    """Master, after the app is loaded and before the workers are forked."""
+    from app.core.serving import NDVI_WARMUP, boot_report, preload, warm_up
+
+    preload()
+    if NDVI_WARMUP:
+        warm_up()
+    stages = ", ".join(f"{name}={ms:.0f}ms" for name, ms in boot_report()["stages_ms"].items())
+    logging.getLogger("ml_service").info(
+        f"NDVI master ready in {(time.perf_counter() - _started) * 1000:.0f}ms ({stages}), forking {workers} workers"
+    )
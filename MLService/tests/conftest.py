@@ -0,0 +1,40 @@
+"""
+Test setup: every store of the service goes to a throwaway directory, and the app runs its
+compute pool in threads without the startup warm-up. The environment is set here, before any
+test module imports app.*, because the modules read their config at import time.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_DATA_DIR = tempfile.mkdtemp(prefix="ndvi-tests-")
+
+for _name, _leaf in (
+    ("NDVI_TILES_DIR", "tiles"),
+    ("NDVI_SERIES_DIR", "series"),
+    ("NDVI_RESULT_CACHE_DIR", "ndvi_cache"),
+    ("NDVI_PROFILE_DIR", "profiles"),
+    ("NDVI_BLOCK_CACHE_DIR", "block_cache"),
+    ("NDVI_UPLOAD_SPOOL_DIR", "spool"),
+    ("NDVI_JOBS_PATH", "ndvi_jobs.sqlite3"),
+    ("N8N_OUTBOX_PATH", "n8n_outbox.sqlite3"),
+    ("FARM_CACHE_SHARED_PATH", "farm_cache.sqlite3"),
+):
+    os.environ[_name] = os.path.join(_DATA_DIR, _leaf)
+os.environ["NDVI_POOL_MODE"] = "thread"
+os.environ["NDVI_WARMUP"] = "0"
+os.environ.pop("N8N_WEBHOOK_URL", None)
+os.environ.pop("BACKEND_URL", None)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The app behind a TestClient, with its lifespan (pool, outbox, job runners) running."""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import httpx
+
+from app.core import alert_outbox as outbox_module
+from app.core.alert_outbox import AlertOutbox
+
+
+def _payload(report_id):
+    return {"farmId": "f1", "ndviReport": {"reportId": report_id, "mean_ndvi": 0.4}}
+
+
+def _outbox(tmp_path, name="outbox.sqlite3"):
+    return AlertOutbox(path=str(tmp_path / name), webhook_url="http://n8n.test/webhook")
+
+
+def test_enqueue_deduplicates_by_report_id(tmp_path):
+    async def scenario():
+        outbox = _outbox(tmp_path)
+        try:
+            first = await outbox.enqueue(_payload("r1"))
+            again = await outbox.enqueue(_payload("r1"))
+            many = await outbox.enqueue_many([_payload("r1"), _payload("r2"), _payload("r3")])
+            return first, again, many, outbox.stats()
+        finally:
+            await outbox.stop()
+
+    first, again, many, stats = asyncio.run(scenario())
+    assert first == {"queued": True, "reportId": "r1"}
+    assert again["reason"] == "duplicate"
+    assert many == {"queued": 2, "duplicates": 1}
+    assert stats["pending"] == 3 and stats["deduplicated"] == 2
+
+
+def test_two_senders_never_claim_the_same_rows(tmp_path):
+    async def scenario():
+        first, second = _outbox(tmp_path), _outbox(tmp_path)
+        try:
+            await first.enqueue_many([_payload(f"r{i}") for i in range(5)])
+            claimed = first._due(3), second._due(10), first._due(10)
+            return [sorted(row[0] for row in rows) for rows in claimed]
+        finally:
+            await first.stop()
+            await second.stop()
+
+    first, second, again = asyncio.run(scenario())
+    assert len(first) == 3 and len(second) == 2
+    assert not set(first) & set(second)
+    assert again == []
+
+
+def test_failed_deliveries_back_off_and_end_dead(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, "N8N_MAX_RETRIES", 2)
+    outbox = _outbox(tmp_path)
+    outbox._insert("r1", _payload("r1"))
+    rows = outbox._due(10)
+    outbox._mark_failed(rows, "status 500")
+    assert outbox._due(10) == []  # backing off
+    outbox._execute("UPDATE alerts SET next_attempt_at = 0")
+    outbox._mark_failed(outbox._due(10), "status 500")
+    assert outbox.stats()["dead"] == 1
+    assert outbox._insert("r1", _payload("r1"))  # re-submitting revives it
+    assert outbox.stats()["pending"] == 1
+
+
+def test_sender_delivers_and_purges_sent_rows_periodically(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, "N8N_OUTBOX_PURGE_SECONDS", 0.05)
+    monkeypatch.setattr(outbox_module, "N8N_OUTBOX_POLL_SECONDS", 0.02)
+    posted = []
+
+    async def scenario():
+        outbox = _outbox(tmp_path)
+        await outbox.start()
+        await outbox._client.aclose()
+        outbox._client = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: posted.append(request.content) or httpx.Response(200)))
+        try:
+            await outbox.enqueue(_payload("new"))
+            await asyncio.sleep(0.1)
+            # a row sent long ago, written while the sender is already running
+            old = time.time() - (outbox_module.N8N_OUTBOX_RETENTION_HOURS + 1) * 3600
+            outbox._execute("INSERT INTO alerts (report_id, payload, status, next_attempt_at, created_at, updated_at) "
+                            "VALUES ('old', '{}', 'sent', 0, ?, ?)", (old, old))
+            await asyncio.sleep(0.2)
+            return outbox._execute("SELECT report_id, status FROM alerts")
+        finally:
+            await outbox.stop()
+
+    rows = asyncio.run(scenario())
+    assert rows == [("new", "sent")]
+    assert len(posted) == 1
@@ -0,0 +1,72 @@
+import base64
+import io
+import json
+
+import numpy as np
+
+from app.core import image_decode
+
+
+def _lines(response):
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def _npy_b64(array):
+    buf = io.BytesIO()
+    np.save(buf, array)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def test_batch_streams_one_line_per_item_and_a_summary(client):
+    items = [
+        {"farmId": "b1", "captureDate": "2026-01-01", "nir": [[0.6, 0.7], [0.8, 0.9]], "red": [[0.1, 0.1], [0.2, 0.2]]},
+        {"farmId": "b2", "captureDate": "2026-01-01", "nir": [[0.5]]},
+    ]
+    lines = _lines(client.post("/v1/ndvi/compute/batch", json={"items": items, "sendAlerts": False}))
+    by_index = {line["index"]: line for line in lines if "index" in line}
+    assert by_index[0]["success"] and by_index[0]["ndviReport"]["valid_pixel_count"] == 4
+    assert not by_index[1]["success"] and "nir" in by_index[1]["error"]
+    assert lines[-1] == {"done": True, "total": 2, "succeeded": 1, "failed": 1, "alertsQueued": 0}
+
+
+def test_oversized_batch_items_are_rejected_before_compute(client, monkeypatch):
+    monkeypatch.setattr(image_decode, "NDVI_MAX_SOURCE_PIXELS", 16)
+    big = np.full((5, 5), 0.5, dtype=np.float32)
+    items = [
+        {"farmId": "small", "nir": [[0.6] * 4] * 4, "red": [[0.2] * 4] * 4},
+        {"farmId": "json", "nir": big.tolist(), "red": big.tolist()},
+        {"farmId": "npy", "nir_b64": _npy_b64(big), "red_b64": _npy_b64(big)},
+    ]
+    lines = _lines(client.post("/v1/ndvi/compute/batch", json={"items": items, "sendAlerts": False},
+                               headers={"X-NDVI-Cache": "bypass"}))
+    by_farm = {line["farmId"]: line for line in lines if "index" in line}
+    assert by_farm["small"]["success"]
+    for farm in ("json", "npy"):
+        assert not by_farm[farm]["success"]
+        assert "limit is" in by_farm[farm]["error"]
+    assert lines[-1]["failed"] == 2
+
+
+def test_batch_items_are_decoded_off_the_event_loop(client, monkeypatch):
+    import asyncio
+
+    from app import main
+
+    on_loop = []
+    original = main._batch_item_inputs
+
+    def inputs(item):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return original(item)
+
+    monkeypatch.setattr(main, "_batch_item_inputs", inputs)
+    band = np.full((4, 4), 0.5, dtype=np.float32)
+    items = [{"farmId": f"t{i}", "nir_b64": _npy_b64(band), "red_b64": _npy_b64(band * 0.5)} for i in range(3)]
+    lines = _lines(client.post("/v1/ndvi/compute/batch", json={"items": items, "sendAlerts": False}))
+    assert lines[-1]["succeeded"] == 3
+    assert on_loop == [False, False, False]
@@ -0,0 +1,182 @@
+import io
+
+import numpy as np
+import pytest
+
+from app import main
+
+
+def _npy(array) -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, array)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    queued = []
+
+    async def enqueue(payload):
+        queued.append(payload)
+        return {"queued": 1}
+
+    monkeypatch.setattr(main.alert_outbox, "enqueue", enqueue)
+    return queued
+
+
+def _compute(client, nir, red, **form):
+    files = {"nir_file": ("nir.npy", _npy(nir)), "red_file": ("red.npy", _npy(red))}
+    return client.post("/v1/ndvi/compute", files=files, data={"captureDate": "2026-03-01", **form})
+
+
+def test_compute_reports_caches_records_and_alerts(client, alerts):
+    nir = np.full((32, 32), 0.6, dtype=np.float32)
+    red = np.full((32, 32), 0.2, dtype=np.float32)
+
+    first = _compute(client, nir, red, farmId="farm-ok")
+    again = _compute(client, nir, red, farmId="farm-ok")
+
+    assert first.status_code == 200 and first.headers["X-NDVI-Cache"] == "miss"
+    assert again.headers["X-NDVI-Cache"] == "hit-memory"
+    report = first.json()["ndviReport"]
+    assert report["mean_ndvi"] == pytest.approx(0.5) and report["valid_pixel_count"] == 32 * 32
+    assert [a["ndviReport"]["reportId"] for a in alerts] == [report["reportId"]] * 2
+    series = client.get("/v1/farms/farm-ok/ndvi/series").json()
+    assert [c["reportId"] for c in series["captures"]] == [report["reportId"]]
+
+
+@pytest.mark.parametrize("approx", [None, "true"])
+def test_all_nodata_bands_give_null_stats_and_no_series_or_alert(client, alerts, approx):
+    nodata = np.zeros((300, 300), dtype=np.uint16)
+    form = {"farmId": f"farm-empty-{approx}", "nodata": "0"}
+    if approx:
+        form["approx"] = approx
+
+    response = _compute(client, nodata, nodata, **form)
+
+    assert response.status_code == 200, response.text
+    report = response.json()["ndviReport"]
+    assert report["mean_ndvi"] is None and report["median_ndvi"] is None
+    assert report["valid_pixel_count"] == 0 and report["coverage_fraction"] == 0.0
+    if approx:
+        assert report["approximate"]["intervals"]["mean_ndvi"] == [None, None]
+    assert alerts == []
+    series = client.get(f"/v1/farms/farm-empty-{approx}/ndvi/series").json()
+    assert series["captures"] == []
+    # the cached result is served the same way
+    assert _compute(client, nodata, nodata, **form).json()["ndviReport"] == report
+
+
+def test_integer_binary_bands_are_decoded_without_a_copy():
+    rng = np.random.default_rng(5)
+    nir = rng.integers(0, 10000, (64, 48), dtype=np.uint16)
+    red = rng.integers(0, 10000, (64, 48), dtype=np.uint16)
+    nir_buf, red_buf = _npy(nir), _npy(red)
+
+    nir_arr, red_arr = main.load_band_arrays({"nir_bytes": nir_buf, "red_bytes": red_buf})
+    stacked_nir, _ = main.load_band_arrays({"bands_bytes": _npy(np.stack([nir, red]))})
+
+    assert nir_arr.dtype == red_arr.dtype == stacked_nir.dtype == np.uint16
+    assert not nir_arr.flags.owndata and not red_arr.flags.owndata
+    native = main.run_ndvi_pipeline({"nir_bytes": nir_buf, "red_bytes": red_buf}, 0.3)
+    scaled = main.run_ndvi_pipeline({"nir_bytes": _npy(nir / 65535.0), "red_bytes": _npy(red / 65535.0)}, 0.3)
+    for key in ("mean_ndvi", "median_ndvi", "pct_stress"):
+        assert native[key] == pytest.approx(scaled[key], abs=1e-6)
+
+
+# ---------- raster bands on different grids ----------
+ORIGIN = (500000.0, 4000000.0)
+
+
+def _geotiff(path, array, resolution, crs="EPSG:32633", nodata=None):
+    rasterio = pytest.importorskip("rasterio")
+    from rasterio.transform import from_origin
+
+    with rasterio.open(path, "w", driver="GTiff", width=array.shape[1], height=array.shape[0], count=1,
+                       dtype=array.dtype.name, crs=crs, nodata=nodata,
+                       transform=from_origin(*ORIGIN, resolution, resolution)) as dst:
+        dst.write(array, 1)
+    return str(path)
+
+
+def _box(left, bottom, right, top):
+    return {"type": "Polygon", "coordinates": [[(left, bottom), (right, bottom), (right, top), (left, top), (left, bottom)]]}
+
+
+@pytest.mark.parametrize("crs", ["EPSG:32633", None])
+@pytest.mark.parametrize("windowed", [False, True])
+def test_a_20m_red_band_is_coregistered_onto_a_10m_nir_band(tmp_path, crs, windowed):
+    from app.core.compute_ndvi import compute_ndvi_from_paths
+
+    nir = np.full((64, 64), 6000, dtype=np.uint16)
+    red = np.full((32, 32), 2000, dtype=np.uint16)
+    red[:, 16:] = 6000  # NDVI 0.5 on the west half, 0 on the east half
+    nir_path = _geotiff(tmp_path / "nir.tif", nir, 10, crs)
+    red_path = _geotiff(tmp_path / "red.tif", red, 20, crs)
+
+    result = compute_ndvi_from_paths(red_path, nir_path, _box(ORIGIN[0], ORIGIN[1] - 640, ORIGIN[0] + 640, ORIGIN[1]),
+                                     save_preview=False, windowed=windowed)
+
+    # computed on the finer (10 m) grid
+    assert result["valid_pixel_count"] == 64 * 64
+    assert result["mean_ndvi"] == pytest.approx(0.25, abs=0.02)
+    assert result["pct_stress"] == pytest.approx(0.5, abs=0.05)
+
+
+def test_alignment_plans_are_cached_in_an_lru():
+    pytest.importorskip("rasterio")
+    from rasterio.transform import from_origin
+
+    from app.core.coregister import Grid, PlanCache
+
+    def grid(resolution, crs=None, origin=ORIGIN):
+        side = int(640 / resolution)
+        return Grid(crs, from_origin(*origin, resolution, resolution), side, side)
+
+    reference = grid(10)
+    cache = PlanCache(max_entries=2)
+    first = cache.get(grid(20), reference)
+    assert cache.get(grid(20), reference) is first and not first.identity
+    assert cache.get(reference, reference).identity
+    cache.get(grid(20), reference)  # most recently used again
+    cache.get(grid(40), reference)  # evicts the identity plan
+    assert cache.stats() == {"entries": 2, "max_entries": 2, "hits": 2, "misses": 3}
+    assert cache.get(grid(20), reference) is first
+
+    with pytest.raises(ValueError, match="do not overlap"):
+        cache.get(grid(20, origin=(ORIGIN[0] + 10000, ORIGIN[1])), reference)
+    from rasterio.crs import CRS
+
+    with pytest.raises(ValueError, match="without a CRS"):
+        cache.get(grid(20, CRS.from_epsg(32633)), reference)
+
+
+def test_raster_endpoints_answer_null_stats_for_a_polygon_without_valid_pixels(client, tmp_path):
+    empty = np.zeros((32, 32), dtype=np.uint16)
+    nir_path = _geotiff(tmp_path / "nir.tif", empty, 10, nodata=0)
+    red_path = _geotiff(tmp_path / "red.tif", empty, 10, nodata=0)
+    polygon = _box(ORIGIN[0] + 40, ORIGIN[1] - 280, ORIGIN[0] + 280, ORIGIN[1] - 40)
+
+    indices = client.post("/v1/ndvi/raster/indices", json={
+        "polygon_geojson": polygon, "indices": ["ndvi"],
+        "band_paths": {"nir": nir_path, "red": red_path},
+    })
+    zonal = client.post("/v1/ndvi/raster/zonal", json={
+        "red_path": red_path, "nir_path": nir_path,
+        "features": {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"farmId": "empty"}, "geometry": polygon},
+        ]},
+    })
+    compute = client.post("/v1/ndvi/raster/compute", json={
+        "red_path": red_path, "nir_path": nir_path, "polygon_geojson": polygon, "save_preview": False,
+    })
+
+    assert indices.status_code == 200, indices.text
+    ndvi = indices.json()["indices"]["ndvi"]
+    assert ndvi["mean"] is None and ndvi["median"] is None and indices.json()["valid_pixel_count"] == 0
+    assert zonal.status_code == 200, zonal.text
+    zone = zonal.json()["zones"][0]
+    assert zone["zone_id"] == "empty" and zone["mean_ndvi"] is None and zone["median_ndvi"] is None
+    assert zone["valid_pixel_count"] == 0 and zone["area_pixel_count"] > 0
+    assert compute.status_code == 200, compute.text
+    assert compute.json()["mean_ndvi"] is None and compute.json()["valid_pixel_count"] == 0
@@ -0,0 +1,65 @@
+import asyncio
+import os
+
+import pytest
+
+from app.core.executor import ComputePool, PoolRestarted, PoolSaturated
+
+
+def _square(x):
+    return x * x
+
+
+def _die():
+    os._exit(1)
+
+
+def test_runs_calls_inline_and_in_threads():
+    async def scenario(pool):
+        try:
+            return await asyncio.gather(*(pool.run(_square, i) for i in range(4)))
+        finally:
+            pool.shutdown()
+
+    for mode in ("inline", "thread"):
+        pool = ComputePool(mode=mode, workers=2, max_queue=2)
+        assert asyncio.run(scenario(pool)) == [0, 1, 4, 9]
+        assert pool.stats()["completed"] == 4
+
+
+def test_rejects_work_beyond_workers_plus_queue():
+    async def scenario():
+        pool = ComputePool(mode="thread", workers=1, max_queue=1, retry_after=7)
+        async def slow():
+            return await pool.run(_square, 3)
+
+        try:
+            first = asyncio.create_task(slow())
+            second = asyncio.create_task(slow())
+            await asyncio.sleep(0)
+            with pytest.raises(PoolSaturated) as info:
+                await pool.run(_square, 1)
+            assert await first == await second == 9
+            return info.value.retry_after, pool.stats()["rejected"]
+        finally:
+            pool.shutdown()
+
+    assert asyncio.run(scenario()) == (7, 1)
+
+
+def test_dead_worker_fails_only_its_call_and_the_pool_recovers():
+    async def scenario():
+        pool = ComputePool(mode="process", workers=1, max_queue=2, retry_after=1)
+        try:
+            assert await pool.run(_square, 2) == 4
+            with pytest.raises(PoolRestarted) as info:
+                await pool.run(_die)
+            assert isinstance(info.value, PoolSaturated)
+            assert await pool.run(_square, 5) == 25
+            return pool.stats()
+        finally:
+            pool.shutdown()
+
+    stats = asyncio.run(scenario())
+    assert stats["pool_restarts"] == 1
+    assert stats["failed"] == 1 and stats["completed"] == 2
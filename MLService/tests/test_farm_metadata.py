@@ -0,0 +1,101 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core import farm_metadata
+from app.core.farm_metadata import BackendClient, FarmMetadataCache, SharedFarmStore
+
+
+def _client(statuses):
+    """BackendClient whose backend answers each lookup with the next status of statuses."""
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if status == 200:
+            return httpx.Response(200, json={"farmId": request.url.path.rsplit("/", 1)[-1]})
+        return httpx.Response(status, text="nope")
+
+    client = BackendClient()
+    client.cache = FarmMetadataCache(ttl=300, negative_ttl=30, max_entries=16)
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, calls
+
+
+@pytest.fixture(autouse=True)
+def backend_url(monkeypatch):
+    monkeypatch.setattr(farm_metadata, "BACKEND_URL", "http://backend")
+
+
+@pytest.mark.parametrize("status", [404, 410])
+def test_not_found_is_negatively_cached(status):
+    async def scenario():
+        client, calls = _client([status, 200])
+        try:
+            return [await client.fetch_farm_metadata("f1") for _ in range(2)], calls
+        finally:
+            await client.close()
+
+    results, calls = asyncio.run(scenario())
+    assert results == [None, None]
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status", [401, 403, 429, 500, 503])
+def test_auth_throttling_and_server_errors_are_not_cached(status):
+    async def scenario():
+        client, calls = _client([status, 200])
+        try:
+            return [await client.fetch_farm_metadata("f1") for _ in range(2)], calls
+        finally:
+            await client.close()
+
+    results, calls = asyncio.run(scenario())
+    assert results == [None, {"farmId": "f1"}]
+    assert len(calls) == 2
+
+
+def test_concurrent_lookups_are_coalesced_and_shared_across_caches(tmp_path):
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return {"farmId": "f1"}, True
+
+    async def scenario():
+        path = str(tmp_path / "farms.sqlite3")
+        first = FarmMetadataCache(300, 30, 16, shared=SharedFarmStore(path))
+        second = FarmMetadataCache(300, 30, 16, shared=SharedFarmStore(path))
+        values = await asyncio.gather(*(first.get("f1", loader) for _ in range(5)))
+        values.append(await second.get("f1", loader))
+        removed = await first.invalidate_all_workers("f1")
+        return values, removed, first.stats(), second.stats(), second.shared.get("f1")[1]
+
+    values, removed, first, second, left = asyncio.run(scenario())
+    assert values == [{"farmId": "f1"}] * 6
+    assert len(loads) == 1
+    assert first["coalesced"] == 4 and second["shared_hits"] == 1
+    assert removed >= 1 and left is None
+
+
+def test_cache_stats_endpoint_reads_the_shared_tier_off_the_event_loop(client, monkeypatch):
+    from app.main import backend_client
+
+    on_loop = []
+    original = backend_client.cache.stats
+
+    def stats():
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return original()
+
+    monkeypatch.setattr(backend_client.cache, "stats", stats)
+    response = client.get("/v1/farms/cache")
+    assert response.status_code == 200 and "shared_entries" in response.json()
+    assert on_loop == [False]
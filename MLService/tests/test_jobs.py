@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+from app.core import jobs
+from app.core.executor import PoolRestarted
+from app.core.jobs import JobManager, JobStore
+
+
+def _unit(index):
+    return {"index": index}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Fake compute pool: records the unit indexes it ran; behaviour[index] may raise per attempt."""
+    calls, behaviour = [], {}
+
+    async def run(fn, **kwargs):
+        index = kwargs["index"]
+        calls.append(index)
+        outcomes = behaviour.get(index)
+        if outcomes:
+            raise outcomes.pop(0)
+        return fn(**kwargs)
+
+    monkeypatch.setattr(jobs, "unit_call", lambda kind, params, index: (_unit, {"index": index}))
+    monkeypatch.setattr(jobs.compute_pool, "run", run)
+    return calls, behaviour
+
+
+async def _finished(manager, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        state = await manager.state(job_id)
+        if state["status"] in jobs.FINAL_STATUSES:
+            return state
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish: {state}")
+
+
+def _crash():
+    return PoolRestarted(0, RuntimeError("worker killed"))
+
+
+def test_units_rerun_after_worker_crashes_but_compute_errors_fail_at_once(tmp_path, pool, monkeypatch):
+    calls, behaviour = pool
+    monkeypatch.setattr(jobs, "NDVI_JOB_CRASH_RETRIES", 2)
+    behaviour.update({0: [_crash()], 1: [ValueError("bad polygon")], 2: [_crash(), _crash(), _crash()]})
+
+    async def scenario():
+        manager = JobManager(JobStore(str(tmp_path / "jobs.sqlite3")), runners=1, bulk_runners=1)
+        await manager.start()
+        try:
+            job = await manager.submit("compute", {"polygons": [{}, {}, {}]})
+            state = await _finished(manager, job["jobId"])
+            return state, await manager.result(job["jobId"], "compute"), manager.stats()
+        finally:
+            await manager.stop()
+
+    state, result, stats = asyncio.run(scenario())
+    assert sorted(calls) == [0, 0, 1, 2, 2, 2]
+    by_index = {r["index"]: r for r in result["results"]}
+    assert by_index[0] == {"index": 0, "success": True, "result": {"index": 0}}
+    assert by_index[1] == {"index": 1, "success": False, "error": "bad polygon"}
+    assert not by_index[2]["success"] and "3 times" in by_index[2]["error"]
+    assert state["status"] == "succeeded" and state["progress"]["failed"] == 2
+    assert stats["worker_crashes"] == 4
+
+
+def test_orphaned_jobs_resume_from_their_first_missing_unit(tmp_path, pool):
+    calls, _ = pool
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    # a job left behind by a worker on another host whose lease ran out after one unit
+    store.create("orphan", "compute", "bulk", {"polygons": [{}, {}, {}]}, 3, "elsewhere:1:dead", lease=60)
+    assert store.begin_unit("orphan", "elsewhere:1:dead")
+    assert store.save_unit("orphan", "elsewhere:1:dead", 0, True, {"index": 0})
+    # still leased by a worker on another host: left alone
+    store.create("leased", "compute", "bulk", {"polygons": [{}]}, 1, "elsewhere:2:live", lease=60)
+    store._update("UPDATE jobs SET lease_until = 0 WHERE id = 'orphan'")
+
+    async def scenario():
+        manager = JobManager(store, runners=2, bulk_runners=2, lease=0.3)
+        await manager.start()
+        try:
+            state = await _finished(manager, "orphan")
+            return state, await manager.state("leased"), await manager.result("orphan", "compute"), manager.stats()
+        finally:
+            await manager.stop()
+
+    state, leased, result, stats = asyncio.run(scenario())
+    assert sorted(calls) == [1, 2]
+    assert state["status"] == "succeeded" and state["progress"]["done"] == 3
+    assert [r["index"] for r in result["results"]] == [0, 1, 2]
+    assert leased["status"] == "queued"
+    assert stats["resumed_jobs"] == 1
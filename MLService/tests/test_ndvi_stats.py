@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from app.core.ndvi_stats import (
+    HIST_BINS,
+    MEDIAN_HIST_BINS,
+    NDVIStatsAccumulator,
+    combine_masks,
+    compute_ndvi_stats,
+    histogram_bin_index,
+)
+from app.core.zonal import ZonalAccumulator
+
+
+def _bands(shape=(301, 257), seed=0, dtype=np.uint16):
+    rng = np.random.default_rng(seed)
+    nir = rng.integers(0, 6000, shape).astype(dtype)
+    red = rng.integers(0, 6000, shape).astype(dtype)
+    return nir, red
+
+
+def _reference(nir, red, threshold, valid=None):
+    nir, red = nir.astype(np.float32), red.astype(np.float32)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndvi = np.where(nir + red == 0, np.float32(0), (nir - red) / (nir + red)).astype(np.float32)
+    ndvi = np.clip(ndvi, -1, 1)
+    if valid is not None:
+        ndvi = ndvi[valid]
+    return ndvi.reshape(-1)
+
+
+def _edge_values(dtype):
+    edges = np.linspace(-1, 1, MEDIAN_HIST_BINS + 1, dtype=dtype)
+    values = np.concatenate([edges, np.nextafter(edges, dtype(2)), np.nextafter(edges, dtype(-2)),
+                             np.linspace(-1, 1, 100_001, dtype=dtype)])
+    return np.clip(values, -1, 1).astype(dtype)
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_histogram_matches_np_histogram_on_bin_edges(dtype):
+    values = _edge_values(dtype)
+    acc = NDVIStatsAccumulator(0.3)
+    acc.add(values)
+    expected, edges = np.histogram(values, bins=HIST_BINS, range=(-1.0, 1.0))
+    result = acc.result()
+    assert result["histogram"]["bins"] == expected.tolist()
+    assert result["histogram"]["edges"] == pytest.approx(edges.tolist())
+
+
+def test_fine_bins_follow_the_np_histogram_rule():
+    values = _edge_values(np.float32)
+    for bins in (HIST_BINS, 200, MEDIAN_HIST_BINS):
+        idx = histogram_bin_index(values, bins)
+        expected = np.histogram(values, bins=bins, range=(-1.0, 1.0))[0]
+        assert np.array_equal(np.bincount(idx, minlength=bins), expected)
+
+
+def test_stats_match_numpy_reference():
+    nir, red = _bands()
+    ndvi_out = np.empty(nir.size, dtype=np.float32)
+    stats = compute_ndvi_stats(nir, red, 0.3, chunk_pixels=4096, ndvi_out=ndvi_out)
+    ndvi = _reference(nir, red, 0.3)
+    assert np.array_equal(ndvi_out, ndvi)
+    assert stats["histogram"]["bins"] == np.histogram(ndvi, bins=HIST_BINS, range=(-1.0, 1.0))[0].tolist()
+    assert stats["median_ndvi"] == pytest.approx(float(np.median(ndvi)), abs=1e-7)
+    assert stats["mean_ndvi"] == pytest.approx(float(ndvi.mean(dtype=np.float64)), rel=1e-6)
+    assert stats["pct_stress"] == pytest.approx(np.count_nonzero(ndvi < 0.3) / ndvi.size)
+    assert stats["pixel_count"] == ndvi.size
+
+
+def test_approx_median_is_within_one_fine_bin():
+    nir, red = _bands(seed=1)
+    stats = compute_ndvi_stats(nir, red, 0.3, median="approx", chunk_pixels=10_000)
+    assert abs(stats["median_ndvi"] - float(np.median(_reference(nir, red, 0.3)))) <= 2.0 / MEDIAN_HIST_BINS
+
+
+def test_valid_mask_skips_pixels_and_reports_coverage():
+    nir, red = _bands(seed=2)
+    valid = combine_masks(nir > 500, None, red > 500)
+    ndvi_out = np.empty(nir.size, dtype=np.float32)
+    stats = compute_ndvi_stats(nir, red, 0.3, ndvi_out=ndvi_out, valid=valid)
+    ndvi = _reference(nir, red, 0.3, valid)
+    assert stats["valid_pixel_count"] == stats["pixel_count"] == int(valid.sum())
+    assert stats["area_pixel_count"] == nir.size
+    assert stats["coverage_fraction"] == pytest.approx(valid.mean())
+    assert stats["median_ndvi"] == pytest.approx(float(np.median(ndvi)), abs=1e-7)
+    assert np.isnan(ndvi_out[~valid.reshape(-1)]).all()
+
+
+def test_nothing_valid_gives_undefined_stats():
+    nir, red = _bands(shape=(8, 8))
+    stats = compute_ndvi_stats(nir, red, 0.3, valid=np.zeros(nir.shape, dtype=bool))
+    assert stats["valid_pixel_count"] == 0 and stats["coverage_fraction"] == 0.0
+    assert stats["mean_ndvi"] is None and stats["median_ndvi"] is None
+    assert sum(stats["histogram"]["bins"]) == 0
+
+
+def test_zonal_histograms_match_np_histogram_per_zone():
+    rng = np.random.default_rng(4)
+    values = np.concatenate([_edge_values(np.float32), rng.uniform(-1, 1, 5000).astype(np.float32)])
+    labels = rng.integers(0, 4, values.size)
+    acc = ZonalAccumulator(3, 0.3)
+    acc.add_area(labels)
+    acc.add(labels, values)
+    for zone in acc.results(["a", "b", "c"]):
+        label = ["a", "b", "c"].index(zone["zone_id"]) + 1
+        expected = np.histogram(values[labels == label], bins=HIST_BINS, range=(-1.0, 1.0))[0]
+        assert zone["histogram"]["bins"] == expected.tolist()
+        assert zone["valid_pixel_count"] == int(np.count_nonzero(labels == label))
+
+
+def test_zonal_zones_without_pixels_have_undefined_stats():
+    acc = ZonalAccumulator(2, 0.3)
+    labels = np.ones(4, dtype=np.int64)
+    acc.add_area(labels)
+    acc.add(labels, np.full(4, 0.5, dtype=np.float32))
+    filled, empty = acc.results(["filled", "empty"])
+    assert filled["mean_ndvi"] == pytest.approx(0.5) and filled["median_ndvi"] == pytest.approx(0.5, abs=0.01)
+    assert empty["mean_ndvi"] is None and empty["median_ndvi"] is None and empty["pixel_count"] == 0
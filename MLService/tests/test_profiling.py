@@ -0,0 +1,35 @@
+import pytest
+
+from app.core import profiling
+from app.core.profiling import profile_trigger
+
+
+@pytest.fixture(autouse=True)
+def no_sampling(monkeypatch):
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_TOKEN", None)
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_ALLOW_HEADER", False)
+
+
+def test_header_is_ignored_by_default():
+    assert profile_trigger("1") is None
+    assert profile_trigger(None) is None
+
+
+def test_token_gates_the_header(monkeypatch):
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_ALLOW_HEADER", True)
+    assert profile_trigger("s3cret") == "header"
+    assert profile_trigger("1") is None
+    assert profile_trigger("s3cre") is None
+
+
+def test_allow_header_accepts_any_client(monkeypatch):
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_ALLOW_HEADER", True)
+    assert profile_trigger(" yes ") == "header"
+    assert profile_trigger("0") is None
+
+
+def test_sampling_needs_no_header(monkeypatch):
+    monkeypatch.setattr(profiling, "NDVI_PROFILE_SAMPLE_RATE", 1.0)
+    assert profile_trigger(None) == "sample"
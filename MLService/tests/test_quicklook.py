@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from app.core.quicklook import sample_estimates
+
+
+def _sample(size=2000, seed=0):
+    return np.random.default_rng(seed).uniform(-0.2, 0.9, size).astype(np.float32)
+
+
+def test_nan_samples_do_not_count_towards_the_estimates():
+    finite = _sample()
+    with_nan = np.concatenate([finite, np.full(finite.size, np.nan, dtype=np.float32)])
+
+    clean = sample_estimates(finite, 0.3, population=100_000, method="strided")
+    mixed = sample_estimates(with_nan, 0.3, population=200_000, method="strided")
+
+    for key in ("mean_ndvi", "median_ndvi", "pct_stress", "pixel_count"):
+        assert mixed[key] == pytest.approx(clean[key])
+    for key, interval in clean["approximate"]["intervals"].items():
+        assert mixed["approximate"]["intervals"][key] == pytest.approx(interval)
+
+
+@pytest.mark.parametrize("nan_fraction", [0.0, 0.3, 0.9])
+def test_intervals_contain_the_reported_estimates(nan_fraction):
+    values = _sample(seed=1)
+    values[: int(values.size * nan_fraction)] = np.nan
+
+    stats = sample_estimates(values, 0.3, population=50_000, method="random")
+
+    intervals = stats["approximate"]["intervals"]
+    for key in ("mean_ndvi", "median_ndvi", "pct_stress"):
+        low, high = intervals[key]
+        assert low <= stats[key] <= high
+    assert stats["pct_stress"] == pytest.approx(np.mean(values[np.isfinite(values)] < 0.3))
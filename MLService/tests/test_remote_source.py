@@ -0,0 +1,163 @@
+import hashlib
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+from app.core import remote_source
+from app.core.remote_source import BlockCache, RemoteObject, RemoteSession, summarize_io
+
+CHUNK = 1024
+
+
+class RangeServer:
+    """Local stand-in for a COG host: serves in-memory objects and honours single Range requests."""
+
+    def __init__(self):
+        self.objects = {}
+        self.ranges = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = server.objects.get(self.path)
+                if data is None:
+                    self.send_error(404)
+                    return
+                m = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+                start, end = (int(m.group(1)), min(int(m.group(2)), len(data) - 1)) if m else (0, len(data) - 1)
+                server.ranges.append((self.path, start, end))
+                self.send_response(206 if m else 200)
+                if m:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                self.send_header("ETag", hashlib.md5(data).hexdigest())
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                self.wfile.write(data[start:end + 1])
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    srv = RangeServer()
+    yield srv
+    srv.close()
+
+
+def _object(server, path, data, cache=None):
+    server.objects[path] = data
+    obj = RemoteObject(server.url(path), cache or BlockCache(memory_mb=8, directory=None), chunk_bytes=CHUNK)
+    session = RemoteSession(obj)
+    obj.refresh(session)
+    return obj, session
+
+
+def test_reads_return_the_exact_bytes(server):
+    data = bytes(range(256)) * 40
+    obj, session = _object(server, "/obj.bin", data)
+    assert obj.size == len(data)
+    for offset, length in ((0, 10), (1000, 100), (CHUNK * 3 - 1, 2), (len(data) - 5, 50), (len(data), 5)):
+        assert obj.read(offset, length, session) == data[offset:offset + length]
+
+
+def test_missing_chunks_are_coalesced_into_few_requests(server, monkeypatch):
+    monkeypatch.setattr(remote_source, "NDVI_RANGE_MAX_GAP_CHUNKS", 1)
+    obj, session = _object(server, "/coalesce.bin", b"x" * (CHUNK * 12))
+    server.ranges.clear()
+    # chunks 2, 3 and 5 (gap of one bridged) in one request, chunk 9 in another
+    obj.prefetch([(CHUNK * 2, CHUNK * 2), (CHUNK * 5 + 10, 5), (CHUNK * 9, 1)], session)
+    assert sorted((start, end) for _, start, end in server.ranges) == [
+        (CHUNK * 2, CHUNK * 6 - 1), (CHUNK * 9, CHUNK * 10 - 1)]
+    assert session.requests == 3  # refresh + 2 coalesced ranges
+
+
+def test_cache_serves_repeat_reads_and_counts_only_the_bytes_read(server):
+    cache = BlockCache(memory_mb=8, directory=None)
+    obj, session = _object(server, "/cached.bin", bytes(CHUNK * 8), cache)
+    obj.prefetch([(CHUNK * 2, CHUNK * 2)], session)
+    requests = session.requests
+    assert session.bytes_from_cache == 0  # prefetching serves nothing
+    obj.read(CHUNK * 2 + 10, 20, session)
+    obj.read(CHUNK * 4 - 5, 10, session)  # 5 bytes of cached chunk 3, 5 of uncached chunk 4
+    assert session.requests == requests + 1
+    assert session.bytes_read == 30
+    assert session.bytes_from_cache == 25
+    io_stats = summarize_io([session])
+    assert io_stats["bytes_read"] == 30 and io_stats["bytes_from_cache"] == 25
+
+    # a later session for the same object is served from the shared cache
+    again = RemoteSession(obj)
+    assert obj.read(CHUNK * 2, CHUNK * 3, again) == bytes(CHUNK * 3)
+    assert again.requests == 0 and again.bytes_from_cache == CHUNK * 3
+
+
+def test_remote_geotiff_reads_like_the_local_file(server, tmp_path):
+    rasterio = pytest.importorskip("rasterio")
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    band = np.arange(512 * 512, dtype=np.uint16).reshape(512, 512)
+    path = tmp_path / "band.tif"
+    with rasterio.open(path, "w", driver="GTiff", width=512, height=512, count=1, dtype="uint16", tiled=True,
+                       blockxsize=128, blockysize=128, crs="EPSG:32633",
+                       transform=from_origin(500000, 4000000, 10, 10)) as dst:
+        dst.write(band, 1)
+    server.objects["/band.tif"] = path.read_bytes()
+
+    window = Window(128, 256, 128, 128)
+    with remote_source.open_remote_raster(server.url("/band.tif")) as (src, session):
+        remote_source.prefetch_window(src, session, window)
+        fetched = session.bytes_fetched
+        assert np.array_equal(src.read(1, window=window), band[256:384, 128:256])
+        assert session.bytes_fetched == fetched  # the block came from the prefetch
+        assert session.bytes_fetched < len(server.objects["/band.tif"])
+
+
+class _FakeS3:
+    """get_object / head_object of one object, with or without a ContentRange header."""
+
+    def __init__(self, data, content_range=True, honour_range=True):
+        self.data, self.content_range, self.honour_range = data, content_range, honour_range
+        self.heads = 0
+
+    def get_object(self, Bucket, Key, Range):
+        import io
+
+        start, end = (int(v) for v in Range[len("bytes="):].split("-"))
+        end = min(end, len(self.data) - 1)
+        body = self.data[start:end + 1] if self.honour_range else self.data
+        resp = {"Body": io.BytesIO(body), "ContentLength": len(body), "ETag": '"e"'}
+        if self.content_range:
+            resp["ContentRange"] = f"bytes {start}-{end}/{len(self.data)}"
+        return resp
+
+    def head_object(self, Bucket, Key):
+        self.heads += 1
+        return {"ContentLength": len(self.data)}
+
+
+@pytest.mark.parametrize("content_range,honour_range", [(True, True), (False, True), (False, False)])
+def test_s3_object_size_is_never_taken_from_a_ranged_response(content_range, honour_range):
+    data = bytes(range(256)) * 20
+    transport = remote_source.S3Transport.__new__(remote_source.S3Transport)
+    transport.client = _FakeS3(data, content_range, honour_range)
+
+    chunk, size, etag = transport.get_range("s3://bucket/scene.tif", 100, 1123)
+
+    assert chunk == data[100:1124] and size == len(data) and etag == '"e"'
+    assert transport.client.heads == (0 if content_range else 1)
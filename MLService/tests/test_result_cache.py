@@ -0,0 +1,43 @@
+import asyncio
+
+from app.core.result_cache import ResultCache, input_cache_key
+
+NIR, RED = b"\x01\x02" * 64, b"\x03\x04" * 64
+
+
+def test_key_depends_on_content_threshold_params_and_options():
+    base = input_cache_key({"nir_bytes": NIR, "red_bytes": RED}, 0.3)
+    assert base == input_cache_key({"red_bytes": bytearray(RED), "nir_bytes": memoryview(NIR)}, 0.3)
+    assert len({
+        base,
+        input_cache_key({"nir_bytes": NIR, "red_bytes": RED + b"\0"}, 0.3),
+        input_cache_key({"nir_bytes": NIR, "red_bytes": RED}, 0.31),
+        input_cache_key({"nir_bytes": NIR, "red_bytes": RED}, 0.3, {"approx": "strided"}),
+        input_cache_key({"nir_bytes": NIR, "red_bytes": RED, "nodata": 0.0}, 0.3),
+        input_cache_key({"nir_bytes": NIR, "red_bytes": RED, "array_dtype": "uint16"}, 0.3),
+    }) == 6
+
+
+def test_key_never_collides_across_field_boundaries():
+    assert input_cache_key({"nir_bytes": b"ab", "red_bytes": b"c"}, 0.3) != \
+        input_cache_key({"nir_bytes": b"a", "red_bytes": b"bc"}, 0.3)
+    assert input_cache_key({"nir": [[0.5, 0.2]], "red": [[0.1]]}, 0.3) != \
+        input_cache_key({"nir": [[0.5]], "red": [[0.2, 0.1]]}, 0.3)
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    async def scenario():
+        cache = ResultCache(enabled=True, memory_entries=1, directory=str(tmp_path), disk_max_mb=1)
+        await cache.put("aa11", {"mean_ndvi": 0.4})
+        await cache.put("bb22", {"mean_ndvi": 0.5})  # evicts aa11 from memory
+        first = await cache.get("aa11")
+        second = await cache.get("aa11")
+        restarted = ResultCache(enabled=True, memory_entries=4, directory=str(tmp_path), disk_max_mb=1)
+        return first, second, await restarted.get("bb22"), await restarted.get("cc33"), cache.stats()
+
+    first, second, shared, missing, stats = asyncio.run(scenario())
+    assert first == ({"mean_ndvi": 0.4}, "disk")
+    assert second == ({"mean_ndvi": 0.4}, "memory")
+    assert shared == ({"mean_ndvi": 0.5}, "disk")
+    assert missing == (None, None)
+    assert stats["memory_evictions"] >= 1 and stats["disk_hits"] == 1
@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+
+from app.core.tiles import TileStore
+
+
+def test_prune_drops_evicted_scenes_and_their_report_links(tmp_path):
+    store = TileStore(root=str(tmp_path), enabled=True, max_mb=0)
+    ndvi = np.linspace(-1, 1, 64 * 64, dtype=np.float32).reshape(64, 64)
+    old, new = "a" * 40, "b" * 40
+    store.save_base(old, ndvi)
+    store.link("1" * 16, old)
+    os.utime(os.path.join(tmp_path, "scenes", old), (1, 1))
+    store.save_base(new, ndvi)
+    store.link("2" * 16, new)
+    store.max_bytes = os.path.getsize(store.base_path(new)) + 1024
+    # a link of a scene removed by another worker, and one still being written
+    store.link("3" * 16, "c" * 40)
+    open(os.path.join(tmp_path, "reports", "4" * 16 + ".1.2.tmp"), "w").close()
+
+    assert store.prune() == 1
+
+    assert store.resolve("2" * 16) == new
+    assert sorted(os.listdir(tmp_path / "reports")) == ["2" * 16, "4" * 16 + ".1.2.tmp"]
@@ -0,0 +1,87 @@
+import asyncio
+import io
+import os
+import pickle
+import tempfile
+
+import numpy as np
+from starlette.datastructures import UploadFile
+
+from app.core.result_cache import input_cache_key
+from app.core.upload_spool import SpooledUpload, content_digest, read_upload
+from app.main import run_ndvi_pipeline
+
+
+def _npy(array) -> bytes:
+    buf = io.BytesIO()
+    np.save(buf, array)
+    return buf.getvalue()
+
+
+def _upload(body: bytes, name: str) -> UploadFile:
+    # what Starlette's multipart parser hands over: a spool file that rolled to disk past 1 KB here
+    file = tempfile.SpooledTemporaryFile(max_size=1024)
+    file.write(body)
+    file.seek(0)
+    return UploadFile(file, size=len(body), filename=name)
+
+
+def _mapped_count(spooled: SpooledUpload) -> int:
+    target = os.readlink(spooled.path)
+    with open("/proc/self/maps") as f:
+        return sum(1 for line in f if target in line)
+
+
+def test_large_uploads_stay_in_the_request_spool_file(tmp_path):
+    body = _npy(np.linspace(0, 1, 4096, dtype=np.float32).reshape(64, 64))
+    upload = _upload(body, "nir.npy")
+
+    spooled = asyncio.run(read_upload(upload, spool_bytes=1024, directory=str(tmp_path)))
+    small = asyncio.run(read_upload(_upload(body[:512], "small.npy"), spool_bytes=1024))
+
+    assert isinstance(spooled, SpooledUpload) and small == body[:512]
+    assert list(tmp_path.iterdir()) == []  # nothing was copied
+    assert os.path.samefile(spooled.path, f"/proc/self/fd/{upload.file.fileno()}")
+    assert spooled.digest == content_digest(body)
+    assert input_cache_key({"nir_bytes": spooled}, 0.3) == input_cache_key({"nir_bytes": body}, 0.3)
+
+    # the handle outlives the UploadFile (a refine task runs after the response)
+    upload.file.close()
+    with spooled.mapped() as buf:
+        assert bytes(buf) == body
+    remote = pickle.loads(pickle.dumps(spooled))
+    assert remote.fd is None and remote.head(6) == body[:6]
+    remote.close()  # the receiving side owns nothing
+    assert os.path.exists(spooled.path)
+
+    fd = spooled.fd
+    spooled.close()
+    spooled.close()
+    assert spooled.fd is None
+    try:
+        os.fstat(fd)
+    except OSError:
+        pass
+    else:
+        raise AssertionError("descriptor is still open")
+
+
+def test_the_pipeline_unmaps_spooled_bands_once_the_stats_are_computed():
+    rng = np.random.default_rng(3)
+    nir, red = rng.random((64, 64), dtype=np.float32), rng.random((64, 64), dtype=np.float32)
+    inputs = {
+        "nir_bytes": asyncio.run(read_upload(_upload(_npy(nir), "nir.npy"), spool_bytes=1024)),
+        "red_bytes": asyncio.run(read_upload(_upload(_npy(red), "red.npy"), spool_bytes=1024)),
+    }
+    try:
+        exact = run_ndvi_pipeline(inputs, 0.3)
+        approx = run_ndvi_pipeline(inputs, 0.3, approx="strided")
+        assert exact["valid_pixel_count"] == 64 * 64 and approx["pixel_count"] > 0
+        assert _mapped_count(inputs["nir_bytes"]) == 0
+        assert _mapped_count(inputs["red_bytes"]) == 0
+
+        in_memory = run_ndvi_pipeline({"nir_bytes": _npy(nir), "red_bytes": _npy(red)}, 0.3)
+        assert in_memory["mean_ndvi"] == exact["mean_ndvi"]
+    finally:
+        for value in inputs.values():
+            value.close()